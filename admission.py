@@ -0,0 +1,200 @@
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from functools import lru_cache
+from typing import FrozenSet, List, Optional
+
+from graphql import FieldNode, GraphQLError, OperationDefinitionNode, parse
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from json_encoding import decode_json
+from settings import (
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+    REQUEST_TIMEOUT,
+)
+
+# Root fields cheap and important enough to be admitted first and shed last
+CRITICAL_FIELDS = frozenset({"login", "me"})
+# How many SQLite VM instructions run between deadline checks
+PROGRESS_INTERVAL = 10000
+
+
+class Lane(IntEnum):
+    CRITICAL = 0
+    NORMAL = 1
+
+
+class Overloaded(Exception):
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__("Request deadline exceeded")
+
+
+# Lanes
+
+@lru_cache(maxsize=1024)
+def _root_fields(query: str, operation_name: Optional[str]) -> FrozenSet[str]:
+    try:
+        document = parse(query, no_location=True)
+    except GraphQLError:
+        return frozenset()
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        if operation_name is None or (definition.name and definition.name.value == operation_name):
+            return frozenset(
+                s.name.value for s in definition.selection_set.selections if isinstance(s, FieldNode)
+            )
+    return frozenset()
+
+
+def operation_lane(query: Optional[str], operation_name: Optional[str] = None) -> Lane:
+    """CRITICAL when every root field is critical, so `me` cannot carry a heavy query along."""
+    if not query:
+        return Lane.NORMAL
+    fields = _root_fields(query, operation_name)
+    return Lane.CRITICAL if fields and fields <= CRITICAL_FIELDS else Lane.NORMAL
+
+
+async def request_lane(request) -> Lane:
+    if request.method == "GET":
+        return operation_lane(request.query_params.get("query"), request.query_params.get("operationName"))
+    if "json" not in request.headers.get("content-type", ""):
+        return Lane.NORMAL
+    try:
+        # Starlette caches the body, so the router reads it again for free
+        data = decode_json(await request.body())
+    except ValueError:
+        return Lane.NORMAL
+    # A batch is only as critical as its least critical operation
+    operations = data if isinstance(data, list) and data else [data]
+    return max(_body_lane(operation) for operation in operations)
+
+
+def _body_lane(data) -> Lane:
+    if not isinstance(data, dict) or not isinstance(data.get("query"), str):
+        return Lane.NORMAL
+    operation_name = data.get("operationName")
+    return operation_lane(data["query"], operation_name if isinstance(operation_name, str) else None)
+
+
+# Admission
+
+class Ticket:
+    __slots__ = ("lane", "deadline")
+
+    def __init__(self, lane: Lane, deadline: float):
+        self.lane = lane
+        self.deadline = deadline  # time.monotonic(), the event loop's clock
+
+
+class AdmissionController:
+    """Caps requests in flight; the rest wait in a bounded queue, critical lane first.
+
+    A request's deadline starts when it arrives, so time spent queued is taken
+    out of its execution budget. When the queue is full a critical request
+    takes the place of the newest queued normal one.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        request_timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.in_flight = 0
+        self._waiters: List[list] = []  # heap of [lane, seq, future]
+        self._seq = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, lane: Lane = Lane.NORMAL) -> Ticket:
+        ticket = Ticket(lane, time.monotonic() + self.request_timeout)
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return ticket
+
+        if len(self._waiters) >= self.max_queue:
+            victim = self._newest_normal_waiter() if lane == Lane.CRITICAL else None
+            if victim is None:
+                raise Overloaded("Server overloaded, try again later")
+            self._remove(victim)
+            victim[2].set_exception(Overloaded("Server overloaded, try again later"))
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = [lane, next(self._seq), future]
+        heapq.heappush(self._waiters, waiter)
+        try:
+            async with asyncio.timeout(min(self.queue_timeout, self.request_timeout)):
+                await future
+        except (TimeoutError, asyncio.CancelledError) as error:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()  # the slot arrived together with the timeout; pass it on
+            elif waiter in self._waiters:
+                self._remove(waiter)
+            if isinstance(error, TimeoutError):
+                raise Overloaded("Timed out waiting for a free slot") from None
+            raise
+        return ticket
+
+    def release(self) -> None:
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                future.set_result(None)  # hand the slot over; in_flight is unchanged
+                return
+        self.in_flight -= 1
+
+    def _newest_normal_waiter(self) -> Optional[list]:
+        normal = [w for w in self._waiters if w[0] == Lane.NORMAL]
+        return max(normal, key=lambda w: w[1]) if normal else None
+
+    def _remove(self, waiter: list) -> None:
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+
+
+def create_admission_controller() -> Optional[AdmissionController]:
+    return AdmissionController() if ADMISSION_MAX_IN_FLIGHT > 0 else None
+
+
+# Deadline propagation into SQL
+#
+# A session whose info carries a "deadline" installs a SQLite progress handler
+# on its connection, so statements still running once it passes are
+# interrupted (OperationalError) instead of holding the worker. The handler is
+# removed when the connection goes back to the pool.
+
+@event.listens_for(Session, "after_begin")
+def _install_deadline(session, transaction, connection):
+    deadline = session.info.get("deadline")
+    if deadline is None:
+        return
+    driver_connection = connection.connection.driver_connection
+    if hasattr(driver_connection, "set_progress_handler"):
+        driver_connection.set_progress_handler(lambda: time.monotonic() >= deadline, PROGRESS_INTERVAL)
+        connection.connection.info["deadline_handler"] = True
+
+
+@event.listens_for(Pool, "checkin")
+def _remove_deadline(dbapi_connection, connection_record):
+    if dbapi_connection is not None and connection_record.info.pop("deadline_handler", False):
+        dbapi_connection.set_progress_handler(None, 0)
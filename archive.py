@@ -0,0 +1,402 @@
+"""Monthly archive partitions for cold posts, with their comments and likes.
+
+`python archive.py [--older-than-days 180]` moves every post whose whole
+thread went quiet before the cutoff (no edit, comment or like since) out of
+the hot tables into one SQLite file per month of `created_at`, compressed
+and read-only: ARCHIVE_DIR/posts-YYYY-MM.db.gz. Running it again adds newly
+cold threads to the month's partition. The post_archives catalog in the
+main database records each partition's post and comment id ranges.
+
+Reads stay on the hot tables unless the post or comment itself is missing
+from them: DataLoaders and the `post` / `comment` / `comments(postId)`
+lookups then retry those keys on the partitions whose id range covers them
+(children of a hot post are never looked up there, even when it has none),
+and `posts` / `feed` continue into
+the partitions, newest month first, only with `includeArchived: true`. A
+partition is decompressed into ARCHIVE_CACHE_DIR the first time it is read.
+Archived posts are no longer ranked or searchable.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Engine, create_engine, delete, event, exists, func, insert, inspect, or_, select, true
+from sqlalchemy.orm import Query, Session
+
+from comments import models as comment_models
+from likes import models as like_models
+from outbox import ChangeEvent, outbox, record
+from posts import models as post_models
+from settings import ARCHIVE_AFTER_DAYS, ARCHIVE_CACHE_DIR, ARCHIVE_CATALOG_TTL, ARCHIVE_DIR
+from tags import models as tag_models
+
+CHUNK_SIZE = 500  # ids per IN list, well below SQLite's bound parameter limit
+
+_posts = post_models.Post.__table__
+_comments = comment_models.Comment.__table__
+_likes = like_models.Like.__table__
+_post_tags = post_models.post_tags_table
+_catalog = post_models.PostArchive.__table__
+# Tags are copied whole so that tag filters still join inside a partition
+PARTITION_TABLES = [tag_models.Tag.__table__, _posts, _post_tags, _comments, _likes]
+
+
+class IdSpace(str, Enum):
+    POST = "post"
+    COMMENT = "comment"
+
+
+@dataclass(frozen=True)
+class Partition:
+    period: str
+    path: str
+    min_post_id: int
+    max_post_id: int
+    min_comment_id: Optional[int]
+    max_comment_id: Optional[int]
+    archived_at: datetime
+
+    def covers(self, space: IdSpace, key_id: int) -> bool:
+        if space == IdSpace.POST:
+            return self.min_post_id <= key_id <= self.max_post_id
+        return self.min_comment_id is not None and self.min_comment_id <= key_id <= self.max_comment_id
+
+
+# Reading
+
+class ArchiveCatalog:
+    """Process-wide copy of post_archives per database.
+
+    Reloaded when a partition is published (an outbox event, see below) or
+    after ARCHIVE_CATALOG_TTL seconds.
+    """
+
+    def __init__(self, ttl: float = ARCHIVE_CATALOG_TTL):
+        self.ttl = ttl
+        self._partitions: Dict[str, Tuple[float, List[Partition]]] = {}
+
+    def partitions(self, db: Session) -> List[Partition]:
+        """Partitions of the database `db` is bound to, newest month first."""
+        url = str(db.get_bind().url)
+        loaded = self._partitions.get(url)
+        if loaded is None or time.monotonic() - loaded[0] > self.ttl:
+            rows = db.execute(select(_catalog).order_by(_catalog.c.period.desc())).all()
+            loaded = (time.monotonic(), [
+                Partition(row.period, row.path, row.min_post_id, row.max_post_id,
+                          row.min_comment_id, row.max_comment_id, row.archived_at)
+                for row in rows
+            ])
+            self._partitions[url] = loaded
+        return loaded[1]
+
+    def route(self, db: Session, space: IdSpace, key_ids: Sequence[int]) -> Dict[Partition, List[int]]:
+        """Positions in `key_ids` by partition that may hold them."""
+        routes = defaultdict(list)
+        for partition in self.partitions(db):
+            for position, key_id in enumerate(key_ids):
+                if partition.covers(space, key_id):
+                    routes[partition].append(position)
+        return routes
+
+    def covers(self, db: Session, space: IdSpace, key_id: int) -> bool:
+        return any(partition.covers(space, key_id) for partition in self.partitions(db))
+
+    def invalidate(self) -> None:
+        self._partitions.clear()
+
+
+archive_catalog = ArchiveCatalog()
+
+
+@outbox.subscribe
+def _reload_archive_catalog(events: List[ChangeEvent]) -> None:
+    if any(change.entity == "PostArchive" for change in events):
+        archive_catalog.invalidate()
+
+_engines: Dict[Tuple[str, datetime], Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def _decompressed(partition: Partition) -> str:
+    # Named after the write it comes from, so a partition rewritten by a later run is decompressed afresh
+    cache_dir = ARCHIVE_CACHE_DIR or os.path.join(os.path.dirname(partition.path), ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"posts-{partition.period}-{partition.archived_at:%Y%m%d%H%M%S%f}.db")
+    if not os.path.exists(path):
+        partial = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(partition.path, "rb") as source, open(partial, "wb") as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+        os.replace(partial, path)  # atomic, so other workers never open a half-written file
+    return path
+
+
+def partition_engine(partition: Partition) -> Engine:
+    key = (partition.period, partition.archived_at)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            path = _decompressed(partition)
+            engine = create_engine(
+                f"sqlite:///file:{path}?mode=ro&uri=true", connect_args={"check_same_thread": False}
+            )
+            _engines[key] = engine
+    return engine
+
+
+def forget_partition_engines() -> None:
+    """Drop the cached partition engines without closing their connections (in a forked worker)."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=False)
+        _engines.clear()
+
+
+def archive_session(partition: Partition) -> Session:
+    return Session(partition_engine(partition), info={"archive": partition.period})
+
+
+@event.listens_for(Session, "loaded_as_persistent")
+def _mark_archived(session, instance):
+    if "archive" in session.info:
+        inspect(instance).info["archived"] = True
+
+
+def is_archived(entity) -> bool:
+    """Whether `entity` was read from an archive partition rather than the hot tables."""
+    return inspect(entity).info.get("archived", False)
+
+
+def loader_key_id(key) -> int:
+    # Loader keys are ids or tuples starting with one, e.g. (post_id, first)
+    return key[0] if isinstance(key, tuple) else key
+
+
+async def load_archived(db: Session, space: IdSpace, keys: list, results: list, load_fn, missing: Sequence[int]) -> list:
+    """Load the keys at positions `missing` from the partitions covering them, into `results`."""
+    if not missing:
+        return results
+    routes = archive_catalog.route(db, space, [loader_key_id(keys[position]) for position in missing])
+    for partition, positions in routes.items():
+        with archive_session(partition) as session:
+            found = await load_fn([keys[missing[position]] for position in positions], session)
+        for position, value in zip(positions, found):
+            if value:
+                results[missing[position]] = value
+    return results
+
+
+def archived_rows(query: Query, space: IdSpace, key_id: int) -> list:
+    """Rows of `query` from the first partition covering `key_id` that has any."""
+    for partition in archive_catalog.partitions(query.session):
+        if partition.covers(space, key_id):
+            with archive_session(partition) as session:
+                rows = query.with_session(session).all()
+            if rows:
+                return rows
+    return []
+
+
+def archived_children(query: Query, space: IdSpace, parent_model, parent_id: int) -> list:
+    """Rows of `query`, the children of `parent_id`, from the partitions if that parent is not in the hot tables."""
+    session = query.session
+    if not archive_catalog.covers(session, space, parent_id) or session.get(parent_model, parent_id) is not None:
+        return []
+    return archived_rows(query, space, parent_id)
+
+
+def with_archives(query: Query, include_archived: bool = True) -> Iterator[Query]:
+    """`query`, then (if asked) the same query on each partition, newest month first."""
+    yield query
+    if not include_archived:
+        return
+    for partition in archive_catalog.partitions(query.session):
+        with archive_session(partition) as session:
+            yield query.with_session(session)
+
+
+# Archiving
+
+@dataclass
+class ArchiveReport:
+    period: str
+    posts: int
+    comments: int
+    likes: int
+    compressed_bytes: int
+
+
+def chunked(ids: Sequence[int], size: int = CHUNK_SIZE) -> Iterator[Sequence[int]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def cold_posts(connection, cutoff: datetime, post_ids: Optional[Sequence[int]] = None) -> Dict[str, List[int]]:
+    """Ids of posts whose thread has been quiet since before `cutoff` (among `post_ids`, if given), by YYYY-MM of creation."""
+    comments, likes = _comments, _likes
+    recent_comment = exists().where(
+        comments.c.post_id == _posts.c.id,
+        or_(comments.c.created_at >= cutoff, comments.c.updated_at >= cutoff),
+    )
+    recent_like = exists().where(likes.c.post_id == _posts.c.id, likes.c.created_at >= cutoff)
+    recent_comment_like = exists().where(
+        likes.c.comment_id == comments.c.id, comments.c.post_id == _posts.c.id, likes.c.created_at >= cutoff
+    )
+    query = select(_posts.c.id, _posts.c.created_at).where(
+        _posts.c.created_at < cutoff,
+        or_(_posts.c.updated_at.is_(None), _posts.c.updated_at < cutoff),
+        ~recent_comment, ~recent_like, ~recent_comment_like,
+    ).order_by(_posts.c.id)
+    periods = defaultdict(list)
+    for ids in [None] if post_ids is None else chunked(post_ids):
+        chunk_query = query if ids is None else query.where(_posts.c.id.in_(ids))
+        for post_id, created_at in connection.execute(chunk_query):
+            periods[f"{created_at:%Y-%m}"].append(post_id)
+    return periods
+
+
+def _copy(source, target, table, condition) -> List[tuple]:
+    rows = source.execute(select(table).where(condition)).all()
+    if rows:
+        target.execute(insert(table).prefix_with("OR REPLACE"), [row._asdict() for row in rows])
+    return rows
+
+
+def _write_partition(hot, path: str, post_ids: List[int]) -> Tuple[List[int], dict]:
+    """Copy the threads of `post_ids` into the partition file at `path`; returns their comment ids and the partition's ranges."""
+    engine = create_engine(f"sqlite:///{path}")
+    comment_ids = []
+    try:
+        with engine.begin() as partition:
+            for table in PARTITION_TABLES:
+                table.create(partition, checkfirst=True)
+            _copy(hot, partition, tag_models.Tag.__table__, true())
+            for ids in chunked(post_ids):
+                _copy(hot, partition, _posts, _posts.c.id.in_(ids))
+                _copy(hot, partition, _post_tags, _post_tags.c.post_id.in_(ids))
+                chunk_comments = [row.id for row in _copy(hot, partition, _comments, _comments.c.post_id.in_(ids))]
+                comment_ids += chunk_comments
+                _copy(hot, partition, _likes, _likes.c.post_id.in_(ids))
+                for comment_chunk in chunked(chunk_comments):
+                    _copy(hot, partition, _likes, _likes.c.comment_id.in_(comment_chunk))
+
+            def stats(table):
+                return partition.execute(select(func.min(table.c.id), func.max(table.c.id), func.count())).one()
+            (min_post, max_post, posts), (min_comment, max_comment, comments) = stats(_posts), stats(_comments)
+            likes = partition.execute(select(func.count()).select_from(_likes)).scalar()
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as partition:
+            partition.exec_driver_sql("VACUUM")
+    finally:
+        engine.dispose()
+    return comment_ids, {
+        "min_post_id": min_post, "max_post_id": max_post, "posts": posts,
+        "min_comment_id": min_comment, "max_comment_id": max_comment, "comments": comments,
+        "likes": likes,
+    }
+
+
+def archive_period(
+    engine: Engine, period: str, post_ids: List[int], cutoff: datetime, archive_dir: str = ARCHIVE_DIR
+) -> Optional[ArchiveReport]:
+    """Move the threads of `post_ids` that are still cold into the period's partition.
+
+    The whole move holds the main database's write lock (BEGIN IMMEDIATE):
+    nothing can be commented or liked between the copy and the delete, and
+    posts that got activity since `cold_posts` listed them stay hot. Writers
+    wait for it, so run it off-peak. Returns None if no post is left to move.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(archive_dir, f"posts-{period}.db.gz"))
+    work = f"{path[:-len('.gz')]}.{os.getpid()}.work"
+
+    # Transactions are issued by hand: pysqlite would only begin one at the first write
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as hot:
+        hot.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            post_ids = cold_posts(hot, cutoff, post_ids).get(period, [])
+            if not post_ids:
+                hot.exec_driver_sql("ROLLBACK")
+                return None
+            try:
+                if os.path.exists(path):
+                    with gzip.open(path, "rb") as source, open(work, "wb") as target:
+                        shutil.copyfileobj(source, target, 1 << 20)
+                comment_ids, stats = _write_partition(hot, work, post_ids)
+                with open(work, "rb") as source, gzip.open(f"{path}.tmp", "wb") as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+                # The partition is in place before anything leaves the hot tables; a run
+                # interrupted after this point is simply repeated (rows are replaced)
+                os.replace(f"{path}.tmp", path)
+            finally:
+                if os.path.exists(work):
+                    os.remove(work)
+
+            hot.execute(delete(_catalog).where(_catalog.c.period == period))
+            hot.execute(insert(_catalog), {"period": period, "path": path, "archived_at": datetime.utcnow(), **stats})
+            # Tells the servers to reload the catalog once this commits, and evicts the
+            # cached results listing the moved rows (they are only hot rows no more)
+            record(hot, [{"entity": "PostArchive", "entity_id": None, "op": "insert", "data": {"refs": {}}}] + [
+                {"entity": entity, "entity_id": None, "op": "delete", "data": {"refs": {entity: list(ids)}}}
+                for entity, moved in (("Post", post_ids), ("Comment", comment_ids))
+                for ids in chunked(moved)
+            ] + [{"entity": "Like", "entity_id": None, "op": "delete", "data": {"refs": {}}}])
+            for ids in chunked(comment_ids):
+                hot.execute(delete(_likes).where(_likes.c.comment_id.in_(ids)))
+            for ids in chunked(post_ids):
+                hot.execute(delete(_likes).where(_likes.c.post_id.in_(ids)))
+                hot.execute(delete(_post_tags).where(_post_tags.c.post_id.in_(ids)))
+                hot.execute(delete(post_models.PostScore.__table__).where(post_models.PostScore.post_id.in_(ids)))
+                hot.execute(delete(_comments).where(_comments.c.post_id.in_(ids)))
+                hot.execute(delete(_posts).where(_posts.c.id.in_(ids)))
+        except BaseException:
+            hot.exec_driver_sql("ROLLBACK")
+            raise
+        hot.exec_driver_sql("COMMIT")
+    return ArchiveReport(period, len(post_ids), len(comment_ids), stats["likes"], os.path.getsize(path))
+
+
+def run_archive(engine: Engine, cutoff: datetime, archive_dir: str = ARCHIVE_DIR) -> List[ArchiveReport]:
+    with engine.connect() as connection:
+        periods = cold_posts(connection, cutoff)
+    reports = [archive_period(engine, period, post_ids, cutoff, archive_dir) for period, post_ids in sorted(periods.items())]
+    archive_catalog.invalidate()
+    return [report for report in reports if report is not None]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--vacuum", action="store_true", help="reclaim the freed space of the main database afterwards")
+    args = parser.parse_args(argv)
+
+    from database import Base, engine, shard_map
+
+    if shard_map.enabled:
+        parser.error("posts are on the shards in SHARD_URLS; archiving reads the main database only")
+
+    Base.metadata.create_all(bind=engine)
+    cutoff = datetime.utcnow() - timedelta(days=args.older_than_days)
+    started = time.perf_counter()
+    reports = run_archive(engine, cutoff, args.archive_dir)
+    if args.vacuum and reports:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+
+    print(f"{'period':<10}{'posts':>8}{'comments':>10}{'likes':>10}{'size':>10}")
+    for report in reports:
+        print(f"{report.period:<10}{report.posts:>8}{report.comments:>10}{report.likes:>10}{report.compressed_bytes / 2 ** 20:>8.1f}MB")
+    print(f"\n{sum(r.posts for r in reports)} posts archived before {cutoff:%Y-%m-%d} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -38,24 +38,30 @@ def verify_token(token: str) -> Optional[dict]:
         return None
 
 
-async def get_current_user(authorization: Optional[str], db: Session) -> Optional[user_models.User]:
+def token_user_id(authorization: Optional[str]) -> Optional[int]:
+    """The user id a bearer token was issued to, without touching the database."""
     if not authorization:
         return None
-    
+
     try:
         scheme, token = authorization.split()
         if scheme.lower() != "bearer":
             return None
-        
+
         payload = verify_token(token)
         if not payload:
             return None
-        
+
         user_id = payload.get("sub")
         if not user_id:
             return None
-        
-        user = db.query(user_models.User).filter(user_models.User.id == int(user_id)).first()
-        return user
+        return int(user_id)
     except Exception:
-        return None
\ No newline at end of file
+        return None
+
+
+async def get_current_user(authorization: Optional[str], db: Session) -> Optional[user_models.User]:
+    user_id = token_user_id(authorization)
+    if user_id is None:
+        return None
+    return db.query(user_models.User).filter(user_models.User.id == user_id).first()
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""Measure archive.py: hot query latency and database size before and after
+archiving, the archive job itself, and reads routed to a partition.
+
+Fills a temporary database with a year of posts (with comments and likes),
+then archives everything older than 30 days.
+
+Usage: python benchmarks/bench_archive.py [posts per month] [runs]   (default 10000 50)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from archive import archive_catalog, run_archive
+from comments.models import Comment
+from database import Base
+from likes.models import Like
+from main import Context, schema
+from posts.models import Post
+from users.models import User, follows_table
+
+MONTHS = 12
+USERS = 200
+CHUNK = 50000
+FEED = "{ feed(first: 50) { id content likesCount comments { content } } }"
+ARCHIVED = "{{ post(id: {id}) {{ content likesCount comments {{ content }} }} }}"
+
+
+def build_database(engine, per_month: int) -> int:
+    """Returns the id of a post from the oldest month."""
+    now = datetime.utcnow()
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"} for i in range(1, USERS + 1)
+        ])
+        connection.execute(follows_table.insert(), [{"follower_id": 1, "following_id": i} for i in range(2, 52)])
+        total = MONTHS * per_month
+        step = timedelta(days=30 * MONTHS) / total
+        for start in range(0, total, CHUNK):
+            ids = range(start + 1, min(total, start + CHUNK) + 1)
+            # Oldest first, so ids grow with created_at as they would in production
+            created = {i: now - timedelta(days=30 * MONTHS) + step * i for i in ids}
+            connection.execute(Post.__table__.insert(), [
+                {"id": i, "author_id": i % USERS + 1, "content": f"post {i}", "created_at": created[i], "updated_at": created[i]}
+                for i in ids
+            ])
+            connection.execute(Comment.__table__.insert(), [
+                {"post_id": i, "author_id": (i + k) % USERS + 1, "content": f"comment {k}", "created_at": created[i], "updated_at": created[i]}
+                for i in ids for k in range(2)
+            ])
+            connection.execute(Like.__table__.insert(), [
+                {"post_id": i, "user_id": (i + k) % USERS + 1, "created_at": created[i]} for i in ids for k in range(5)
+            ])
+    return 1
+
+
+async def timed(engine, query: str, runs: int) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        with Session(engine) as db:
+            result = await schema.execute(query, context_value=Context(db=db, user=db.get(User, 1)))
+        assert not result.errors, result.errors
+    return (time.perf_counter() - started) / runs
+
+
+def main():
+    per_month = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        old_post = build_database(engine, per_month)
+        print(f"{MONTHS * per_month} posts over {MONTHS} months, 2 comments and 5 likes each\n")
+
+        size_before = os.path.getsize(path)
+        feed_before = asyncio.run(timed(engine, FEED, runs))
+
+        started = time.perf_counter()
+        reports = run_archive(engine, datetime.utcnow() - timedelta(days=30), os.path.join(tmp, "archive"))
+        job = time.perf_counter() - started
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+        archived = sum(report.posts for report in reports)
+        compressed = sum(report.compressed_bytes for report in reports)
+        size_after = os.path.getsize(path)
+        feed_after = asyncio.run(timed(engine, FEED, runs))
+
+        archive_catalog.invalidate()
+        first_read = asyncio.run(timed(engine, ARCHIVED.format(id=old_post), 1))
+        warm_read = asyncio.run(timed(engine, ARCHIVED.format(id=old_post), runs))
+
+        print(f"archive job        {archived} posts in {len(reports)} partitions, {job:.1f}s ({archived / job:.0f} posts/s)")
+        print(f"main database      {size_before / 2 ** 20:.0f}MB -> {size_after / 2 ** 20:.0f}MB (partitions {compressed / 2 ** 20:.1f}MB compressed)")
+        print(f"feed(first: 50)    {feed_before * 1000:.1f}ms -> {feed_after * 1000:.1f}ms")
+        print(f"archived post      {first_read * 1000:.1f}ms first read (decompresses), {warm_read * 1000:.1f}ms after")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare an app-shell screen load sent as separate POSTs and as one batch.
+
+Both variants run the same operations concurrently against the app in
+process (no network); SQL statements are counted per screen load.
+
+Usage: python benchmarks/bench_batching.py [screen loads]   (default 200)
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import event
+
+from auth import create_access_token
+from database import engine
+from main import app, init_storage
+
+SCREEN = [
+    {"query": "{ me { id username avatarUrl } }"},
+    {"query": "{ feed { id content author { username } likesCount } }"},
+    {"query": "{ tags { id name } }"},
+    {"query": "{ trendingPosts(first: 5) { id content author { username } } }"},
+    {"query": "{ followSuggestions(first: 5) { id username } }"},
+    {"query": "{ me { followers { id username } following { id username } } }"},
+    {"query": "{ posts { id author { username } } }"},
+]
+
+
+async def separate(client, headers):
+    responses = await asyncio.gather(*(client.post("/graphql", json=op, headers=headers) for op in SCREEN))
+    for response in responses:
+        response.raise_for_status()
+
+
+async def batched(client, headers):
+    response = await client.post("/graphql", json=SCREEN, headers=headers)
+    response.raise_for_status()
+
+
+async def measure(variant, loads: int, headers: dict):
+    statements = 0
+
+    def count(*_args):
+        nonlocal statements
+        statements += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await variant(client, headers)  # warm up
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            started = time.perf_counter()
+            for _ in range(loads):
+                await variant(client, headers)
+            elapsed = time.perf_counter() - started
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+    return elapsed / loads, statements / loads
+
+
+def main():
+    loads = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    init_storage()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "1"}, timedelta(hours=1))}
+
+    print(f"{len(SCREEN)} operations per screen load, {loads} loads\n")
+    print(f"{'variant':<12}{'per load':>12}{'SQL/load':>10}")
+    for name, variant in (("separate", separate), ("batched", batched)):
+        seconds, statements = asyncio.run(measure(variant, loads, headers))
+        print(f"{name:<12}{seconds * 1000:>10.2f}ms{statements:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
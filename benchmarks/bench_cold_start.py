@@ -0,0 +1,58 @@
+"""Measure cold start: importing the app, serving the first request, collecting tests.
+
+Each step runs in a fresh interpreter; the median of several runs is reported.
+
+Usage: python benchmarks/bench_cold_start.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8766
+
+
+def run(args) -> float:
+    started = time.perf_counter()
+    subprocess.run(args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def first_response() -> float:
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                httpx.post(f"http://127.0.0.1:{PORT}/graphql", json={"query": "{ __typename }"}).raise_for_status()
+                return time.perf_counter() - started
+            except httpx.TransportError:
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    steps = [
+        ("import main", lambda: run([sys.executable, "-c", "import main"])),
+        ("first response", first_response),
+        ("pytest --collect-only", lambda: run([sys.executable, "-m", "pytest", "--collect-only", "-q"])),
+    ]
+    for name, step in steps:
+        times = [step() for _ in range(runs)]
+        print(f"{name:<24}{statistics.median(times) * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
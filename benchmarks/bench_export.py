@@ -0,0 +1,81 @@
+"""Compare streaming NDJSON export with materializing the whole table first.
+
+Fills a temporary database with synthetic likes and reports throughput and
+peak Python memory (tracemalloc) of each approach.
+
+Usage: python benchmarks/bench_export.py [rows]   (default 1000000)
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from database import Base
+from users import models as user_models  # noqa: F401 - register tables
+from posts import models as post_models  # noqa: F401
+from comments import models as comment_models  # noqa: F401
+from likes import models as like_models
+from tags import models as tag_models  # noqa: F401
+from export import ExportTable, export_query, iter_ndjson
+from json_encoding import encode_json
+
+CHUNK = 200000
+
+
+def streamed(connection) -> int:
+    written = 0
+    for chunk in iter_ndjson(connection, ExportTable.LIKES):
+        written += len(chunk)
+    return written
+
+
+def materialized(connection) -> int:
+    # What one giant query response amounts to: every row in memory, then one document
+    result = connection.execute(export_query(ExportTable.LIKES))
+    keys = [str(key) for key in result.keys()]
+    rows = [dict(zip(keys, row)) for row in result.all()]
+    return len(encode_json(rows))
+
+
+def measure(fn, engine):
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        written = fn(connection)
+        elapsed = time.perf_counter() - started
+    # Traced separately: tracemalloc slows allocation-heavy code down
+    with engine.connect() as connection:
+        tracemalloc.start()
+        fn(connection)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak, written
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    now = datetime(2024, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            for start in range(0, rows, CHUNK):
+                conn.execute(like_models.Like.__table__.insert(), [
+                    {"user_id": i % 1000 + 1, "post_id": i % 50000 + 1, "created_at": now}
+                    for i in range(start, min(rows, start + CHUNK))
+                ])
+
+        print(f"{rows} likes\n")
+        print(f"{'approach':<14}{'rows/s':>12}{'peak memory':>14}{'output':>10}")
+        for name, fn in (("streamed", streamed), ("materialized", materialized)):
+            elapsed, peak, written = measure(fn, engine)
+            print(f"{name:<14}{rows / elapsed:>12.0f}{peak / 2 ** 20:>12.1f}MB{written / 2 ** 20:>8.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Compare SQL joins with the in-memory follow graph on a synthetic graph.
+
+Every user follows a handful of random accounts plus a few celebrities, so
+each celebrity has one follower per user.
+
+Usage: python benchmarks/bench_follow_graph.py [users]   (default 1000000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+
+from database import Base
+from users import models as user_models
+from posts import models as post_models  # noqa: F401 - register tables
+from comments import models as comment_models  # noqa: F401
+from likes import models as like_models  # noqa: F401
+from tags import models as tag_models  # noqa: F401
+from users.follow_graph import FollowGraph
+
+CELEBRITIES = 3
+FOLLOWS_PER_USER = 10
+CHUNK = 200000
+
+MUTUAL_SQL = text(
+    "SELECT a.following_id FROM follows a JOIN follows b ON b.follower_id = a.following_id "
+    "WHERE a.follower_id = :viewer AND b.following_id = :user ORDER BY a.following_id"
+)
+SUGGESTIONS_SQL = text(
+    "SELECT b.following_id, COUNT(*) AS n FROM follows a JOIN follows b ON b.follower_id = a.following_id "
+    "WHERE a.follower_id = :viewer AND b.following_id != :viewer AND b.following_id NOT IN "
+    "(SELECT following_id FROM follows WHERE follower_id = :viewer) "
+    "GROUP BY b.following_id ORDER BY n DESC, b.following_id LIMIT 10"
+)
+IS_FOLLOWING_SQL = text("SELECT following_id FROM follows WHERE follower_id = :viewer AND following_id IN ({ids})")
+
+
+def generate_edges(users: int):
+    rng = random.Random(42)
+    edges = set()
+    for user_id in range(1, users + 1):
+        for celebrity in range(1, CELEBRITIES + 1):
+            if user_id != celebrity:
+                edges.add((user_id, celebrity))
+        for _ in range(FOLLOWS_PER_USER):
+            other = rng.randint(1, users)
+            if other != user_id:
+                edges.add((user_id, other))
+    return sorted(edges)
+
+
+def timed(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    edges = generate_edges(users)
+    print(f"{users} users, {len(edges)} follows, {CELEBRITIES} accounts with {users - 1} followers\n")
+
+    started = time.perf_counter()
+    graph = FollowGraph(edges)
+    print(f"graph built in {time.perf_counter() - started:.1f}s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            for start in range(0, len(edges), CHUNK):
+                conn.execute(
+                    user_models.follows_table.insert(),
+                    [{"follower_id": a, "following_id": b} for a, b in edges[start:start + CHUNK]],
+                )
+
+        viewer = users // 2
+        probe_ids = list(range(1, 101))
+        cases = [
+            ("mutualFollowers(celebrity)",
+             lambda conn: conn.execute(MUTUAL_SQL, {"viewer": viewer, "user": 1}).all(),
+             lambda: graph.mutual_followers(viewer, 1)),
+            ("mutualFollowers(user)",
+             lambda conn: conn.execute(MUTUAL_SQL, {"viewer": viewer, "user": viewer + 1}).all(),
+             lambda: graph.mutual_followers(viewer, viewer + 1)),
+            ("followSuggestions(10)",
+             lambda conn: conn.execute(SUGGESTIONS_SQL, {"viewer": viewer}).all(),
+             lambda: graph.suggestions(viewer, 10)),
+            ("isFollowing(100 ids)",
+             lambda conn: conn.execute(
+                 text(IS_FOLLOWING_SQL.text.format(ids=",".join(map(str, probe_ids)))), {"viewer": viewer}
+             ).all(),
+             lambda: [graph.is_following(viewer, i) for i in probe_ids]),
+        ]
+
+        print(f"\n{'query':<28}{'sql':>12}{'graph':>12}{'speedup':>10}")
+        with engine.connect() as conn:
+            for name, sql, in_memory in cases:
+                sql_time = timed(lambda: sql(conn))
+                graph_time = timed(in_memory)
+                print(f"{name:<28}{sql_time * 1000:>10.2f}ms{graph_time * 1000:>10.3f}ms{sql_time / graph_time:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measure bulk_import.py throughput on synthetic NDJSON files.
+
+Generates users, posts, likes and follows (likes dominate), then imports
+them into a fresh database with and without --defer-indexes.
+
+Usage: python benchmarks/bench_import.py [likes]   (default 1000000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from bulk_import import run_import
+from json_encoding import encode_json
+
+
+def write_ndjson(path: str, rows) -> None:
+    with open(path, "wb") as f:
+        for row in rows:
+            f.write(encode_json(row) + b"\n")
+
+
+def generate(directory: str, likes: int) -> dict:
+    rng = random.Random(42)
+    users, posts = max(likes // 100, 10), max(likes // 10, 10)
+    files = {name: os.path.join(directory, f"{name}.ndjson") for name in ("users", "posts", "likes", "follows")}
+    write_ndjson(files["users"], (
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"} for i in range(1, users + 1)
+    ))
+    write_ndjson(files["posts"], (
+        {"author_id": rng.randint(1, users), "content": f"post {i} about graphql and python"} for i in range(posts)
+    ))
+    write_ndjson(files["likes"], (
+        {"user_id": rng.randint(1, users), "post_id": rng.randint(1, posts)} for _ in range(likes)
+    ))
+    write_ndjson(files["follows"], (
+        {"follower_id": i, "following_id": i % users + 1} for i in range(1, users + 1)
+    ))
+    return files
+
+
+def main():
+    likes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as tmp:
+        files = generate(tmp, likes)
+        print(f"{'mode':<16}{'table':<10}{'rows':>10}{'rows/s':>10}")
+        for defer_indexes in (False, True):
+            mode = "defer indexes" if defer_indexes else "indexes live"
+            engine = create_engine(f"sqlite:///{tmp}/{mode.replace(' ', '_')}.db")
+            started = time.perf_counter()
+            reports = run_import(engine, files, defer_indexes=defer_indexes)
+            elapsed = time.perf_counter() - started
+            for report in reports:
+                print(f"{mode:<16}{report.name:<10}{report.inserted:>10}{report.rows_per_second:>10.0f}")
+            total = sum(report.inserted for report in reports)
+            print(f"{mode:<16}{'total':<10}{total:>10}{total / elapsed:>10.0f}   ({total / elapsed * 60 / 1e6:.1f}M rows/min end to end)\n")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Measure memory of the GraphQL output types and of a large list response.
+
+Per-object bytes (tracemalloc) of each slotted output type are compared with
+an equivalent regular dataclass, the layout the types had before. Then a
+`posts { likes { ... } }` query over a synthetic database runs in a fresh
+process, reporting peak RSS and how many output objects it built.
+
+Usage: python benchmarks/bench_output_memory.py [posts] [likes per post]   (default 2000 100)
+"""
+import asyncio
+import dataclasses
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Context, schema  # builds the schema, resolving lazy types
+from comments.schemas import Comment
+from likes.schemas import Like
+from posts.schemas import Post
+from tags.schemas import Tag
+from users.schemas import User
+
+SAMPLE = 100000
+QUERY = "{ posts { id content likes { id userId createdAt } } }"
+NOW = datetime(2024, 1, 1)
+VALUES = {int: 1, str: "text", datetime: NOW}
+
+
+def bytes_per_object(cls, kwargs) -> float:
+    tracemalloc.start()
+    objects = [cls(**kwargs) for _ in range(SAMPLE)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size / SAMPLE - 8  # minus the list slot
+
+
+def per_object_sizes():
+    print(f"{'type':<10}{'dataclass':>12}{'slotted':>10}{'saved':>8}")
+    for cls in (Post, Comment, Like, User, Tag):
+        fields = [(name, cls.__annotations__[name]) for name in cls.__slots__]
+        kwargs = {name: VALUES.get(annotation, None) for name, annotation in fields}
+        plain = dataclasses.make_dataclass(f"Plain{cls.__name__}", fields, kw_only=True)
+        before, after = bytes_per_object(plain, kwargs), bytes_per_object(cls, kwargs)
+        print(f"{cls.__name__:<10}{before:>10.0f} B{after:>8.0f} B{1 - after / before:>8.0%}")
+
+
+def build_database(path: str, posts: int, likes_per_post: int) -> None:
+    from sqlalchemy import create_engine
+    from database import Base
+    from likes.models import Like as LikeModel
+    from posts.models import Post as PostModel
+    from users.models import User as UserModel
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(UserModel.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"} for i in range(1, 101)
+        ])
+        connection.execute(PostModel.__table__.insert(), [
+            {"author_id": i % 100 + 1, "content": f"post {i}", "created_at": NOW, "updated_at": NOW} for i in range(posts)
+        ])
+        connection.execute(LikeModel.__table__.insert(), [
+            {"user_id": i % 100 + 1, "post_id": i // likes_per_post + 1, "created_at": NOW}
+            for i in range(posts * likes_per_post)
+        ])
+    engine.dispose()
+
+
+def run_query(path: str) -> None:
+    """Child process: execute QUERY once and print peak RSS growth."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from users.models import User as UserModel
+
+    counts = {}
+    for cls in (Post, Like):
+        original = cls.from_db_model
+
+        def counting(row, original=original, name=cls.__name__):
+            counts[name] = counts.get(name, 0) + 1
+            return original(row)
+        cls.from_db_model = staticmethod(counting)
+
+    engine = create_engine(f"sqlite:///{path}")
+    with Session(engine) as db:
+        context = Context(db=db, user=db.get(UserModel, 1))
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        result = asyncio.run(schema.execute(QUERY, context_value=context))
+        elapsed = time.perf_counter() - started
+        assert not result.errors, result.errors
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    objects = ", ".join(f"{count} {name}" for name, count in counts.items())
+    print(f"{elapsed:.2f}s, peak RSS +{(peak - baseline) / 1024:.0f}MB, output objects: {objects}")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--run-query":
+        run_query(sys.argv[2])
+        return
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    likes_per_post = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    per_object_sizes()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        build_database(path, posts, likes_per_post)
+        print(f"\n{posts} posts x {likes_per_post} likes: {QUERY}")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--run-query", path], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compare the DataLoader path with QueryPlannerExtension on nested post lists.
+
+Fills a temporary database (posts with tags, comments and likes) and runs
+each query through a schema without and with the planner, reporting time
+and SQL statements per query (the better of two alternating rounds, so drift
+hits both paths alike). SQLite round trips cost next to nothing; pass a
+latency to add that many milliseconds per statement, as a database server
+over the network would. `posts` spans several pages and is left to the
+loaders (see query_planner.py), so both paths should match there.
+
+Usage: python benchmarks/bench_query_planner.py [posts] [runs] [latency ms]   (default 2000 20 0)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import strawberry
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from cache_control import CacheControlExtension
+from comments.models import Comment
+from database import Base
+from likes.models import Like
+from main import Context, Mutation, Query
+from posts.models import Post, post_tags_table
+from query_planner import QueryPlannerExtension
+from tags.models import Tag
+from users.models import User, follows_table
+
+USERS = 100
+POST_FIELDS = "id content author { username } tags { name } likesCount comments { content author { username } }"
+QUERIES = {
+    "posts": f"{{ posts {{ {POST_FIELDS} }} }}",
+    "feed": f"{{ feed(first: 100) {{ {POST_FIELDS} }} }}",
+    "user": f"{{ user(id: 2) {{ username posts {{ {POST_FIELDS} }} }} }}",
+}
+
+
+def build_database(engine, posts: int) -> None:
+    now = datetime(2024, 1, 1)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"} for i in range(1, USERS + 1)
+        ])
+        connection.execute(Tag.__table__.insert(), [{"name": f"tag{i}"} for i in range(20)])
+        connection.execute(follows_table.insert(), [{"follower_id": 1, "following_id": i} for i in range(2, 52)])
+        connection.execute(Post.__table__.insert(), [
+            {"author_id": i % USERS + 1, "content": f"post {i}", "created_at": now, "updated_at": now} for i in range(posts)
+        ])
+        connection.execute(post_tags_table.insert(), [
+            {"post_id": p, "tag_id": (p + k) % 20 + 1} for p in range(1, posts + 1) for k in range(3)
+        ])
+        connection.execute(Comment.__table__.insert(), [
+            {"post_id": p, "author_id": (p * 7 + k) % USERS + 1, "content": f"comment {k}", "created_at": now, "updated_at": now}
+            for p in range(1, posts + 1) for k in range(5)
+        ])
+        connection.execute(Like.__table__.insert(), [
+            {"post_id": p, "user_id": (p + k) % USERS + 1, "created_at": now} for p in range(1, posts + 1) for k in range(20)
+        ])
+
+
+async def measure(schema, engine, query: str, runs: int, latency: float = 0.0):
+    statements = 0
+
+    def count(*_args):
+        nonlocal statements
+        statements += 1
+        if latency:
+            time.sleep(latency)
+
+    async def run():
+        with Session(engine) as db:
+            result = await schema.execute(query, context_value=Context(db=db, user=db.get(User, 1)))
+        assert not result.errors, result.errors
+        return result.data
+
+    data = await run()  # warm up
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        started = time.perf_counter()
+        for _ in range(runs):
+            await run()
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return data, elapsed / runs, statements / runs
+
+
+def main():
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    schemas = {
+        "loaders": strawberry.Schema(query=Query, mutation=Mutation, extensions=[CacheControlExtension]),
+        "planned": strawberry.Schema(query=Query, mutation=Mutation, extensions=[CacheControlExtension, QueryPlannerExtension]),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        build_database(engine, posts)
+
+        print(f"{posts} posts, 3 tags, 5 comments and 20 likes each; {runs} runs, {latency * 1000:g}ms per statement\n")
+        print(f"{'query':<8}{'path':<10}{'per query':>12}{'SQL/query':>11}")
+        for name, query in QUERIES.items():
+            results, best = {}, {}
+            for _ in range(2):
+                for path, schema in schemas.items():
+                    data, seconds, statements = asyncio.run(measure(schema, engine, query, runs, latency))
+                    results[path] = data
+                    best[path] = min(best.get(path, (seconds, statements)), (seconds, statements))
+            for path, (seconds, statements) in best.items():
+                print(f"{name:<8}{path:<10}{seconds * 1000:>10.1f}ms{statements:>11.1f}")
+            assert results["loaders"] == results["planned"], f"{name}: planned result differs"
+
+
+if __name__ == "__main__":
+    main()
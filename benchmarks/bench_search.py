@@ -0,0 +1,71 @@
+"""Compare LIKE scans with the FTS5 search index on a synthetic corpus.
+
+Usage: python benchmarks/bench_search.py [posts]   (e.g. 3000000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from database import Base
+from users import models as user_models  # noqa: F401 - register tables
+from posts import models as post_models
+from comments import models as comment_models  # noqa: F401
+from likes import models as like_models  # noqa: F401
+from tags import models as tag_models  # noqa: F401
+from search import models as search_models  # noqa: F401
+from search.resolvers import build_match_expression, search_ids
+
+VOCABULARY = [f"word{i}" for i in range(20000)] + ["graphql", "python", "strawberry", "sqlite"]
+CHUNK = 50000
+
+
+def populate(engine, posts: int) -> None:
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'bench@example.com', 'x')"))
+        for start in range(0, posts, CHUNK):
+            rows = [
+                {"author_id": 1, "content": " ".join(rng.choices(VOCABULARY, k=25))}
+                for _ in range(min(CHUNK, posts - start))
+            ]
+            conn.execute(post_models.Post.__table__.insert(), rows)
+
+
+def timed(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+
+        started = time.perf_counter()
+        populate(engine, posts)
+        elapsed = time.perf_counter() - started
+        print(f"indexed {posts} posts in {elapsed:.1f}s ({posts / elapsed:,.0f} rows/s)\n")
+
+        with Session(engine) as db:
+            for term in ("graphql", "word12345", "word1234"):
+                like = timed(lambda: db.execute(
+                    text("SELECT id FROM posts WHERE content LIKE :q ORDER BY id LIMIT 20"), {"q": f"%{term}%"}
+                ).all(), repeat=3)
+                fts = timed(lambda: search_ids(db, build_match_expression(term), ["post"], 20))
+                print(f"{term!r:<14} LIKE {like * 1000:9.1f} ms   FTS5 (bm25, prefix) {fts * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
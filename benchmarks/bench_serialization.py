@@ -0,0 +1,86 @@
+"""Compare response serialization paths on a large nested `posts` result.
+
+Usage: python benchmarks/bench_serialization.py [posts] [comments_per_post] [likes_per_post]
+"""
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_encoding import orjson, orjson_encode, stdlib_encode
+
+
+def build_result(posts: int, comments: int, likes: int) -> dict:
+    now = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    return {
+        "data": {
+            "posts": [
+                {
+                    "id": p,
+                    "content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 3,
+                    "createdAt": now - timedelta(minutes=p),
+                    "updatedAt": now - timedelta(minutes=p),
+                    "author": {"id": p % 50, "username": f"user{p % 50}"},
+                    "comments": [
+                        {
+                            "id": p * comments + c,
+                            "content": "Nice post!",
+                            "createdAt": now - timedelta(seconds=c),
+                            "author": {"username": f"user{c % 50}"},
+                        }
+                        for c in range(comments)
+                    ],
+                    "likes": [
+                        {"id": p * likes + l, "createdAt": now - timedelta(seconds=l), "user": {"username": f"user{l % 50}"}}
+                        for l in range(likes)
+                    ],
+                }
+                for p in range(posts)
+            ]
+        }
+    }
+
+
+def stringify_datetimes(value):
+    # What the built-in DateTime scalar does during execution
+    if isinstance(value, dict):
+        return {k: stringify_datetimes(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [stringify_datetimes(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def main():
+    args = [int(a) for a in sys.argv[1:4]]
+    posts, comments, likes = args + [1000, 20, 30][len(args):]
+    native = build_result(posts, comments, likes)
+    stringified = stringify_datetimes(native)
+
+    paths = {
+        # Datetimes already stringified by the scalar; this excludes the
+        # per-field isoformat cost, so the speedups below are conservative.
+        "baseline (json.dumps)": lambda: json.dumps(stringified, separators=(",", ":")).encode(),
+        "stdlib encoder (native datetime)": lambda: stdlib_encode(native),
+    }
+    if orjson is not None:
+        paths["orjson encoder (native datetime)"] = lambda: orjson_encode(native)
+    else:
+        print("orjson not installed; install the `speedups` extra to compare it\n")
+
+    size = len(json.dumps(stringified, separators=(",", ":")))
+    print(f"{posts} posts x {comments} comments x {likes} likes, {size / 1e6:.1f} MB of JSON\n")
+    baseline = None
+    for name, fn in paths.items():
+        runs = 5
+        best = min(timeit.repeat(fn, number=1, repeat=runs))
+        baseline = baseline or best
+        print(f"{name:<38} {best * 1000:8.1f} ms  x{baseline / best:.1f}")
+
+
+if __name__ == "__main__":
+    main()
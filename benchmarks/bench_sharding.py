@@ -0,0 +1,143 @@
+"""Compare one database with the same data split over shards by reshard.py.
+
+Fills a temporary main database, then measures nested read queries and
+concurrent writers (threads committing one like at a time) before and after
+splitting it into N shard files.
+
+Usage: python benchmarks/bench_sharding.py [shards] [posts] [writers]   (default 4 20000 8)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from comments.models import Comment
+from database import Base, Shards, shard_map
+from likes.models import Like
+from main import Context, schema
+from posts.models import Post
+from reshard import reshard
+from users.models import User, follows_table
+
+USERS = 200
+RUNS = 20
+WRITE_SECONDS = 3
+QUERIES = {
+    "feed": "{ feed(first: 50) { content author { username } likesCount comments { content author { username } } } }",
+    "user posts": "{ posts(authorId: 7) { content likesCount likes(first: 3) { userId } } }",
+}
+
+
+def build_database(engine, posts: int) -> None:
+    start = datetime(2024, 1, 1)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"} for i in range(1, USERS + 1)
+        ])
+        connection.execute(follows_table.insert(), [{"follower_id": 1, "following_id": i} for i in range(2, 52)])
+        connection.execute(Post.__table__.insert(), [
+            {"author_id": i % USERS + 1, "content": f"post {i}", "created_at": start + timedelta(minutes=i)} for i in range(posts)
+        ])
+        connection.execute(Comment.__table__.insert(), [
+            {"post_id": p, "author_id": (p + k) % USERS + 1, "content": f"comment {k}", "created_at": start}
+            for p in range(1, posts + 1) for k in range(3)
+        ])
+        connection.execute(Like.__table__.insert(), [
+            {"post_id": p, "user_id": (p + k) % USERS + 1, "created_at": start} for p in range(1, posts + 1) for k in range(10)
+        ])
+
+
+async def read_latency(main, query: str) -> float:
+    async def run():
+        with Session(main) as db:
+            context = Context(db=db, user=db.get(User, 1))
+            result = await schema.execute(query, context_value=context)
+            context.shards.close()
+        assert not result.errors, result.errors
+
+    await run()  # warm up
+    started = time.perf_counter()
+    for _ in range(RUNS):
+        await run()
+    return (time.perf_counter() - started) / RUNS
+
+
+def write_throughput(main, post_ids, writers: int) -> float:
+    """Commits per second of `writers` threads each liking posts one transaction at a time."""
+    commits = [0] * writers
+    deadline = time.perf_counter() + WRITE_SECONDS
+
+    def write(index: int):
+        with Session(main) as db:
+            shards = Shards(db)
+            n = index
+            while time.perf_counter() < deadline:
+                post_id = post_ids[n % len(post_ids)]
+                session = shards.for_id(post_id)
+                session.add(Like(post_id=post_id, user_id=index + 1))
+                session.commit()
+                commits[index] += 1
+                n += writers
+            shards.close()
+
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(commits) / WRITE_SECONDS
+
+
+def post_ids(engines):
+    ids = []
+    for engine in engines:
+        with engine.connect() as connection:
+            ids.extend(connection.execute(Post.__table__.select().with_only_columns(Post.id).limit(5000)).scalars())
+    return ids
+
+
+def main():
+    shards = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    posts = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    with tempfile.TemporaryDirectory() as tmp:
+        main_engine = create_engine(f"sqlite:///{tmp}/main.db", connect_args={"check_same_thread": False})
+        build_database(main_engine, posts)
+        print(f"{posts} posts, 3 comments and 10 likes each; {writers} writer threads\n")
+
+        results = {}
+        for name, query in QUERIES.items():
+            results[name] = [asyncio.run(read_latency(main_engine, query))]
+        results["likes/s"] = [write_throughput(main_engine, post_ids([main_engine]), writers)]
+
+        started = time.perf_counter()
+        urls = [f"sqlite:///{tmp}/shard{index}.db" for index in range(shards)]
+        reshard(main_engine, [], urls)
+        shard_map.configure(urls)
+        split = time.perf_counter() - started
+
+        for name, query in QUERIES.items():
+            results[name].append(asyncio.run(read_latency(main_engine, query)))
+        results["likes/s"].append(write_throughput(main_engine, post_ids(shard_map.engines), writers))
+        shard_map.configure([])
+
+        print(f"{'':<12}{'one database':>14}{f'{shards} shards':>12}")
+        for name in QUERIES:
+            one, sharded = results[name]
+            print(f"{name:<12}{one * 1000:>12.1f}ms{sharded * 1000:>10.1f}ms")
+        one, sharded = results["likes/s"]
+        print(f"{'likes/s':<12}{one:>14.0f}{sharded:>12.0f}")
+        print(f"\nreshard.py split in {split:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure request throughput of serve.py as the number of workers grows.
+
+Starts the server with 1, 2, 4, ... workers (up to the CPU count) and drives
+it with concurrent authenticated GraphQL requests for a few seconds each.
+
+Usage: python benchmarks/bench_workers.py [seconds] [concurrency]
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from auth import create_access_token
+
+PORT = 8765
+QUERY = "query { posts { id content author { username } tags { name } likesCount } }"
+
+
+def start_server(workers: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(PORT), "--host", "127.0.0.1"],
+        cwd=ROOT,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{PORT}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+async def drive(seconds: float, concurrency: int, headers: dict) -> int:
+    done = 0
+    deadline = time.monotonic() + seconds
+
+    async def client_loop(client):
+        nonlocal done
+        while time.monotonic() < deadline:
+            response = await client.post("/graphql", json={"query": QUERY}, headers=headers)
+            response.raise_for_status()
+            done += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=30) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return done
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "1"}, timedelta(hours=1))}
+
+    cpus = os.cpu_count() or 1
+    counts = sorted({1, *(2 ** i for i in range(1, 6) if 2 ** i <= cpus), cpus})
+    print(f"{cpus} CPUs, {concurrency} concurrent clients, {seconds:.0f}s per run\n")
+    print(f"{'workers':>8}{'req/s':>10}{'scaling':>9}")
+    baseline = None
+    for workers in counts:
+        server = start_server(workers)
+        try:
+            asyncio.run(drive(1, concurrency, headers))  # warm every worker
+            rate = asyncio.run(drive(seconds, concurrency, headers)) / seconds
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+        baseline = baseline or rate
+        print(f"{workers:>8}{rate:>10.0f}{rate / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
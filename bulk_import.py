@@ -0,0 +1,398 @@
+"""Bulk import of users, tags, posts, comments, likes and follows.
+
+Reads NDJSON (.ndjson / .jsonl) or CSV files in chunks, validates and coerces
+each row against the table's columns, resolves foreign keys for the whole
+chunk with one query per reference, and inserts with Core executemany, one
+transaction per chunk. Tables are loaded in dependency order.
+
+References may be given as ids (`author_id`) or by natural key: `author`,
+`user`, `follower` and `following` take a username, `tag` a tag name.
+Password hashes are imported as they are; rows are never hashed here.
+
+With --defer-indexes, secondary indexes and the full-text search indexes are
+dropped before loading and rebuilt once at the end. Post scores are rebuilt
+after importing posts, comments or likes.
+
+Each chunk also records outbox events in its transaction (see outbox.py), so
+running servers update their caches, tag dictionary and follow graph: one
+event per chunk of users, tags, posts, comments or likes, naming the rows
+they point at, and one per imported post tag or follow, as the ORM records
+links.
+
+Usage: python bulk_import.py --users users.ndjson --posts posts.csv [--likes ...]
+                             [--chunk-size 20000] [--defer-indexes] [--skip-duplicates]
+"""
+import argparse
+import csv
+import itertools
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import ColumnDefault, Connection, DateTime, Engine, Float, Integer, Table, select
+
+from json_encoding import decode_json
+from outbox import record
+from users import models as user_models
+from posts import models as post_models
+from comments import models as comment_models
+from likes import models as like_models
+from tags import models as tag_models
+
+CHUNK_SIZE = 20000
+MAX_REPORTED_ERRORS = 10
+
+
+@dataclass(frozen=True)
+class Reference:
+    column: str
+    table: Table
+    # Input field naming the referenced row by a unique column instead of its id
+    alias: Optional[str] = None
+    natural_key: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ImportSpec:
+    name: str
+    table: Table
+    references: Tuple[Reference, ...] = ()
+    check: Optional[Callable[[dict], Optional[str]]] = None
+
+
+def _check_like(row: dict) -> Optional[str]:
+    if row["post_id"] is None and row["comment_id"] is None:
+        return "a like needs post_id or comment_id"
+    return None
+
+
+def _check_follow(row: dict) -> Optional[str]:
+    if row["follower_id"] == row["following_id"]:
+        return "users cannot follow themselves"
+    return None
+
+
+_users = user_models.User.__table__
+_tags = tag_models.Tag.__table__
+_posts = post_models.Post.__table__
+_comments = comment_models.Comment.__table__
+
+# In dependency order
+SPECS = [
+    ImportSpec("users", _users),
+    ImportSpec("tags", _tags),
+    ImportSpec("posts", _posts, (Reference("author_id", _users, "author", "username"),)),
+    ImportSpec("post_tags", post_models.post_tags_table, (
+        Reference("post_id", _posts),
+        Reference("tag_id", _tags, "tag", "name"),
+    )),
+    ImportSpec("comments", _comments, (
+        Reference("post_id", _posts),
+        Reference("author_id", _users, "author", "username"),
+        Reference("parent_comment_id", _comments),
+    )),
+    ImportSpec("likes", like_models.Like.__table__, (
+        Reference("user_id", _users, "user", "username"),
+        Reference("post_id", _posts),
+        Reference("comment_id", _comments),
+    ), check=_check_like),
+    ImportSpec("follows", user_models.follows_table, (
+        Reference("follower_id", _users, "follower", "username"),
+        Reference("following_id", _users, "following", "username"),
+    ), check=_check_follow),
+]
+SCORED_TABLES = {"posts", "comments", "likes"}
+# Outbox entity names of the tables whose rows are entities; the others are links
+ENTITIES = {
+    model.__table__: model.__name__
+    for model in (user_models.User, tag_models.Tag, post_models.Post, comment_models.Comment, like_models.Like)
+}
+
+
+@dataclass
+class ImportReport:
+    name: str
+    read: int = 0
+    inserted: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rejected(self) -> int:
+        return len(self.errors)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.inserted / self.seconds if self.seconds else 0.0
+
+
+# Reading
+
+def read_rows(path: str) -> Iterator[Tuple[int, dict]]:
+    """(line number, row) pairs; a row's number is the file line it starts on, for error reports."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(f)
+            reader.fieldnames  # reads the header
+            start = reader.line_num + 1
+            # line_num counts physical lines, so quoted fields spanning lines are accounted for
+            for row in reader:
+                yield start, row
+                start = reader.line_num + 1
+            return
+        for number, line in enumerate(f, start=1):
+            if line.strip():
+                yield number, decode_json(line)
+
+
+def chunked(rows: Iterable[Tuple[int, dict]], size: int) -> Iterator[List[Tuple[int, dict]]]:
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+# Validation
+
+_AUTOINCREMENT = object()
+_REQUIRED = object()
+
+
+def _coercer(column) -> Callable:
+    if isinstance(column.type, Integer):
+        return int
+    if isinstance(column.type, Float):
+        return float
+    if isinstance(column.type, DateTime):
+        return lambda value: value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    return str
+
+
+def _fallback(table: Table, column):
+    """What a missing value becomes: SQLite's rowid, the column default, NULL, or an error."""
+    if column.primary_key and column.autoincrement is not False and isinstance(column.type, Integer) and len(table.primary_key) == 1:
+        return _AUTOINCREMENT
+    if column.default is not None:
+        return column.default
+    return None if column.nullable else _REQUIRED
+
+
+def coerce_rows(table: Table, raws: List[dict]) -> List[object]:
+    """Build rows holding every column of `table`; rows that are missing or have invalid values become ValueErrors."""
+    # Defaults are evaluated once per chunk: rows imported together share a timestamp
+    plan = []
+    for column in table.columns:
+        fallback = _fallback(table, column)
+        if isinstance(fallback, ColumnDefault):
+            fallback = fallback.arg(None) if fallback.is_callable else fallback.arg
+        elif fallback is _AUTOINCREMENT:
+            fallback = None  # assigned by SQLite
+        plan.append((column.name, _coercer(column), fallback))
+
+    rows = []
+    for raw in raws:
+        row = {}
+        try:
+            for name, coerce, fallback in plan:
+                value = raw.get(name)
+                if value is None or value == "":  # "" is an empty CSV cell
+                    if fallback is _REQUIRED:
+                        raise ValueError(f"missing {name}")
+                    row[name] = fallback
+                    continue
+                try:
+                    row[name] = coerce(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"invalid {name}: {value!r}") from None
+        except ValueError as error:
+            row = error
+        rows.append(row)
+    return rows
+
+
+def _existing(connection: Connection, column, values: set) -> set:
+    if not values:
+        return set()
+    return {value for (value,) in connection.execute(select(column).where(column.in_(values)))}
+
+
+def resolve_natural_keys(connection: Connection, spec: ImportSpec, raws: List[dict]) -> Dict[int, str]:
+    """Replace aliases (`author`, `tag`, ...) with ids, one lookup per reference for the whole chunk.
+
+    Returns errors for names that do not exist, by position in the chunk.
+    """
+    errors = {}
+    for ref in spec.references:
+        if ref.alias is None:
+            continue
+        pending = [
+            (position, raw) for position, raw in enumerate(raws)
+            if raw.get(ref.alias) not in (None, "") and raw.get(ref.column) in (None, "")
+        ]
+        if not pending:
+            continue
+        key_column = ref.table.c[ref.natural_key]
+        names = {raw[ref.alias] for _, raw in pending}
+        ids = dict(connection.execute(select(key_column, ref.table.c.id).where(key_column.in_(names))).all())
+        for position, raw in pending:
+            if raw[ref.alias] in ids:
+                raw[ref.column] = ids[raw[ref.alias]]
+            else:
+                errors.setdefault(position, f"unknown {ref.alias} {raw[ref.alias]!r}")
+    return errors
+
+
+def validate_chunk(connection: Connection, spec: ImportSpec, raws: List[dict], raw_lines: List[int], report: ImportReport) -> List[dict]:
+    unresolved = resolve_natural_keys(connection, spec, raws)
+    rows, lines = [], []
+    for position, row in enumerate(coerce_rows(spec.table, raws)):
+        line = raw_lines[position]
+        if position in unresolved:
+            report.errors.append((line, unresolved[position]))
+        elif isinstance(row, ValueError):
+            report.errors.append((line, str(row)))
+        else:
+            rows.append(row)
+            lines.append(line)
+
+    # Every referenced id must exist, in the database or (self references) in this chunk
+    missing = []
+    for ref in spec.references:
+        ids = {row[ref.column] for row in rows} - {None}
+        known = _existing(connection, ref.table.c.id, ids)
+        if ref.table is spec.table:
+            known |= {row["id"] for row in rows}
+        if ids - known:
+            missing.append((ref.column, ids - known))
+
+    valid = []
+    for line, row in zip(lines, rows):
+        error = next((f"unknown {column} {row[column]}" for column, ids in missing if row[column] in ids), None)
+        if error is None and spec.check is not None:
+            error = spec.check(row)
+        if error:
+            report.errors.append((line, error))
+        else:
+            valid.append(row)
+    return valid
+
+
+# Loading
+
+def change_events(spec: ImportSpec, rows: List[dict]) -> List[dict]:
+    """Outbox events for a chunk: one for rows of an entity table, one per row of a link table."""
+    def refs(rows: List[dict]) -> Dict[str, List[int]]:
+        found = defaultdict(set)
+        for ref in spec.references:
+            found[ENTITIES[ref.table]].update(row[ref.column] for row in rows if row[ref.column] is not None)
+        return {entity: sorted(ids) for entity, ids in found.items() if ids}
+
+    entity = ENTITIES.get(spec.table)
+    if entity is not None:
+        # Ids are assigned by SQLite: the event names the table, so every list of it is invalidated
+        return [{"entity": entity, "entity_id": None, "op": "insert", "data": {"refs": refs(rows)}}]
+    return [
+        {
+            "entity": spec.table.name, "entity_id": None, "op": "insert",
+            "data": {"refs": refs([row]), "row": {ref.column: row[ref.column] for ref in spec.references}},
+        }
+        for row in rows
+    ]
+
+
+def import_file(engine: Engine, spec: ImportSpec, path: str, chunk_size: int = CHUNK_SIZE, skip_duplicates: bool = False) -> ImportReport:
+    report = ImportReport(spec.name)
+    insert = spec.table.insert()
+    if skip_duplicates:
+        insert = insert.prefix_with("OR IGNORE")
+
+    started = time.perf_counter()
+    for numbered in chunked(read_rows(path), chunk_size):
+        raw_lines, raws = [line for line, _ in numbered], [raw for _, raw in numbered]
+        with engine.begin() as connection:
+            rows = validate_chunk(connection, spec, raws, raw_lines, report)
+            if rows:
+                result = connection.execute(insert, rows)
+                report.inserted += result.rowcount if skip_duplicates else len(rows)
+                record(connection, change_events(spec, rows))
+        report.read += len(raws)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def secondary_indexes(tables: Iterable[Table]) -> list:
+    # Unique indexes stay: they enforce integrity while loading
+    return [index for table in tables for index in table.indexes if not index.unique]
+
+
+def run_import(
+    engine: Engine,
+    files: Dict[str, str],
+    chunk_size: int = CHUNK_SIZE,
+    defer_indexes: bool = False,
+    skip_duplicates: bool = False,
+) -> List[ImportReport]:
+    from database import Base
+    from posts.ranking import rebuild_post_scores
+    from search.models import create_search_indexes, drop_search_indexes
+
+    Base.metadata.create_all(bind=engine)
+    specs = [spec for spec in SPECS if spec.name in files]
+    deferred = secondary_indexes(spec.table for spec in specs) if defer_indexes else []
+    if defer_indexes:
+        with engine.begin() as connection:
+            for index in deferred:
+                index.drop(connection, checkfirst=True)
+            drop_search_indexes(connection)
+
+    try:
+        reports = [import_file(engine, spec, files[spec.name], chunk_size, skip_duplicates) for spec in specs]
+    finally:
+        with engine.begin() as connection:
+            for index in deferred:
+                index.create(connection, checkfirst=True)
+            if defer_indexes:
+                create_search_indexes(connection)
+
+    if SCORED_TABLES & files.keys():
+        with engine.begin() as connection:
+            rebuild_post_scores(connection)
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for spec in SPECS:
+        parser.add_argument(f"--{spec.name.replace('_', '-')}", dest=spec.name, metavar="FILE")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--defer-indexes", action="store_true", help="drop secondary indexes while loading")
+    parser.add_argument("--skip-duplicates", action="store_true", help="ignore rows violating a unique constraint")
+    args = parser.parse_args(argv)
+
+    files = {spec.name: getattr(args, spec.name) for spec in SPECS if getattr(args, spec.name)}
+    if not files:
+        parser.error("nothing to import")
+
+    from database import engine, shard_map
+
+    if shard_map.enabled and set(files) - {"users", "tags", "follows"}:
+        parser.error("posts, comments and likes are on the shards in SHARD_URLS; import them before splitting with reshard.py")
+
+    started = time.perf_counter()
+    reports = run_import(engine, files, args.chunk_size, args.defer_indexes, args.skip_duplicates)
+    elapsed = time.perf_counter() - started
+
+    print(f"{'table':<12}{'read':>10}{'inserted':>10}{'rejected':>10}{'rows/s':>10}")
+    for report in reports:
+        print(f"{report.name:<12}{report.read:>10}{report.inserted:>10}{report.rejected:>10}{report.rows_per_second:>10.0f}")
+        for line, error in report.errors[:MAX_REPORTED_ERRORS]:
+            print(f"  {report.name} row {line}: {error}", file=sys.stderr)
+    total = sum(report.inserted for report in reports)
+    print(f"\n{total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s including index rebuilds)")
+    return 1 if any(report.rejected for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+import strawberry
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    GraphQLSchema,
+    OperationDefinitionNode,
+    OperationType,
+    TypeInfo,
+    TypeInfoVisitor,
+    Visitor,
+    get_named_type,
+    is_composite_type,
+    parse,
+    visit,
+)
+from strawberry.extensions import SchemaExtension
+from strawberry.schema.schema_converter import GraphQLCoreConverter
+from strawberry.schema_directive import Location
+
+
+@strawberry.enum
+class CacheScope(Enum):
+    PUBLIC = "PUBLIC"
+    PRIVATE = "PRIVATE"
+
+
+@strawberry.schema_directive(locations=[Location.FIELD_DEFINITION, Location.OBJECT])
+class CacheControl:
+    max_age: int
+    scope: CacheScope = CacheScope.PUBLIC
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    # max_age of None means no field constrained the policy (e.g. only __typename)
+    max_age: Optional[int] = None
+    scope: CacheScope = CacheScope.PUBLIC
+    has_errors: bool = False
+
+    @property
+    def cacheable(self) -> bool:
+        return not self.has_errors and bool(self.max_age)
+
+    def restrict(self, max_age: int, scope: CacheScope) -> "CachePolicy":
+        return CachePolicy(
+            max_age=max_age if self.max_age is None else min(self.max_age, max_age),
+            scope=CacheScope.PRIVATE if CacheScope.PRIVATE in (self.scope, scope) else CacheScope.PUBLIC,
+            has_errors=self.has_errors,
+        )
+
+    def merge(self, other: "CachePolicy") -> "CachePolicy":
+        merged = self.restrict(other.max_age, other.scope) if other.max_age is not None else self
+        if other.has_errors:
+            merged = merged.with_errors()
+        return merged
+
+    def with_errors(self) -> "CachePolicy":
+        return CachePolicy(max_age=self.max_age, scope=self.scope, has_errors=True)
+
+    def header_value(self) -> str:
+        if self.has_errors:
+            return "no-store"
+        private = self.scope == CacheScope.PRIVATE
+        if not self.max_age:
+            return "no-cache, private" if private else "no-cache"
+        return f"max-age={self.max_age}, {'private' if private else 'public'}"
+
+
+UNCACHEABLE = CachePolicy(max_age=0)
+
+
+def _hints(definition) -> List[CacheControl]:
+    directives = getattr(definition, "directives", None) or ()
+    return [d for d in directives if isinstance(d, CacheControl)]
+
+
+def _strawberry_definition(graphql_object) -> object:
+    extensions = getattr(graphql_object, "extensions", None) or {}
+    return extensions.get(GraphQLCoreConverter.DEFINITION_BACKREF)
+
+
+class _CachePolicyVisitor(Visitor):
+    def __init__(self, type_info: TypeInfo, root_type):
+        super().__init__()
+        self.type_info = type_info
+        self.root_type = root_type
+        self.policy = CachePolicy()
+
+    def enter_field(self, node: FieldNode, *_args):
+        field_def = self.type_info.get_field_def()
+        if field_def is None:
+            return
+        named_type = get_named_type(field_def.type)
+        composite = is_composite_type(named_type)
+
+        hints = _hints(_strawberry_definition(field_def))
+        if not hints and composite:
+            hints = _hints(_strawberry_definition(named_type))
+
+        if hints:
+            for hint in hints:
+                self.policy = self.policy.restrict(hint.max_age, hint.scope)
+        elif composite or self.type_info.get_parent_type() is self.root_type:
+            # Objects and root fields without a hint are uncacheable;
+            # scalar fields inherit the hint of their parent object.
+            self.policy = self.policy.restrict(0, CacheScope.PUBLIC)
+
+
+def _selected_definitions(document, operation_name: Optional[str]) -> Iterable:
+    operations = [d for d in document.definitions if isinstance(d, OperationDefinitionNode)]
+    if operation_name is not None:
+        operations = [d for d in operations if d.name and d.name.value == operation_name]
+    fragments = [d for d in document.definitions if isinstance(d, FragmentDefinitionNode)]
+    return operations[:1], fragments
+
+
+@lru_cache(maxsize=1024)
+def compute_cache_policy(schema: GraphQLSchema, query: str, operation_name: Optional[str] = None) -> CachePolicy:
+    operations, fragments = _selected_definitions(parse(query), operation_name)
+    if not operations or operations[0].operation != OperationType.QUERY:
+        return UNCACHEABLE
+
+    policy = CachePolicy()
+    for definition in operations + fragments:
+        type_info = TypeInfo(schema)
+        visitor = _CachePolicyVisitor(type_info, schema.query_type)
+        visit(definition, TypeInfoVisitor(type_info, visitor))
+        policy = policy.merge(visitor.policy)
+    return policy if policy.max_age is not None else UNCACHEABLE
+
+
+class CacheControlExtension(SchemaExtension):
+    """Aggregates `@cacheControl` hints of the executed operation onto `context.cache_policy`."""
+
+    def on_execute(self):
+        execution_context = self.execution_context
+        try:
+            policy = compute_cache_policy(
+                execution_context.schema._schema,
+                execution_context.query,
+                execution_context.operation_name,
+            )
+        except Exception:
+            policy = UNCACHEABLE
+
+        yield
+
+        result = execution_context.result
+        if result is None or getattr(result, "errors", None):
+            policy = policy.with_errors()
+
+        context = execution_context.context
+        current = getattr(context, "cache_policy", None)
+        context.cache_policy = policy if current is None else current.merge(policy)
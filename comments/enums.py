@@ -0,0 +1,9 @@
+from enum import Enum
+
+import strawberry
+
+
+@strawberry.enum
+class CommentOrder(Enum):
+    NEWEST = "NEWEST"
+    OLDEST = "OLDEST"
@@ -5,6 +5,8 @@ from database import Base
 
 class Comment(Base):
     __tablename__ = "comments"
+    # Placed on the shard of its post (see database.py)
+    __shard_keys__ = ("post_id",)
 
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False, index=True)
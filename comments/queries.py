@@ -2,8 +2,9 @@ import strawberry
 from typing import Optional, List
 from comments.schemas import Comment
 from comments.resolvers import resolve_comment, resolve_comments
+from cache_control import CacheControl
 
 @strawberry.type
 class CommentQuery:
-    comment: Optional[Comment] = strawberry.field(resolver=resolve_comment)
-    comments: List[Comment] = strawberry.field(resolver=resolve_comments)
+    comment: Optional[Comment] = strawberry.field(resolver=resolve_comment, directives=[CacheControl(max_age=60)])
+    comments: List[Comment] = strawberry.field(resolver=resolve_comments, directives=[CacheControl(max_age=30)])
@@ -1,6 +1,9 @@
+import heapq
 import strawberry
 from typing import List, Optional, TYPE_CHECKING
 from comments import models
+from posts import models as post_models
+from archive import IdSpace, archived_children, archived_rows
 from sqlalchemy.orm import Session # type: ignore
 
 import users.schemas
@@ -37,7 +40,8 @@ async def get_parent_comment(root: "Comment", info: strawberry.Info) -> Optional
 
 def get_replies(root: "Comment", info: strawberry.Info) -> List["Comment"]:
     # from comments.schemas import Comment # Removed
-    db = info.context.db
+    # Replies share their post, so its shard
+    db = info.context.shards.for_id(root.id)
     replies = db.query(models.Comment).filter(
         models.Comment.parent_comment_id == root.id
     ).all()
@@ -47,7 +51,12 @@ async def get_comment_likes(root: "Comment", info: strawberry.Info) -> List["Lik
     # from likes.schemas import Like # Removed
     loaders = info.context.loaders
     comment_likes = await loaders.likes_by_comment_loader.load(root.id)
-    return [like_schemas.Like.from_db_model(like) for like in comment_likes]
+    return [likes.schemas.Like.from_db_model(like) for like in comment_likes]
+
+async def get_comment_viewer_has_liked(root: "Comment", info: strawberry.Info) -> bool:
+    if not info.context.user:
+        return False
+    return await info.context.loaders.viewer_liked_comment_loader.load(root.id)
 
 # Query Resolvers
 def resolve_comment(id: int, info: strawberry.Info) -> Optional["Comment"]:
@@ -55,8 +64,8 @@ def resolve_comment(id: int, info: strawberry.Info) -> Optional["Comment"]:
     if not info.context.user:
         raise Exception("Not authenticated")
     
-    db = info.context.db
-    comment = db.query(models.Comment).filter(models.Comment.id == id).first()
+    query = info.context.shards.for_id(id).query(models.Comment).filter(models.Comment.id == id)
+    comment = query.first() or next(iter(archived_rows(query, IdSpace.COMMENT, id)), None)
     if not comment:
         raise Exception(f"Comment with id {id} not found")
     return comments.schemas.Comment.from_db_model(comment)
@@ -69,11 +78,16 @@ def resolve_comments(
     if not info.context.user:
         raise Exception("Not authenticated")
     
-    db = info.context.db
-    query = db.query(models.Comment)
-    
+    shards = info.context.shards
     if post_id:
-        query = query.filter(models.Comment.post_id == post_id)
-    
-    all_comments = query.order_by(models.Comment.created_at.desc()).all()
+        query = shards.for_id(post_id).query(models.Comment).filter(models.Comment.post_id == post_id)
+        query = query.order_by(models.Comment.created_at.desc())
+        all_comments = query.all() or archived_children(query, IdSpace.POST, post_models.Post, post_id)
+    else:
+        # Newest first across the shards
+        all_comments = heapq.merge(
+            *(db.query(models.Comment).order_by(models.Comment.created_at.desc()).all() for db in shards.all()),
+            key=lambda comment: comment.created_at,
+            reverse=True,
+        )
     return [comments.schemas.Comment.from_db_model(comment) for comment in all_comments]
@@ -2,14 +2,17 @@ import strawberry
 from typing import Optional, List, TYPE_CHECKING, Annotated
 from datetime import datetime
 import comments.resolvers as resolvers
+from cache_control import CacheControl, CacheScope
 
 if TYPE_CHECKING:
     from users.schemas import User
     from posts.schemas import Post
     from likes.schemas import Like
 
-@strawberry.type
+@strawberry.type(directives=[CacheControl(max_age=60)])
 class Comment:
+    __slots__ = ("id", "author_id", "post_id", "parent_comment_id", "content", "created_at", "updated_at")
+
     id: int
     author_id: int
     post_id: Optional[int]
@@ -24,6 +27,9 @@ class Comment:
     parent_comment: Optional["Comment"] = strawberry.field(resolver=resolvers.get_parent_comment)
     replies: List["Comment"] = strawberry.field(resolver=resolvers.get_replies)
     likes: List[Annotated["Like", strawberry.lazy("likes.schemas")]] = strawberry.field(resolver=resolvers.get_comment_likes)
+    viewer_has_liked: bool = strawberry.field(
+        resolver=resolvers.get_comment_viewer_has_liked, directives=[CacheControl(max_age=30, scope=CacheScope.PRIVATE)]
+    )
 
     @staticmethod
     def from_db_model(comment) -> "Comment":
@@ -1,6 +1,12 @@
-from sqlalchemy import create_engine
+import asyncio
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from sqlalchemy import create_engine, event, func, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from settings import SHARD_URLS
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./social_media.db"
 
@@ -17,4 +23,134 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Sharding (opt-in, see SHARD_URLS).
+#
+# Posts, comments and likes, with their post_tags and post_scores rows, can be
+# spread over several databases by the user who owns them; users, follows,
+# tags and the archive catalog stay in the main database. Every id belongs to
+# one of SHARD_SLOTS slots, `id % SHARD_SLOTS`: a user by their own id, a post
+# by an id chosen in its author's slot, and a comment or like by an id in its
+# post's slot (see `__shard_keys__` on the models). So any id routes to its
+# database by arithmetic alone, and a user's posts and threads share one.
+# Slots are placed on databases by jump consistent hashing: adding a database
+# takes over about 1/N of the slots and leaves the rest where they are.
+# reshard.py moves the rows.
+SHARD_SLOTS = 256
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach) of `key` into range(buckets)."""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_engine(url: str):
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+
+class ShardMap:
+    """The shard databases and which of them holds each slot."""
+
+    def __init__(self, urls: Iterable[str] = ()):
+        self.configure(urls)
+
+    def configure(self, urls: Iterable[str]) -> None:
+        self.urls = list(urls)
+        self.engines = [shard_engine(url) for url in self.urls]
+        self.placement = [jump_hash(slot, len(self.engines)) for slot in range(SHARD_SLOTS)] if self.engines else []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def shard_of(self, id: int) -> int:
+        return self.placement[id % SHARD_SLOTS]
+
+    def split(self, ids: Iterable[int]) -> Dict[int, List[int]]:
+        """`ids` by the shard holding them."""
+        shards = defaultdict(list)
+        for id in ids:
+            shards[self.shard_of(id)].append(id)
+        return shards
+
+
+shard_map = ShardMap(SHARD_URLS)
+
+
+class Shards:
+    """A request's sessions on the shards.
+
+    With sharding off, the request's main session stands in for the only
+    shard, so callers route the same way either way. DataLoader batches run
+    on worker threads through `run`, with sessions of their own.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._sessions: Dict[int, Session] = {}
+        self._workers: Dict[int, Session] = {}
+        self._locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    @property
+    def count(self) -> int:
+        return len(shard_map.engines) or 1
+
+    def session(self, index: int) -> Session:
+        if not shard_map.enabled:
+            return self.db
+        if index not in self._sessions:
+            self._sessions[index] = self._open(index)
+        return self._sessions[index]
+
+    def for_id(self, id: int) -> Session:
+        """Session on the shard holding `id` (a user, post, comment or like id)."""
+        return self.session(shard_map.shard_of(id)) if shard_map.enabled else self.db
+
+    def all(self) -> List[Session]:
+        return [self.session(index) for index in range(self.count)]
+
+    async def run(self, index: int, fn, *args):
+        """`fn(session, *args)` on a worker thread; calls for one shard take turns on its worker session."""
+        async with self._locks[index]:
+            if index not in self._workers:
+                self._workers[index] = self._open(index)
+            return await asyncio.to_thread(fn, self._workers[index], *args)
+
+    def close(self) -> None:
+        for session in (*self._sessions.values(), *self._workers.values()):
+            session.close()
+        self._sessions.clear()
+        self._workers.clear()
+
+    def _open(self, index: int) -> Session:
+        # Carries the request's deadline (see admission.py) and snapshot mode
+        # (see snapshot_reads.py) over to the shard
+        info = {"shard": index, **{key: self.db.info[key] for key in ("deadline", "snapshot") if key in self.db.info}}
+        return SessionLocal(bind=shard_map.engines[index], info=info)
+
+
+@event.listens_for(Session, "before_flush")
+def _assign_shard_ids(session, flush_context, instances):
+    # New rows written to a shard take ids in their owner's slot, above every id
+    # the table has, so they stay unique after slots move between databases.
+    # The id is worked out inside the INSERT (and read back with RETURNING), so
+    # concurrent writers to one shard cannot pick the same one.
+    if "shard" not in session.info:
+        return
+    for obj in session.new:
+        if not getattr(obj, "__shard_keys__", None) or obj.id is not None:
+            continue
+        owner = next((getattr(obj, key) for key in obj.__shard_keys__ if getattr(obj, key) is not None), None)
+        if owner is None:
+            raise ValueError(f"{type(obj).__name__} needs one of {obj.__shard_keys__} to be placed on a shard")
+        ids = obj.__table__.c.id
+        obj.id = select(
+            (func.coalesce(func.max(ids), 0) // SHARD_SLOTS + 1) * SHARD_SLOTS + owner % SHARD_SLOTS
+        ).scalar_subquery()
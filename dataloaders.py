@@ -1,11 +1,18 @@
-from typing import List, Optional
+import asyncio
+from collections import defaultdict
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
 from strawberry.dataloader import DataLoader
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from users import models as user_models
 from posts import models as post_models
 from comments import models as comment_models
 from likes import models as like_models
-from tags import models as tag_models
+from tags.dictionary import TagEntry, tag_dictionary
+from admission import DeadlineExceeded
+from archive import IdSpace, archive_catalog, is_archived, load_archived, loader_key_id
+from database import Shards, shard_map
 
 
 async def load_users(keys: List[int], db: Session) -> List[Optional[user_models.User]]:
@@ -66,24 +73,232 @@ async def load_likes_by_comment(keys: List[int], db: Session) -> List[List[like_
     return [likes_map.get(key, []) for key in keys]
 
 
-async def load_tags_by_post(keys: List[int], db: Session) -> List[List[tag_models.Tag]]:
-    from sqlalchemy.orm import joinedload
-    posts = db.query(post_models.Post).options(
-        joinedload(post_models.Post.tags)
-    ).filter(post_models.Post.id.in_(keys)).all()
-    
-    tags_map = {post.id: post.tags for post in posts}
-    return [tags_map.get(key, []) for key in keys]
+COMMENT_ORDERINGS = {
+    "NEWEST": (comment_models.Comment.created_at.desc(), comment_models.Comment.id.desc()),
+    "OLDEST": (comment_models.Comment.created_at, comment_models.Comment.id),
+}
+RECENT_LIKES_ORDERING = (like_models.Like.created_at.desc(), like_models.Like.id.desc())
+
+
+def top_n_per_parent(db: Session, model, parent_column, parent_ids: Iterable[int], first: Optional[int], ordering) -> list:
+    # One query for every parent: rank children within each parent and keep the first N
+    ranked = select(
+        model.id,
+        func.row_number().over(partition_by=parent_column, order_by=ordering).label("rank"),
+    ).where(parent_column.in_(parent_ids)).subquery()
+    query = db.query(model).join(ranked, model.id == ranked.c.id)
+    if first is not None:
+        query = query.filter(ranked.c.rank <= first)
+    return query.order_by(ranked.c.rank).all()
+
+
+async def load_top_comments_by_post(keys: List[Tuple[int, Optional[int], str]], db: Session) -> List[List[comment_models.Comment]]:
+    # Keys are (post_id, first, order); one query per distinct (first, order)
+    post_ids_by_args: Dict[Tuple[Optional[int], str], set] = defaultdict(set)
+    for post_id, first, order in keys:
+        post_ids_by_args[(first, order)].add(post_id)
+
+    Comment = comment_models.Comment
+    comments_map = defaultdict(list)
+    for (first, order), post_ids in post_ids_by_args.items():
+        for comment in top_n_per_parent(db, Comment, Comment.post_id, post_ids, first, COMMENT_ORDERINGS[order]):
+            comments_map[(comment.post_id, first, order)].append(comment)
+    return [comments_map.get(key, []) for key in keys]
+
+
+async def load_recent_likes_by_post(keys: List[Tuple[int, int]], db: Session) -> List[List[like_models.Like]]:
+    # Keys are (post_id, first), newest likes first
+    post_ids_by_first: Dict[int, set] = defaultdict(set)
+    for post_id, first in keys:
+        post_ids_by_first[first].add(post_id)
+
+    Like = like_models.Like
+    likes_map = defaultdict(list)
+    for first, post_ids in post_ids_by_first.items():
+        for like in top_n_per_parent(db, Like, Like.post_id, post_ids, first, RECENT_LIKES_ORDERING):
+            likes_map[(like.post_id, first)].append(like)
+    return [likes_map.get(key, []) for key in keys]
+
+
+async def load_likes_count_by_post(keys: List[int], db: Session) -> List[int]:
+    counts = count_likes_by_post(db, keys)
+    return [counts.get(key, 0) for key in keys]
+
+
+def count_likes_by_post(db: Session, post_ids: Iterable[int]) -> Dict[int, int]:
+    Like = like_models.Like
+    return dict(
+        db.query(Like.post_id, func.count(Like.id)).filter(Like.post_id.in_(post_ids)).group_by(Like.post_id).all()
+    )
+
+
+async def load_tag_ids_by_post(keys: List[int], db: Session) -> List[List[int]]:
+    tag_ids_map = tag_ids_by_post(db, keys)
+    return [tag_ids_map.get(key, []) for key in keys]
+
+
+def tag_ids_by_post(db: Session, post_ids: Iterable[int]) -> Dict[int, List[int]]:
+    post_tags = post_models.post_tags_table
+    rows = db.execute(
+        select(post_tags.c.post_id, post_tags.c.tag_id)
+        .where(post_tags.c.post_id.in_(post_ids))
+        .order_by(post_tags.c.tag_id)
+    ).all()
+    tag_ids_map = defaultdict(list)
+    for post_id, tag_id in rows:
+        tag_ids_map[post_id].append(tag_id)
+    return tag_ids_map
+
+
+def tags_by_post(db: Session, post_ids: Iterable[int], tags_db: Optional[Session] = None) -> Dict[int, List[TagEntry]]:
+    # `tags_db` holds the tags when `db` is a shard or an archive partition
+    return {
+        post_id: tag_dictionary.get_many(tags_db or db, tag_ids)
+        for post_id, tag_ids in tag_ids_by_post(db, post_ids).items()
+    }
+
+
+async def load_viewer_likes(keys: List[int], db: Session, viewer_id: Optional[int], column) -> List[bool]:
+    # One `user_id = :viewer AND <column> IN (...)` lookup per batch
+    if viewer_id is None:
+        return [False] * len(keys)
+    liked = {
+        row[0] for row in db.query(column).filter(
+            like_models.Like.user_id == viewer_id, column.in_(keys)
+        )
+    }
+    return [key in liked for key in keys]
+
+
+async def load_viewer_follows(keys: List[int], db: Session, viewer_id: Optional[int]) -> List[bool]:
+    if viewer_id is None:
+        return [False] * len(keys)
+    follows = user_models.follows_table
+    followed = {
+        row[0] for row in db.execute(
+            select(follows.c.following_id).where(
+                follows.c.follower_id == viewer_id, follows.c.following_id.in_(keys)
+            )
+        )
+    }
+    return [key in followed for key in keys]
+
+
+def _run_load(session: Session, load_fn, keys: list) -> list:
+    # On a worker thread: the load functions only run SQL, so each completes in a loop of its own
+    return asyncio.run(load_fn(keys, session))
 
 
 class DataLoaders:
-    def __init__(self, db: Session):
+    def __init__(
+        self,
+        db: Session,
+        viewer_id: Optional[int] = None,
+        deadline: Optional[float] = None,
+        shards: Optional[Shards] = None,
+    ):
         self.db = db
-        self.user_loader = DataLoader(load_fn=lambda keys: load_users(keys, db))
-        self.post_loader = DataLoader(load_fn=lambda keys: load_posts(keys, db))
-        self.comment_loader = DataLoader(load_fn=lambda keys: load_comments(keys, db))
-        self.posts_by_author_loader = DataLoader(load_fn=lambda keys: load_posts_by_author(keys, db))
-        self.comments_by_post_loader = DataLoader(load_fn=lambda keys: load_comments_by_post(keys, db))
-        self.likes_by_post_loader = DataLoader(load_fn=lambda keys: load_likes_by_post(keys, db))
-        self.likes_by_comment_loader = DataLoader(load_fn=lambda keys: load_likes_by_comment(keys, db))
-        self.tags_by_post_loader = DataLoader(load_fn=lambda keys: load_tags_by_post(keys, db))
+        self.deadline = deadline
+        self.shards = shards if shards is not None else Shards(db)
+        self.user_loader = self._loader(lambda keys: load_users(keys, db))
+        self.post_loader = self._loader(self._archived(load_posts, IdSpace.POST))
+        self.comment_loader = self._loader(self._archived(load_comments, IdSpace.COMMENT))
+        self._entity_loaders = {
+            user_models.User: self.user_loader,
+            post_models.Post: self.post_loader,
+            comment_models.Comment: self.comment_loader,
+        }
+
+        self.posts_by_author_loader = self._loader(self._priming(lambda keys: self._on_shards(load_posts_by_author, keys)))
+        self.comments_by_post_loader = self._loader(self._priming(self._archived_children(load_comments_by_post, IdSpace.POST)))
+        self.likes_by_post_loader = self._loader(self._archived_children(load_likes_by_post, IdSpace.POST))
+        self.likes_count_by_post_loader = self._loader(self._archived_children(load_likes_count_by_post, IdSpace.POST))
+        self.likes_by_comment_loader = self._loader(self._archived_children(load_likes_by_comment, IdSpace.COMMENT))
+        self.top_comments_by_post_loader = self._loader(
+            self._priming(self._archived_children(load_top_comments_by_post, IdSpace.POST))
+        )
+        self.recent_likes_by_post_loader = self._loader(self._archived_children(load_recent_likes_by_post, IdSpace.POST))
+        self.tags_by_post_loader = self._loader(self._named_tags(self._archived_children(load_tag_ids_by_post, IdSpace.POST)))
+        self.viewer_liked_post_loader = self._loader(self._archived_children(
+            lambda keys, session: load_viewer_likes(keys, session, viewer_id, like_models.Like.post_id), IdSpace.POST
+        ))
+        self.viewer_liked_comment_loader = self._loader(self._archived_children(
+            lambda keys, session: load_viewer_likes(keys, session, viewer_id, like_models.Like.comment_id),
+            IdSpace.COMMENT,
+        ))
+        self.viewer_follows_loader = self._loader(lambda keys: load_viewer_follows(keys, db, viewer_id))
+
+    def prime(self, entities: Iterable[object]) -> None:
+        """Seed the by-id loaders with entities already loaded in this request."""
+        for entity in entities:
+            loader = self._entity_loaders.get(type(entity))
+            if loader is not None:
+                loader.prime(entity.id, entity)
+
+    def _loader(self, load_fn) -> DataLoader:
+        if self.deadline is None:
+            return DataLoader(load_fn=load_fn)
+
+        async def load(keys):
+            # Batches are dispatched in tasks of their own, outside the request's timeout
+            if time.monotonic() >= self.deadline:
+                raise DeadlineExceeded()
+            return await load_fn(keys)
+        return DataLoader(load_fn=load)
+
+    def _archived(self, load_fn, space: IdSpace):
+        # load_fn(keys, session) by id: ids missing from the hot tables are retried on the archive partitions
+        async def load(keys):
+            results = await self._on_shards(load_fn, keys)
+            missing = [position for position, result in enumerate(results) if result is None]
+            return await load_archived(self.db, space, keys, results, load_fn, missing)
+        return load
+
+    def _archived_children(self, load_fn, space: IdSpace):
+        # load_fn(keys, session) by parent id: an empty result (0, False, []) is only retried on the
+        # archive partitions when the parent post or comment itself was archived
+        parent_loader = self.post_loader if space == IdSpace.POST else self.comment_loader
+
+        async def load(keys):
+            results = await self._on_shards(load_fn, keys)
+            missing = [
+                position for position, result in enumerate(results)
+                if not result and archive_catalog.covers(self.db, space, loader_key_id(keys[position]))
+            ]
+            if missing:
+                # Usually answered from the loader's cache: the parents were resolved first
+                parents = await parent_loader.load_many([loader_key_id(keys[position]) for position in missing])
+                missing = [position for position, parent in zip(missing, parents) if parent is not None and is_archived(parent)]
+            return await load_archived(self.db, space, keys, results, load_fn, missing)
+        return load
+
+    async def _on_shards(self, load_fn, keys: list) -> list:
+        # load_fn(keys, session) on each shard holding some of the keys, the shards concurrently
+        if not shard_map.enabled:
+            return await load_fn(keys, self.db)
+        positions = defaultdict(list)
+        for position, key in enumerate(keys):
+            positions[shard_map.shard_of(loader_key_id(key))].append(position)
+        found = await asyncio.gather(*(
+            self.shards.run(index, _run_load, load_fn, [keys[position] for position in shard_positions])
+            for index, shard_positions in positions.items()
+        ))
+        results = [None] * len(keys)
+        for shard_positions, values in zip(positions.values(), found):
+            for position, value in zip(shard_positions, values):
+                results[position] = value
+        return results
+
+    def _named_tags(self, load_fn):
+        # Tag ids come from the posts' database, the tags themselves from the main one
+        async def load(keys):
+            return [tag_dictionary.get_many(self.db, tag_ids) if tag_ids else [] for tag_ids in await load_fn(keys)]
+        return load
+
+    def _priming(self, load_fn):
+        async def load(keys):
+            results = await load_fn(keys)
+            for entities in results:
+                self.prime(entities)
+            return results
+        return load
@@ -0,0 +1,181 @@
+"""Streaming bulk export of posts, comments, likes and follows.
+
+GET /export/{table}?format=ndjson|arrow&since=<ISO datetime>
+
+Rows are read through a server-side cursor in batches of EXPORT_BATCH_SIZE
+and written out as they arrive, so memory stays flat however large the
+table is. `since` keeps rows changed at or after the given time (`updated_at`
+for posts and comments, `created_at` for likes and follows); the
+`X-Export-Watermark` response header is the `since` to pass next time.
+Deletions are not exported. With sharding on, posts, comments and likes are
+read from each shard in turn, so rows come ordered by key within a shard.
+Archived posts, comments and likes (see archive.py) follow the hot rows,
+one partition after another, newest month first.
+
+Exports contain every user's rows, so only the users listed in EXPORT_USERS
+may run them.
+"""
+import io
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Iterator, Optional, Sequence, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Connection, DateTime, Float, Integer, select
+from sqlalchemy.orm import Session
+
+from archive import Partition, archive_catalog, partition_engine
+from auth import get_current_user
+from comments import models as comment_models
+from database import engine, get_db, shard_map
+from json_encoding import encode_json
+from likes import models as like_models
+from posts import models as post_models
+from settings import EXPORT_BATCH_SIZE, EXPORT_USERS
+from users import models as user_models
+
+try:
+    import pyarrow
+except ImportError:  # optional, only needed for format=arrow (see the `export` extra)
+    pyarrow = None
+
+
+class ExportTable(str, Enum):
+    POSTS = "posts"
+    COMMENTS = "comments"
+    LIKES = "likes"
+    FOLLOWS = "follows"
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    ARROW = "arrow"
+
+
+# table, watermark column
+_TABLES = {
+    ExportTable.POSTS: (post_models.Post.__table__, "updated_at"),
+    ExportTable.COMMENTS: (comment_models.Comment.__table__, "updated_at"),
+    ExportTable.LIKES: (like_models.Like.__table__, "created_at"),
+    ExportTable.FOLLOWS: (user_models.follows_table, "created_at"),
+}
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.ARROW: "application/vnd.apache.arrow.stream",
+}
+
+
+def export_query(table: ExportTable, since: Optional[datetime] = None):
+    sql_table, watermark = _TABLES[table]
+    query = select(sql_table).order_by(*sql_table.primary_key.columns)
+    if since is not None:
+        query = query.where(sql_table.c[watermark] >= since)
+    return query
+
+
+def iter_batches(connection: Union[Connection, Sequence[Connection]], table: ExportTable, since: Optional[datetime] = None, batch_size: int = EXPORT_BATCH_SIZE):
+    # A sequence of connections (one per shard) is read one after another
+    for source in [connection] if isinstance(connection, Connection) else connection:
+        result = source.execution_options(yield_per=batch_size).execute(export_query(table, since))
+        keys = [str(key) for key in result.keys()]  # plain str; orjson rejects quoted_name keys
+        for rows in result.partitions():
+            yield keys, rows
+
+
+def iter_ndjson(connection: Union[Connection, Sequence[Connection]], table: ExportTable, since: Optional[datetime] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    for keys, rows in iter_batches(connection, table, since, batch_size):
+        # One chunk per batch; encoding row by row would mean a write per row
+        yield b"".join(encode_json(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+def _arrow_type(column):
+    if isinstance(column.type, Integer):
+        return pyarrow.int64()
+    if isinstance(column.type, Float):
+        return pyarrow.float64()
+    if isinstance(column.type, DateTime):
+        return pyarrow.timestamp("us")
+    return pyarrow.string()
+
+
+class _Chunks(io.RawIOBase):
+    """Write target for the Arrow stream writer that hands back what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_arrow(connection: Union[Connection, Sequence[Connection]], table: ExportTable, since: Optional[datetime] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    sql_table, _ = _TABLES[table]
+    schema = pyarrow.schema([(column.name, _arrow_type(column)) for column in sql_table.columns])
+    sink = _Chunks()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for keys, rows in iter_batches(connection, table, since, batch_size):
+            columns = list(zip(*rows))
+            writer.write_batch(pyarrow.record_batch(
+                [pyarrow.array(values, type=schema.field(key).type) for key, values in zip(keys, columns)],
+                schema=schema,
+            ))
+            yield sink.drain()
+    yield sink.drain()  # end-of-stream marker
+
+
+def _stream(table: ExportTable, export_format: ExportFormat, since: Optional[datetime], partitions: Sequence[Partition]) -> Iterator[bytes]:
+    # Runs in Starlette's threadpool with connections of its own, so a long
+    # export neither blocks the event loop nor outlives the request's session
+    engines = shard_map.engines if shard_map.enabled and table != ExportTable.FOLLOWS else [engine]
+    # Partitions are decompressed here on first read, off the event loop
+    engines = engines + [partition_engine(partition) for partition in partitions]
+    with ExitStack() as stack:
+        connections = [stack.enter_context(source.connect()) for source in engines]
+        if export_format == ExportFormat.ARROW:
+            yield from iter_arrow(connections, table, since)
+        else:
+            yield from iter_ndjson(connections, table, since)
+
+
+router = APIRouter()
+
+
+@router.get("/export/{table}")
+async def export_table(
+    table: ExportTable,
+    request: Request,
+    format: ExportFormat = ExportFormat.NDJSON,
+    since: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    user = await get_current_user(request.headers.get("authorization"), db)
+    if user is None:
+        raise HTTPException(401, "Not authenticated")
+    if user.username not in EXPORT_USERS:
+        raise HTTPException(403, "Exports are limited to the users in EXPORT_USERS")
+    if format == ExportFormat.ARROW and pyarrow is None:
+        raise HTTPException(400, "Arrow export needs the pyarrow package")
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)  # stored timestamps are naive UTC
+
+    # Follows are never archived
+    archive_partitions = archive_catalog.partitions(db) if table != ExportTable.FOLLOWS else []
+    # Taken before reading, so rows written while the export runs are picked up next time
+    watermark = datetime.now(timezone.utc).replace(tzinfo=None)
+    return StreamingResponse(
+        _stream(table, format, since, archive_partitions),
+        media_type=MEDIA_TYPES[format],
+        headers={"X-Export-Watermark": watermark.isoformat()},
+    )
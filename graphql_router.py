@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Any, Dict, List, Optional
+
+from graphql import GraphQLError
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLRequestData
+from strawberry.types import ExecutionResult
+from strawberry.types.unset import UNSET
+
+from cache_control import CacheScope
+from json_encoding import JSONEncoder, decode_json, encode_json
+from rate_limit import QueryTooExpensive, RateLimiter, RateLimitExceeded, compute_query_cost
+
+
+class PersistedQueryStore:
+    """Bounded sha256 -> query text registry for automatic persisted queries."""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._queries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, digest: str) -> Optional[str]:
+        query = self._queries.get(digest)
+        if query is not None:
+            self._queries.move_to_end(digest)
+        return query
+
+    def register(self, query: str) -> str:
+        digest = hashlib.sha256(query.encode()).hexdigest()
+        self._queries[digest] = query
+        self._queries.move_to_end(digest)
+        while len(self._queries) > self.max_size:
+            self._queries.popitem(last=False)
+        return digest
+
+
+def _error_result(message: str, code: str, **extensions: Any) -> ExecutionResult:
+    return ExecutionResult(data=None, errors=[GraphQLError(message, extensions={"code": code, **extensions})])
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+class AppGraphQLRouter(GraphQLRouter):
+    """GraphQLRouter with persisted GET queries and HTTP caching headers.
+
+    GET requests may reference a query by its sha256 (`?id=<hash>` or the
+    `persistedQuery` extension). Successful GET responses carry the
+    `Cache-Control` policy aggregated by `CacheControlExtension` and a strong
+    `ETag`; a matching `If-None-Match` is answered with `304 Not Modified`.
+    Responses to requests with credentials vary on `Authorization`.
+
+    Responses are serialized by a pluggable `encoder` returning bytes
+    (orjson when installed, the stdlib otherwise).
+
+    With a `rate_limiter`, each operation is charged its query cost against
+    the client's token bucket; when it runs dry the response is a `429` with
+    `Retry-After`. A batch (a JSON array of operations, see
+    `StrawberryConfig.batching_config`) is charged its total cost at once, so
+    it either runs entirely or is limited entirely.
+
+    Once an operation (or a whole batch) has resolved, the context's
+    `release` returns its database connections, before serialization.
+
+    When the context carries a `deadline` (see admission.py), DataLoader
+    batches and SQL are aborted once it passes and the response is a `503`
+    with a `DEADLINE_EXCEEDED` error instead of partial data.
+    """
+
+    def __init__(
+        self,
+        schema,
+        persisted_queries: Optional[PersistedQueryStore] = None,
+        encoder: JSONEncoder = encode_json,
+        rate_limiter: Optional[RateLimiter] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(schema, **kwargs)
+        self.persisted_queries = persisted_queries or PersistedQueryStore()
+        self.encoder = encoder
+        self.rate_limiter = rate_limiter
+
+    def encode_json(self, data: object) -> bytes:
+        return self.encoder(data)
+
+    def decode_json(self, data) -> object:
+        return decode_json(data)
+
+    def should_render_graphql_ide(self, request) -> bool:
+        if "id" in request.query_params or "extensions" in request.query_params:
+            return False
+        return super().should_render_graphql_ide(request)
+
+    def parse_query_params(self, params) -> Dict[str, Any]:
+        params = super().parse_query_params(params)
+        digest = params.pop("id", None)
+        if digest and not params.get("query"):
+            params["extensions"] = {
+                **(params.get("extensions") or {}),
+                "persistedQuery": {"version": 1, "sha256Hash": digest},
+            }
+        return params
+
+    async def execute_operation(self, request, request_adapter, request_data, context, root_value, sub_response):
+        result = await self._execute_operation(request, request_adapter, request_data, context, root_value, sub_response)
+        # Resolution is over unless results still stream (@defer/@stream, subscriptions):
+        # hand the connections back before the response is serialized and sent
+        release = getattr(context, "release", None)
+        if release is not None and all(isinstance(item, ExecutionResult) for item in (result if isinstance(result, list) else [result])):
+            release()
+        return result
+
+    async def _execute_operation(self, request, request_adapter, request_data, context, root_value, sub_response):
+        if not isinstance(request_data, list):
+            return await super().execute_operation(
+                request=request,
+                request_adapter=request_adapter,
+                request_data=request_data,
+                context=context,
+                root_value=root_value,
+                sub_response=sub_response,
+            )
+
+        # Operations of a batch run concurrently on one context: the session,
+        # viewer lookup and DataLoaders are shared, so loads deduplicate across them
+        limited = await self._charge(request, context, sub_response, request_data)
+        if limited is not None:
+            return [limited] * len(request_data)
+        return await asyncio.gather(*(
+            self.execute_single(
+                request=request,
+                request_adapter=request_adapter,
+                sub_response=sub_response,
+                context=context,
+                root_value=root_value,
+                request_data=data,
+                charged=True,
+            )
+            for data in request_data
+        ))
+
+    async def execute_single(self, request, request_adapter, sub_response, context, root_value, request_data: GraphQLRequestData, charged: bool = False):
+        persisted = (request_data.extensions or {}).get("persistedQuery")
+        if isinstance(persisted, dict) and persisted.get("sha256Hash"):
+            digest = persisted["sha256Hash"]
+            if request_data.query:
+                if self.persisted_queries.register(request_data.query) != digest:
+                    return _error_result("provided sha does not match query", "PERSISTED_QUERY_HASH_MISMATCH")
+            else:
+                query = self.persisted_queries.get(digest)
+                if query is None:
+                    return _error_result("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+                request_data = replace(request_data, query=query)
+
+        if not charged:
+            limited = await self._charge(request, context, sub_response, [request_data])
+            if limited is not None:
+                return limited
+
+        result = await super().execute_single(
+            request=request,
+            request_adapter=request_adapter,
+            sub_response=sub_response,
+            context=context,
+            root_value=root_value,
+            request_data=request_data,
+        )
+        deadline = getattr(context, "deadline", None)
+        if deadline is not None and isinstance(result, ExecutionResult) and result.errors and time.monotonic() >= deadline:
+            # Errors from aborted DataLoader batches and interrupted SQL; the data is incomplete
+            sub_response.status_code = 503
+            return _error_result("Request deadline exceeded", "DEADLINE_EXCEEDED")
+        return result
+
+    def _operation_cost(self, request_data: GraphQLRequestData) -> int:
+        query = request_data.query
+        persisted = (request_data.extensions or {}).get("persistedQuery")
+        if not query and isinstance(persisted, dict) and persisted.get("sha256Hash"):
+            query = self.persisted_queries.get(persisted["sha256Hash"])
+        if not query:
+            return 1
+        try:
+            return compute_query_cost(self.schema._schema, query, request_data.operation_name, request_data.variables)
+        except GraphQLError:
+            return 1  # syntax errors are reported by the normal execution path
+
+    async def _charge(self, request, context, sub_response, operations: List[GraphQLRequestData]) -> Optional[ExecutionResult]:
+        if self.rate_limiter is None:
+            return None
+        cost = sum(self._operation_cost(request_data) for request_data in operations)
+        key = self.rate_limiter.client_key(request, getattr(context, "viewer_id", None))
+        try:
+            await self.rate_limiter.charge(key, cost)
+        except QueryTooExpensive as error:
+            return _error_result(str(error), "QUERY_TOO_EXPENSIVE", cost=error.cost)
+        except RateLimitExceeded as error:
+            retry_after = math.ceil(error.retry_after)
+            sub_response.status_code = 429
+            sub_response.headers["Retry-After"] = str(retry_after)
+            return _error_result(str(error), "RATE_LIMITED", cost=error.cost, retryAfter=retry_after)
+        return None
+
+    async def run(self, request, context=UNSET, root_value=UNSET):
+        response = await super().run(request, context=context, root_value=root_value)
+        if self.is_websocket_request(request) or request.method != "GET":
+            return response
+        if isinstance(response, StreamingResponse) or response.media_type != "application/json":
+            return response
+        return self._apply_http_caching(request, response, getattr(context, "cache_policy", None))
+
+    def _apply_http_caching(self, request: Request, response: Response, policy) -> Response:
+        if policy is None or policy.has_errors or response.status_code != 200:
+            response.headers["Cache-Control"] = "no-store"
+            return response
+
+        etag = '"%s"' % hashlib.sha256(response.body).hexdigest()
+        headers = {"ETag": etag, "Cache-Control": policy.header_value()}
+        # Public answers to authenticated requests still depend on the credentials
+        # being valid: shared caches must not hand them to anonymous clients
+        if policy.scope == CacheScope.PRIVATE or "authorization" in request.headers:
+            headers["Vary"] = "Authorization"
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+        return response
@@ -0,0 +1,50 @@
+import json
+from dataclasses import replace
+from datetime import date, datetime, time
+from typing import Callable, Union
+
+from strawberry.schema.types.base_scalars import DateTimeDefinition
+
+try:
+    import orjson
+except ImportError:  # optional speedup, see the `speedups` extra
+    orjson = None
+
+JSONEncoder = Callable[[object], bytes]
+
+
+def _default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stdlib_encode(data: object) -> bytes:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=_default).encode()
+
+
+def orjson_encode(data: object) -> bytes:
+    return orjson.dumps(data, default=_default)
+
+
+def stdlib_decode(data: Union[str, bytes]) -> object:
+    return json.loads(data)
+
+
+encode_json: JSONEncoder = orjson_encode if orjson is not None else stdlib_encode
+decode_json: Callable[[Union[str, bytes]], object] = orjson.loads if orjson is not None else stdlib_decode
+
+
+def _serialize_datetime(value):
+    # Leave datetimes to the response encoder instead of building an
+    # intermediate isoformat string per field during execution.
+    if isinstance(value, datetime):
+        return value
+    return value.isoformat()
+
+
+# Drop-in for the built-in DateTime scalar (same name, parsing and SDL).
+# Only worth it with orjson: the stdlib `default=` hook is slower than
+# stringifying during execution.
+NativeDateTimeDefinition = replace(DateTimeDefinition, serialize=_serialize_datetime)
+scalar_map = {datetime: NativeDateTimeDefinition} if orjson is not None else {}
@@ -5,6 +5,8 @@ from database import Base
 
 class Like(Base):
     __tablename__ = "likes"
+    # Placed on the shard of the post or comment liked (see database.py)
+    __shard_keys__ = ("post_id", "comment_id")
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
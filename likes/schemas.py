@@ -2,14 +2,17 @@ import strawberry
 from typing import Optional, TYPE_CHECKING, Annotated
 from datetime import datetime
 import likes.resolvers as resolvers
+from cache_control import CacheControl
 
 if TYPE_CHECKING:
     from users.schemas import User
     from posts.schemas import Post
     from comments.schemas import Comment
 
-@strawberry.type
+@strawberry.type(directives=[CacheControl(max_age=30)])
 class Like:
+    __slots__ = ("id", "user_id", "post_id", "comment_id", "created_at")
+
     id: int
     user_id: int
     post_id: Optional[int]
@@ -1,13 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI, Depends, Request
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from strawberry.fastapi import GraphQLRouter, BaseContext
+from strawberry.fastapi import BaseContext
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Optional, Set
 import strawberry
+from strawberry.schema.config import StrawberryConfig
 
-from database import engine, get_db, Base
-from auth import get_current_user
+from database import engine, get_db, Base, Shards, shard_map
+from auth import token_user_id
 from dataloaders import DataLoaders
+from cache_control import CacheControlExtension, CachePolicy
+from graphql_router import AppGraphQLRouter
+from result_cache import ResultCacheExtension
+from query_planner import QueryPlannerExtension
+from snapshot_reads import SnapshotReadsExtension, use_wal
+from settings import BATCH_MAX_OPERATIONS, QUERY_PLANNER_ENABLED, RATE_LIMIT_ENABLED, RESULT_CACHE_ENABLED, SNAPSHOT_READS
+from rate_limit import RateLimiter, create_rate_limit_store
+from admission import Overloaded, Ticket, create_admission_controller, request_lane
+from json_encoding import encode_json, scalar_map
+from export import router as export_router
+from outbox import outbox
 
 # Import models to ensure registration with Base.metadata
 from users import models as user_models
@@ -15,6 +30,9 @@ from posts import models as post_models
 from comments import models as comment_models
 from likes import models as like_models
 from tags import models as tag_models
+from search import models as search_models
+from posts import ranking as post_ranking
+from users.follow_graph import follow_graph
 
 # Import Domain Queries and Mutations
 from users.queries import UserQuery
@@ -22,39 +40,157 @@ from users.mutations import UserMutation
 from posts.queries import PostQuery
 from comments.queries import CommentQuery
 from tags.queries import TagQuery
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+from search.queries import SearchQuery
+
+_storage_ready = False
+
+def init_storage() -> None:
+    """Create missing tables/indexes and load the in-memory follow graph (once per process tree)."""
+    global _storage_ready
+    if _storage_ready:
+        return
+    Base.metadata.create_all(bind=engine)
+    for shard in shard_map.engines:
+        Base.metadata.create_all(bind=shard)
+    if SNAPSHOT_READS:
+        for database in [engine, *shard_map.engines]:
+            use_wal(database)
+    # Before the follow graph loads: events it already reflects replay harmlessly
+    outbox.start([engine, *shard_map.engines])
+    with engine.connect() as connection:
+        follow_graph.load(connection)
+    _storage_ready = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Kept out of import time so importing the app (tests, pre-fork master) never touches the database
+    init_storage()
+    # Delivers other workers' commits to this process's caches (see outbox.py)
+    consumer = asyncio.create_task(outbox.run())
+    try:
+        yield
+    finally:
+        # Waited for, so shutdown does not leave it pending mid-delivery
+        consumer.cancel()
+        with suppress(asyncio.CancelledError):
+            await consumer
 
 class Context(BaseContext):
+    """Per-request state shared by resolvers.
+
+    `db` and the shard sessions take a pool connection at their first
+    statement, not when the context is built, and `release` hands them back
+    once the operation has resolved. The viewer is known from the token
+    (`viewer_id`); `user` reads their row the first time it is used.
+    """
+
     db: Session
-    user: Optional[user_models.User]
+    shards: Shards
+    viewer_id: Optional[int]
     loaders: DataLoaders
-
-    def __init__(self, db: Session, user: Optional[user_models.User] = None):
+    cache_policy: Optional[CachePolicy]
+    cache_tags: Set[str]
+    deadline: Optional[float]
+    plan_queries: bool
+
+    def __init__(
+        self,
+        db: Session,
+        user: Optional[user_models.User] = None,
+        deadline: Optional[float] = None,
+        shards: Optional[Shards] = None,
+        viewer_id: Optional[int] = None,
+    ):
         self.db = db
-        self.user = user
-        self.loaders = DataLoaders(db)
+        self.shards = shards if shards is not None else Shards(db)
+        self.viewer_id = user.id if user is not None else viewer_id
+        self._user = user
+        self._user_loaded = user is not None or viewer_id is None
+        self.deadline = deadline
+        self.loaders = DataLoaders(db, viewer_id=self.viewer_id, deadline=deadline, shards=self.shards)
+        if user is not None:
+            self.loaders.prime([user])
+        self.cache_policy = None
+        self.cache_tags = set()
+        # Set by QueryPlannerExtension
+        self.plan_queries = False
+
+    @property
+    def user(self) -> Optional[user_models.User]:
+        if not self._user_loaded:
+            self._user_loaded = True
+            self._user = self.db.get(user_models.User, self.viewer_id)
+            if self._user is not None:
+                self.loaders.prime([self._user])
+        return self._user
+
+    def release(self) -> None:
+        """Return the request's connections to their pools (the sessions reconnect if used again)."""
+        self.shards.close()
+        self.db.close()
+
+admission = create_admission_controller()
+
+async def admit(request: Request):
+    # Runs before the session is first used, so waiting requests hold no connection
+    if admission is None:
+        yield None
+        return
+    ticket = await admission.acquire(await request_lane(request))
+    try:
+        yield ticket
+    finally:
+        admission.release()
+
+def get_shards(db: Session = Depends(get_db)):
+    shards = Shards(db)
+    try:
+        yield shards
+    finally:
+        shards.close()
 
 async def get_context(
     request: Request,
-    db: Session = Depends(get_db)
+    ticket: Optional[Ticket] = Depends(admit),
+    db: Session = Depends(get_db),
+    shards: Shards = Depends(get_shards),
 ) -> Context:
-    authorization = request.headers.get("authorization")
-    user = await get_current_user(authorization, db)
-    return Context(db=db, user=user)
+    deadline = ticket.deadline if ticket else None
+    if deadline is not None:
+        db.info["deadline"] = deadline
+    # No query here: requests that fail validation, hit the result cache or are
+    # rate limited never take a connection
+    viewer_id = token_user_id(request.headers.get("authorization"))
+    return Context(db=db, viewer_id=viewer_id, deadline=deadline, shards=shards)
 
 @strawberry.type
-class Query(UserQuery, PostQuery, CommentQuery, TagQuery):
+class Query(UserQuery, PostQuery, CommentQuery, TagQuery, SearchQuery):
     pass
 
 @strawberry.type
 class Mutation(UserMutation):
     pass
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+extensions = [CacheControlExtension]
+if RESULT_CACHE_ENABLED:
+    extensions.append(ResultCacheExtension)
+if QUERY_PLANNER_ENABLED:
+    extensions.append(QueryPlannerExtension)
+if SNAPSHOT_READS:
+    extensions.append(SnapshotReadsExtension)
+
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=extensions,
+    config=StrawberryConfig(
+        scalar_map=scalar_map,
+        enable_experimental_incremental_execution=True,
+        batching_config={"max_operations": BATCH_MAX_OPERATIONS} if BATCH_MAX_OPERATIONS > 0 else None,
+    ),
+)
 
-app = FastAPI(title="Social Media GraphQL API")
+app = FastAPI(title="Social Media GraphQL API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -64,13 +200,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-graphql_app = GraphQLRouter(
+graphql_app = AppGraphQLRouter(
     schema,
     context_getter=get_context,
     graphql_ide="graphiql",
+    rate_limiter=RateLimiter(create_rate_limit_store()) if RATE_LIMIT_ENABLED else None,
 )
 
 app.include_router(graphql_app, prefix="/graphql")
+app.include_router(export_router)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, error: Overloaded):
+    body = {"data": None, "errors": [{"message": str(error), "extensions": {"code": "OVERLOADED"}}]}
+    return Response(
+        encode_json(body),
+        status_code=503,
+        media_type="application/json",
+        headers={"Retry-After": str(error.retry_after)},
+    )
 
 @app.get("/")
 async def root():
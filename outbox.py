@@ -0,0 +1,266 @@
+"""Transactional outbox of row changes, delivered to in-process subscribers.
+
+Every ORM flush records what it changed in outbox_events, in the same
+transaction as the change: one event per inserted, updated or deleted object
+(with the ids of the rows it points at) and one per many-to-many link added
+or removed (e.g. a follow). So an event exists exactly when its change
+committed, on the database that holds the row (the main one or a shard).
+
+Subscribers are the process's caches and derived state (result_cache.py,
+tags/dictionary.py, users/follow_graph.py, the archive catalog). They receive
+each database's events in commit order, in batches, at least once: a batch
+whose handler raises is offered to it again on the next delivery while the
+other subscribers move on, so handlers must be idempotent. Cursors are kept
+per process and start at the head when storage is initialized, since what
+they feed starts empty in a new process.
+
+A commit delivers its events before returning, so a process sees its own
+writes at once; the consumer started in the app's lifespan picks up commits
+made by other worker processes every OUTBOX_POLL_INTERVAL seconds (SQLite has
+no change notifications). Events older than OUTBOX_RETENTION are deleted.
+Core writers add events with `record` (archive.py and bulk_import.py do);
+reshard.py does not.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import JSON, Column, DateTime, Engine, Integer, String, delete, event, func, insert, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from database import Base
+from settings import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_RETENTION
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 60.0
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    # AUTOINCREMENT: ids are never reused after pruning, so cursors stay valid.
+    # SQLite's single writer makes id order the commit order.
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # mapped class, or link table for many-to-many changes
+    entity_id = Column(Integer)
+    op = Column(String, nullable=False)  # insert / update / delete
+    data = Column(JSON, nullable=False)  # {"refs": {Type: [ids]}, "row": link columns}
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+_events = OutboxEvent.__table__
+
+
+class ChangeEvent(NamedTuple):
+    id: int
+    entity: str
+    entity_id: Optional[int]
+    op: str
+    refs: Dict[str, List[int]]  # ids of the rows the changed row points at (old and new), by type
+    row: Optional[Dict[str, int]]  # the link row, for many-to-many changes
+
+
+Subscriber = Callable[[List[ChangeEvent]], None]
+
+
+class Outbox:
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._subscribers: List[Subscriber] = []
+        self._sources: List[Engine] = []
+        self._heads: Dict[str, int] = {}
+        self._cursors: Dict[str, Dict[Subscriber, int]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler: Subscriber) -> Subscriber:
+        self._subscribers.append(handler)
+        return handler
+
+    def start(self, engines: Iterable[Engine]) -> None:
+        """Deliver the events committed on `engines` from now on."""
+        self._sources = list(engines)
+        for engine in self._sources:
+            with engine.connect() as connection:
+                head = connection.execute(select(func.max(_events.c.id))).scalar() or 0
+            with self._lock:
+                self._heads[str(engine.url)] = head
+                self._cursors.pop(str(engine.url), None)
+
+    def drain(self, engine: Engine, first_id: Optional[int] = None) -> int:
+        """Deliver the events on `engine` past the subscribers' cursors; returns how many were read.
+
+        `first_id` is where delivery starts on a database `start` was not
+        called for (the first event of a commit made there).
+        """
+        key = str(engine.url)
+        read = 0
+        with self._lock:
+            if key not in self._heads:
+                if first_id is None:
+                    return 0
+                self._heads[key] = first_id - 1
+            cursors = self._cursors[key]
+            for handler in self._subscribers:
+                cursors.setdefault(handler, self._heads[key])
+            failed = set()
+            with engine.connect() as connection:
+                while True:
+                    active = [handler for handler in self._subscribers if handler not in failed]
+                    if not active:
+                        break
+                    rows = connection.execute(
+                        select(_events)
+                        .where(_events.c.id > min(cursors[handler] for handler in active))
+                        .order_by(_events.c.id)
+                        .limit(self.batch_size)
+                    ).all()
+                    if not rows:
+                        break
+                    events = [
+                        ChangeEvent(row.id, row.entity, row.entity_id, row.op, row.data.get("refs", {}), row.data.get("row"))
+                        for row in rows
+                    ]
+                    read += len(events)
+                    for handler in active:
+                        batch = [change for change in events if change.id > cursors[handler]]
+                        if not batch:
+                            continue
+                        try:
+                            handler(batch)
+                        except Exception:
+                            # Offered again from the same event on the next delivery
+                            logger.exception("outbox subscriber %s failed on events %d-%d", handler.__qualname__, batch[0].id, batch[-1].id)
+                            failed.add(handler)
+                        else:
+                            cursors[handler] = batch[-1].id
+        return read
+
+    def prune(self, engine: Engine, older_than: float = OUTBOX_RETENTION) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        with engine.begin() as connection:
+            return connection.execute(delete(_events).where(_events.c.created_at < cutoff)).rowcount
+
+    async def run(self, interval: float = OUTBOX_POLL_INTERVAL) -> None:
+        """Deliver commits made by other processes until cancelled."""
+        pruned_at = time.monotonic()
+        while True:
+            prune = time.monotonic() - pruned_at > PRUNE_INTERVAL
+            for engine in self._sources:
+                try:
+                    # On the event loop, like the readers of the caches it updates;
+                    # with nothing new this is one primary-key lookup
+                    self.drain(engine)
+                    if prune:
+                        await asyncio.to_thread(self.prune, engine)
+                except SQLAlchemyError:
+                    logger.exception("outbox delivery from %s failed", engine.url)
+            if prune:
+                pruned_at = time.monotonic()
+            await asyncio.sleep(interval)
+
+
+outbox = Outbox()
+
+
+def record(connection, events: List[dict]) -> List[int]:
+    """Insert events (`entity`, `entity_id`, `op`, `data`) in the connection's transaction; returns their ids."""
+    if not events:
+        return []
+    result = connection.execute(insert(_events).returning(_events.c.id, sort_by_parameter_order=True), events)
+    return list(result.scalars())
+
+
+def _primary_key(obj) -> Optional[int]:
+    key = inspect(obj).mapper.primary_key_from_instance(obj)
+    return key[0] if len(key) == 1 else None
+
+
+def _row_change(obj, op: str) -> dict:
+    insp = inspect(obj)
+    refs = defaultdict(set)
+    for rel in insp.mapper.relationships:
+        if rel.direction is not MANYTOONE:
+            continue
+        for column in rel.local_columns:
+            history = insp.attrs[insp.mapper.get_property_by_column(column).key].history
+            for value in chain(history.added or (), history.unchanged or (), history.deleted or ()):
+                if value is not None:
+                    refs[rel.mapper.class_.__name__].add(value)
+    return {
+        "entity": type(obj).__name__,
+        "entity_id": _primary_key(obj),
+        "op": op,
+        "data": {"refs": {target: sorted(ids) for target, ids in refs.items()}},
+    }
+
+
+def _column_values(obj, pairs) -> Dict[str, int]:
+    mapper = inspect(obj).mapper
+    return {link.name: getattr(obj, mapper.get_property_by_column(column).key) for column, link in pairs}
+
+
+def _link_changes(obj) -> Iterator[tuple]:
+    insp = inspect(obj)
+    for rel in insp.mapper.relationships:
+        if rel.secondary is None:
+            continue
+        history = insp.attrs[rel.key].history
+        for op, others in (("insert", history.added), ("delete", history.deleted)):
+            for other in others or ():
+                row = {**_column_values(obj, rel.synchronize_pairs), **_column_values(other, rel.secondary_synchronize_pairs)}
+                yield rel.secondary.name, op, tuple(sorted(row.items())), (
+                    (insp.mapper.class_.__name__, _primary_key(obj)),
+                    (rel.mapper.class_.__name__, _primary_key(other)),
+                )
+
+
+def changes(session: Session) -> List[dict]:
+    """Events for what `session` is flushing (call in after_flush: ids are set, history is kept)."""
+    events = [_row_change(obj, "insert") for obj in session.new]
+    events += [_row_change(obj, "update") for obj in session.dirty if session.is_modified(obj)]
+    events += [_row_change(obj, "delete") for obj in session.deleted]
+    # Both sides of a bidirectional relationship report the same link
+    links = {}
+    for obj in chain(session.new, session.dirty):
+        for table, op, row, ends in _link_changes(obj):
+            links[(table, op, row)] = ends
+    for (table, op, row), ends in links.items():
+        refs = defaultdict(set)
+        for target, id in ends:
+            refs[target].add(id)
+        events.append({
+            "entity": table,
+            "entity_id": None,
+            "op": op,
+            "data": {"refs": {target: sorted(ids) for target, ids in refs.items()}, "row": dict(row)},
+        })
+    return events
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    ids = record(session.connection(), changes(session))
+    if ids:
+        session.info.setdefault("outbox_first_id", ids[0])
+
+
+@event.listens_for(Session, "after_commit")
+def _deliver_on_commit(session):
+    first_id = session.info.pop("outbox_first_id", None)
+    if first_id is not None:
+        bind = session.get_bind()
+        outbox.drain(getattr(bind, "engine", bind), first_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop("outbox_first_id", None)
@@ -0,0 +1,16 @@
+from enum import Enum
+
+import strawberry
+
+
+@strawberry.enum
+class FeedOrder(Enum):
+    RECENT = "RECENT"
+    RANKED = "RANKED"
+
+
+@strawberry.enum
+class TrendingWindow(Enum):
+    HOUR = "HOUR"
+    DAY = "DAY"
+    WEEK = "WEEK"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Table, Integer
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Table, Integer, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -12,6 +12,8 @@ post_tags_table = Table(
 
 class Post(Base):
     __tablename__ = "posts"
+    # Placed on the shard of its author (see database.py)
+    __shard_keys__ = ("author_id",)
 
     id = Column(Integer, primary_key=True, index=True)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -25,3 +27,33 @@ class Post(Base):
     comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan")
     likes = relationship("Like", back_populates="post", cascade="all, delete-orphan")
     tags = relationship("Tag", secondary=post_tags_table, back_populates="posts")
+
+
+class PostScore(Base):
+    # Time-decayed engagement score per post and trending window, maintained
+    # by posts/ranking.py. Indexed so the top-K posts are an index range read.
+    __tablename__ = "post_scores"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    window = Column(String, primary_key=True)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (Index("ix_post_scores_window_score", "window", "score"),)
+
+
+class PostArchive(Base):
+    # One row per monthly partition of cold posts written by archive.py. The
+    # id ranges route reads that miss the hot tables to partitions that may
+    # hold them.
+    __tablename__ = "post_archives"
+
+    period = Column(String, primary_key=True)  # YYYY-MM of the posts' created_at
+    path = Column(Text, nullable=False)
+    min_post_id = Column(Integer, nullable=False)
+    max_post_id = Column(Integer, nullable=False)
+    min_comment_id = Column(Integer)
+    max_comment_id = Column(Integer)
+    posts = Column(Integer, nullable=False)
+    comments = Column(Integer, nullable=False)
+    likes = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
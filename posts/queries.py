@@ -1,10 +1,12 @@
 import strawberry
 from typing import Optional, List
 from posts.schemas import Post
-from posts.resolvers import resolve_post, resolve_posts, resolve_feed
+from posts.resolvers import resolve_post, resolve_posts, resolve_feed, resolve_trending_posts
+from cache_control import CacheControl, CacheScope
 
 @strawberry.type
 class PostQuery:
-    post: Optional[Post] = strawberry.field(resolver=resolve_post)
-    posts: List[Post] = strawberry.field(resolver=resolve_posts)
-    feed: List[Post] = strawberry.field(resolver=resolve_feed)
+    post: Optional[Post] = strawberry.field(resolver=resolve_post, directives=[CacheControl(max_age=60)])
+    posts: List[Post] = strawberry.field(resolver=resolve_posts, directives=[CacheControl(max_age=30)])
+    feed: List[Post] = strawberry.field(resolver=resolve_feed, directives=[CacheControl(max_age=30, scope=CacheScope.PRIVATE)])
+    trending_posts: List[Post] = strawberry.field(resolver=resolve_trending_posts, directives=[CacheControl(max_age=60)])
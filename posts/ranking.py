@@ -0,0 +1,226 @@
+# Trending scores for posts.
+#
+# An engagement event (post created, like, comment) of weight w at time t
+# contributes w * 2 ** ((t - EPOCH) / half_life) to its post's score. Every
+# score decays by the same factor as time passes, so ranking by this anchored
+# sum equals ranking by the decayed sum "as of now": scores only change when
+# events arrive and never need re-decaying. They are stored as logarithms to
+# stay within float range.
+#
+# Inserts and deletions are applied incrementally on flush. Subtracting in the
+# log domain loses the remainder when a deleted event dwarfs the rest of a
+# score; those posts are rescored from their events instead. A full rebuild
+# can be run with `python -m posts.ranking`.
+# Posts written without the ORM (e.g. by bulk_import.py) have no score row
+# until then; they rank by their own creation event (`creation_score`).
+import math
+from datetime import datetime, timedelta
+from typing import Collection, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import Base
+from posts import models
+from comments import models as comment_models
+from likes import models as like_models
+
+EPOCH = datetime(2020, 1, 1)
+
+# Trending window -> half-life in seconds
+WINDOW_HALF_LIVES = {
+    "HOUR": 3600,
+    "DAY": 24 * 3600,
+    "WEEK": 7 * 24 * 3600,
+}
+
+POST_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+
+ScoreMap = Dict[Tuple[int, str], float]
+
+
+def log_add(a: float, b: float) -> float:
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def log_sub(a: float, b: float) -> Optional[float]:
+    """log(exp(a) - exp(b)), or None when nothing measurable is left."""
+    if b >= a:
+        return None
+    remainder = a + math.log1p(-math.exp(b - a))
+    return remainder if math.isfinite(remainder) else None
+
+
+def event_log_score(when: datetime, weight: float, half_life: float) -> float:
+    return math.log(weight) + (when - EPOCH).total_seconds() * math.log(2) / half_life
+
+
+def creation_score(created_at: datetime, window: str) -> float:
+    """Score of a post with no engagement but its own creation."""
+    return event_log_score(created_at or EPOCH, POST_WEIGHT, WINDOW_HALF_LIVES[window])
+
+
+def created_since(score: float, window: str) -> datetime:
+    """Earliest creation time whose `creation_score` reaches `score`."""
+    seconds = (score - math.log(POST_WEIGHT)) * WINDOW_HALF_LIVES[window] / math.log(2)
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def accumulate(scores: ScoreMap, events: Iterable[Tuple[int, datetime, float]]) -> ScoreMap:
+    for post_id, when, weight in events:
+        when = when or datetime.utcnow()
+        for window, half_life in WINDOW_HALF_LIVES.items():
+            contribution = event_log_score(when, weight, half_life)
+            key = (post_id, window)
+            scores[key] = log_add(scores[key], contribution) if key in scores else contribution
+    return scores
+
+
+def apply_score_deltas(connection, deltas: ScoreMap, merge: bool = True) -> None:
+    if not deltas:
+        return
+    table = models.PostScore.__table__
+    current = {}
+    if merge:
+        post_ids = {post_id for post_id, _ in deltas}
+        current = {
+            (row.post_id, row.window): row.score
+            for row in connection.execute(
+                select(table.c.post_id, table.c.window, table.c.score).where(table.c.post_id.in_(post_ids))
+            )
+        }
+    rows = [
+        {
+            "post_id": post_id,
+            "window": window,
+            "score": log_add(current[(post_id, window)], delta) if (post_id, window) in current else delta,
+        }
+        for (post_id, window), delta in deltas.items()
+    ]
+    statement = sqlite_insert(table)
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.post_id, table.c.window],
+            set_={"score": statement.excluded.score},
+        ),
+        rows,
+    )
+
+
+def remove_score_deltas(connection, deltas: ScoreMap) -> Set[int]:
+    """Subtract removed engagement from stored scores.
+
+    Returns the posts whose remainder was lost, which need rescoring.
+    """
+    lost = set()
+    if not deltas:
+        return lost
+    table = models.PostScore.__table__
+    post_ids = {post_id for post_id, _ in deltas}
+    current = {
+        (row.post_id, row.window): row.score
+        for row in connection.execute(
+            select(table.c.post_id, table.c.window, table.c.score).where(table.c.post_id.in_(post_ids))
+        )
+    }
+    for (post_id, window), delta in deltas.items():
+        if (post_id, window) not in current:
+            continue
+        score = log_sub(current[(post_id, window)], delta)
+        if score is None:
+            lost.add(post_id)
+        else:
+            connection.execute(
+                table.update()
+                .where((table.c.post_id == post_id) & (table.c.window == window))
+                .values(score=score)
+            )
+    return lost
+
+
+def rebuild_post_scores(connection, post_ids: Optional[Collection[int]] = None) -> int:
+    """Recompute scores from scratch, for all posts or only `post_ids`."""
+    def only(statement, column):
+        return statement if post_ids is None else statement.where(column.in_(post_ids))
+
+    scores: ScoreMap = {}
+    accumulate(scores, (
+        (row.id, row.created_at, POST_WEIGHT)
+        for row in connection.execute(only(select(models.Post.id, models.Post.created_at), models.Post.id))
+    ))
+    accumulate(scores, (
+        (row.post_id, row.created_at, LIKE_WEIGHT)
+        for row in connection.execute(only(
+            select(like_models.Like.post_id, like_models.Like.created_at)
+            .where(like_models.Like.post_id.isnot(None)),
+            like_models.Like.post_id,
+        ))
+    ))
+    accumulate(scores, (
+        (row.post_id, row.created_at, COMMENT_WEIGHT)
+        for row in connection.execute(only(
+            select(comment_models.Comment.post_id, comment_models.Comment.created_at),
+            comment_models.Comment.post_id,
+        ))
+    ))
+    table = models.PostScore.__table__
+    connection.execute(only(delete(table), table.c.post_id))
+    apply_score_deltas(connection, scores, merge=False)
+    return len(scores)
+
+
+def _engagement_events(objects) -> Iterable[Tuple[int, datetime, float]]:
+    for obj in objects:
+        if isinstance(obj, models.Post):
+            yield obj.id, obj.created_at, POST_WEIGHT
+        elif isinstance(obj, like_models.Like) and obj.post_id:
+            yield obj.post_id, obj.created_at, LIKE_WEIGHT
+        elif isinstance(obj, comment_models.Comment):
+            yield obj.post_id, obj.created_at, COMMENT_WEIGHT
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_deleted_engagement(session, flush_context, instances):
+    # Read before the flush, while deleted likes and comments can still be loaded.
+    # Deleted posts lose their whole score row instead.
+    removed = [obj for obj in session.deleted if not isinstance(obj, models.Post)]
+    session.info["removed_engagement"] = list(_engagement_events(removed))
+
+
+@event.listens_for(Session, "after_flush")
+def _score_new_engagement(session, flush_context):
+    lost = remove_score_deltas(session.connection(), accumulate({}, session.info.pop("removed_engagement", ())))
+    deltas = accumulate({}, _engagement_events(session.new))
+    if deltas:
+        apply_score_deltas(session.connection(), deltas)
+    if lost:
+        rebuild_post_scores(session.connection(), lost)
+    deleted_posts = [obj.id for obj in session.deleted if isinstance(obj, models.Post)]
+    if deleted_posts:
+        session.connection().execute(
+            delete(models.PostScore.__table__).where(models.PostScore.__table__.c.post_id.in_(deleted_posts))
+        )
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _backfill_post_scores(target, connection, **kw):
+    table = models.PostScore.__table__
+    if connection.execute(select(table.c.post_id).limit(1)).first() is None:
+        rebuild_post_scores(connection)
+
+
+if __name__ == "__main__":
+    from database import engine, shard_map
+    from users import models as user_models  # noqa: F401 (registers User for the mappers)
+    from tags import models as tag_models  # noqa: F401
+
+    # Scores live next to their posts, so on each shard when sharding is on
+    for source in shard_map.engines or [engine]:
+        with source.begin() as connection:
+            models.PostScore.__table__.create(connection, checkfirst=True)
+            print(f"Rebuilt {rebuild_post_scores(connection)} post scores in {source.url.database}")
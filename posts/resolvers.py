@@ -1,16 +1,25 @@
-import sys
+import heapq
 import strawberry
-from typing import List, Optional, TYPE_CHECKING
+from contextlib import closing
+from functools import partial
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Sequence, TYPE_CHECKING, Union
 from posts import models
-from sqlalchemy.orm import Session # type: ignore
+from posts.enums import FeedOrder, TrendingWindow
+from posts.ranking import created_since, creation_score
+from comments.enums import CommentOrder
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query, Session # type: ignore
 
 import users.schemas as user_schemas
 import comments.schemas as comment_schemas
 import likes.schemas as like_schemas
 import tags.schemas as tag_schemas
 import posts.schemas as post_schemas
-from tags import models as tag_models
 from users import models as user_models
+from result_cache import emit_cache_tags
+from query_planner import post_plan, prefetch_posts
+from archive import IdSpace, archived_rows, with_archives
+from database import shard_map
 
 if TYPE_CHECKING:
     from users.schemas import User
@@ -19,20 +28,142 @@ if TYPE_CHECKING:
     from tags.schemas import Tag
     from posts.schemas import Post
 
+# Post lists are read in keyset pages so that `@stream` can send the first
+# items before the rest are loaded and only one page is held at a time.
+POST_PAGE_SIZE = 100
+RANKED_FEED_SIZE = 50
+# Most posts a ranked list (feed(order: RANKED), trendingPosts) returns
+MAX_RANKED_SIZE = 100
+
+def _newest_first(post: models.Post):
+    return post.created_at, post.id
+
+def _read_posts(
+    query: Query,
+    page_size: int,
+    limit: Optional[int],
+    prefetch: Optional[Callable[[List[models.Post]], None]],
+    include_archived: bool,
+) -> Iterator[models.Post]:
+    # Archive partitions follow the hot tables, each in the same order
+    with closing(with_archives(query, include_archived)) as sources:
+        for source in sources:
+            if source is not query:
+                prefetch = None  # planned reads go to the hot tables only
+            last = None
+            while True:
+                size = page_size if limit is None else min(page_size, limit)
+                if size <= 0:
+                    return
+                page_query = source
+                if last is not None:
+                    page_query = page_query.filter(or_(
+                        models.Post.created_at < last.created_at,
+                        and_(models.Post.created_at == last.created_at, models.Post.id < last.id),
+                    ))
+                page = page_query.order_by(
+                    models.Post.created_at.desc(), models.Post.id.desc()
+                ).limit(size).all()
+                if limit is not None:
+                    limit -= len(page)
+                last_page = len(page) < size or limit == 0
+                if prefetch is not None:
+                    # Only a list that fits in one page: pages are read back to back before any
+                    # field resolves, so the DataLoaders batch the children of all pages at once
+                    if last_page:
+                        prefetch(page)
+                    prefetch = None
+                yield from page
+                if last_page:
+                    break
+                last = page[-1]
+
+async def iter_posts(
+    query: Union[Query, Sequence[Query]],
+    page_size: int = POST_PAGE_SIZE,
+    limit: Optional[int] = None,
+    prefetch: Optional[Callable[[List[models.Post]], None]] = None,
+    include_archived: bool = False,
+) -> AsyncIterator["Post"]:
+    # Several queries (one per shard) are read side by side and merged, newest first
+    queries = [query] if isinstance(query, Query) else query
+    streams = [_read_posts(source, page_size, limit, prefetch, include_archived) for source in queries]
+    posts = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=_newest_first, reverse=True)
+    for count, post in enumerate(posts):
+        if limit is not None and count >= limit:
+            break
+        yield post_schemas.Post.from_db_model(post)
+
+def ranked_posts(
+    query: Union[Query, Sequence[Query]],
+    window: str,
+    first: int,
+    prefetch: Optional[Callable[[List[models.Post]], None]] = None,
+) -> List["Post"]:
+    # Top-K by precomputed score: a range read on ix_post_scores_window_score, per shard
+    first = max(0, min(first, MAX_RANKED_SIZE))
+    scored = []
+    for source in [query] if isinstance(query, Query) else query:
+        source_scored = source.join(models.PostScore, models.PostScore.post_id == models.Post.id).filter(
+            models.PostScore.window == window
+        ).add_columns(models.PostScore.score).order_by(models.PostScore.score.desc()).limit(first).all()
+        # Posts without a score row yet rank by their creation alone; once K posts are
+        # scored, only those created late enough to beat the K-th can enter the top-K
+        unscored = source.outerjoin(models.PostScore, and_(
+            models.PostScore.post_id == models.Post.id, models.PostScore.window == window
+        )).filter(models.PostScore.post_id.is_(None))
+        if first and len(source_scored) == first:
+            unscored = unscored.filter(models.Post.created_at >= created_since(source_scored[-1][1], window))
+        scored.extend(source_scored)
+        scored.extend(
+            (post, creation_score(post.created_at, window))
+            for post in unscored.order_by(models.Post.created_at.desc()).limit(first)
+        )
+    top = [post for post, _ in sorted(scored, key=lambda row: row[1], reverse=True)[:first]]
+    if prefetch is not None:
+        prefetch(top)
+    return [post_schemas.Post.from_db_model(post) for post in top]
+
+def post_queries(info: strawberry.Info, author_ids: Optional[Sequence[int]] = None) -> List[Query]:
+    """`query(Post)` on every shard, or filtered to `author_ids` on the shards holding their posts."""
+    shards = info.context.shards
+    if author_ids is None:
+        return [db.query(models.Post) for db in shards.all()]
+    if not shard_map.enabled:
+        return [shards.db.query(models.Post).filter(models.Post.author_id.in_(author_ids))]
+    return [
+        shards.session(index).query(models.Post).filter(models.Post.author_id.in_(shard_author_ids))
+        for index, shard_author_ids in shard_map.split(author_ids).items()
+    ]
+
 # Field Resolvers
 async def get_author(root: "Post", info: strawberry.Info) -> Optional["User"]:
     loaders = info.context.loaders
     user = await loaders.user_loader.load(root.author_id)
     return user_schemas.User.from_db_model(user) if user else None
 
-async def get_comments(root: "Post", info: strawberry.Info) -> List["Comment"]:
+async def get_comments(
+    root: "Post",
+    info: strawberry.Info,
+    first: Optional[int] = None,
+    order_by: Optional[CommentOrder] = None,
+) -> List["Comment"]:
     loaders = info.context.loaders
-    comments = await loaders.comments_by_post_loader.load(root.id)
+    if first is None and order_by is None:
+        comments = await loaders.comments_by_post_loader.load(root.id)
+    else:
+        first = max(0, first) if first is not None else None
+        order = (order_by or CommentOrder.OLDEST).value
+        comments = await loaders.top_comments_by_post_loader.load((root.id, first, order))
     return [comment_schemas.Comment.from_db_model(comment) for comment in comments]
 
-async def get_likes(root: "Post", info: strawberry.Info) -> List["Like"]:
+async def get_likes(root: "Post", info: strawberry.Info, first: Optional[int] = None) -> List["Like"]:
     loaders = info.context.loaders
-    likes = await loaders.likes_by_post_loader.load(root.id)
+    if first is None:
+        likes = await loaders.likes_by_post_loader.load(root.id)
+    else:
+        # Most recent likers first
+        likes = await loaders.recent_likes_by_post_loader.load((root.id, max(0, first)))
     return [like_schemas.Like.from_db_model(like) for like in likes]
 
 async def get_tags(root: "Post", info: strawberry.Info) -> List["Tag"]:
@@ -42,16 +173,20 @@ async def get_tags(root: "Post", info: strawberry.Info) -> List["Tag"]:
 
 async def get_likes_count(root: "Post", info: strawberry.Info) -> int:
     loaders = info.context.loaders
-    likes = await loaders.likes_by_post_loader.load(root.id)
-    return len(likes)
+    return await loaders.likes_count_by_post_loader.load(root.id)
+
+async def get_viewer_has_liked(root: "Post", info: strawberry.Info) -> bool:
+    if not info.context.user:
+        return False
+    return await info.context.loaders.viewer_liked_post_loader.load(root.id)
 
 # Query Resolvers
 def resolve_post(id: int, info: strawberry.Info) -> Optional["Post"]:
     if not info.context.user:
         raise Exception("Not authenticated")
     
-    db = info.context.db
-    post = db.query(models.Post).filter(models.Post.id == id).first()
+    query = info.context.shards.for_id(id).query(models.Post).filter(models.Post.id == id)
+    post = query.first() or next(iter(archived_rows(query, IdSpace.POST, id)), None)
     if not post:
         raise Exception(f"Post with id {id} not found")
     return post_schemas.Post.from_db_model(post)
@@ -59,29 +194,36 @@ def resolve_post(id: int, info: strawberry.Info) -> Optional["Post"]:
 def resolve_posts(
     info: strawberry.Info,
     author_id: Optional[int] = None,
-    tag_id: Optional[int] = None
-) -> List["Post"]:
+    tag_id: Optional[int] = None,
+    include_archived: bool = False,
+) -> AsyncIterator["Post"]:
     if not info.context.user:
         raise Exception("Not authenticated")
     
     db = info.context.db
-    query = db.query(models.Post)
-    
-    if author_id:
-        query = query.filter(models.Post.author_id == author_id)
+    plan = post_plan(info)
+    queries = post_queries(info, [author_id] if author_id else None)
     
     if tag_id:
-        query = query.join(models.Post.tags).filter(tag_models.Tag.id == tag_id)
+        # post_tags only: the tags themselves live in the main database
+        post_tags = models.post_tags_table
+        queries = [
+            query.join(post_tags, post_tags.c.post_id == models.Post.id).filter(post_tags.c.tag_id == tag_id)
+            for query in queries
+        ]
     
-    all_posts = query.order_by(models.Post.created_at.desc()).all()
-    res = [post_schemas.Post.from_db_model(post) for post in all_posts]
-    if res:
-        import sys
-        sys.stderr.write(f"DEBUG resolve_posts[0]: {res[0]}\n")
-        sys.stderr.write(f"DEBUG resolve_posts[0] dict: {res[0].__dict__}\n")
-    return res
-
-def resolve_feed(info: strawberry.Info) -> List["Post"]:
+    return iter_posts(
+        queries, prefetch=partial(prefetch_posts, info.context.loaders, db, plan), include_archived=include_archived
+    )
+
+def resolve_feed(
+    info: strawberry.Info,
+    order: FeedOrder = FeedOrder.RECENT,
+    first: Optional[int] = None,
+    include_archived: bool = False,
+    window: TrendingWindow = TrendingWindow.DAY,
+) -> Union[List["Post"], AsyncIterator["Post"]]:
+    # A ranked feed is read whole (top-K); the chronological one is streamed page by page
     current_user = info.context.user
     if not current_user:
         raise Exception("Not authenticated")
@@ -92,9 +234,23 @@ def resolve_feed(info: strawberry.Info) -> List["Post"]:
     ).first()
     
     following_ids = [u.id for u in user.following]
+    # The feed depends on who the viewer follows, which changes the viewer row
+    emit_cache_tags(info, f"User:{current_user.id}")
     
-    all_posts = db.query(models.Post).filter(
-        models.Post.author_id.in_(following_ids)
-    ).order_by(models.Post.created_at.desc()).all()
-    
-    return [post_schemas.Post.from_db_model(post) for post in all_posts]
+    plan = post_plan(info)
+    # Only the shards holding posts of followed users are read
+    queries = post_queries(info, following_ids)
+    prefetch = partial(prefetch_posts, info.context.loaders, db, plan)
+    if order == FeedOrder.RANKED:
+        return ranked_posts(queries, window.value, RANKED_FEED_SIZE if first is None else first, prefetch)
+    return iter_posts(queries, limit=first, prefetch=prefetch, include_archived=include_archived)
+
+def resolve_trending_posts(
+    info: strawberry.Info,
+    window: TrendingWindow = TrendingWindow.DAY,
+    first: int = 20,
+) -> List["Post"]:
+    if not info.context.user:
+        raise Exception("Not authenticated")
+
+    return ranked_posts(post_queries(info), window.value, first)
@@ -2,6 +2,7 @@ import strawberry
 from typing import Optional, List, TYPE_CHECKING, Annotated
 from datetime import datetime
 import posts.resolvers as resolvers
+from cache_control import CacheControl, CacheScope
 
 if TYPE_CHECKING:
     from users.schemas import User
@@ -9,8 +10,11 @@ if TYPE_CHECKING:
     from likes.schemas import Like
     from tags.schemas import Tag
 
-@strawberry.type
+@strawberry.type(directives=[CacheControl(max_age=60)])
 class Post:
+    # One instance per row in list-heavy responses; slots drop the per-instance __dict__
+    __slots__ = ("id", "author_id", "content", "image_url", "created_at", "updated_at")
+
     id: int
     author_id: int
     content: str
@@ -24,6 +28,9 @@ class Post:
     likes: List[Annotated["Like", strawberry.lazy("likes.schemas")]] = strawberry.field(resolver=resolvers.get_likes)
     tags: List[Annotated["Tag", strawberry.lazy("tags.schemas")]] = strawberry.field(resolver=resolvers.get_tags)
     likes_count: int = strawberry.field(resolver=resolvers.get_likes_count)
+    viewer_has_liked: bool = strawberry.field(
+        resolver=resolvers.get_viewer_has_liked, directives=[CacheControl(max_age=30, scope=CacheScope.PRIVATE)]
+    )
 
     @staticmethod
     def from_db_model(post) -> "Post":
@@ -0,0 +1,173 @@
+"""Up-front SQL planning for post lists (opt-in, see QUERY_PLANNER_ENABLED).
+
+Through DataLoaders alone, each relationship level of a post list is a round
+trip that waits for the level above it: the page of posts, then authors,
+tags, comments and like counts, then the comments' authors. With
+QueryPlannerExtension installed, `posts`, `feed` and `user { posts }` read
+their selection set and fetch everything it asks for as soon as their first
+page of posts is known, without waiting for the levels in between: one IN
+query each for tags and comments, one grouped count for `likesCount`, and
+one IN query for the post and comment authors not loaded earlier in the
+request. The rows prime the request's DataLoaders, so the field resolvers
+find them cached and run no SQL of their own.
+
+Only selections without arguments that resolve with the initial result are
+planned: `comments(first: 3)`, fields left out by @skip / @include, deferred
+fragments and anything not listed here still go through the loaders. So do
+lists longer than one page (POST_PAGE_SIZE): their pages are read back to
+back before any field resolves, and the loaders already batch the children
+of all of them, so planning the first page would only add statements.
+"""
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set
+
+import strawberry
+from sqlalchemy.orm import Session, object_session
+from strawberry.extensions import SchemaExtension
+from strawberry.types.nodes import SelectedField
+
+from admission import DeadlineExceeded
+from comments import models as comment_models
+from dataloaders import DataLoaders, count_likes_by_post, tags_by_post
+from posts import models as post_models
+from users import models as user_models
+
+
+@dataclass(frozen=True)
+class CommentPlan:
+    author: bool = False
+
+
+@dataclass(frozen=True)
+class PostPlan:
+    author: bool = False
+    tags: bool = False
+    likes_count: bool = False
+    comments: Optional[CommentPlan] = None
+
+
+def _resolved_now(selection) -> bool:
+    """Whether `selection` resolves with the rest of the initial result (after @skip, @include and @defer)."""
+    directives = selection.directives or {}
+    if directives.get("skip", {}).get("if") is True or directives.get("include", {}).get("if") is False:
+        return False
+    # Deferred fragments resolve after the first payload has been sent: planning them would delay it
+    return "defer" not in directives or directives["defer"].get("if") is False
+
+
+def _fields(selections: Iterable) -> Dict[str, List[SelectedField]]:
+    """Selected fields by name, with fragments flattened into their parent."""
+    fields = defaultdict(list)
+    for selection in selections:
+        if not _resolved_now(selection):
+            continue
+        if isinstance(selection, SelectedField):
+            fields[selection.name].append(selection)
+        else:  # fragment spread or inline fragment
+            for name, found in _fields(selection.selections).items():
+                fields[name].extend(found)
+    return fields
+
+
+def _plain(fields: Dict[str, List[SelectedField]], name: str) -> List[SelectedField]:
+    found = fields.get(name, [])
+    return [] if any(field.arguments for field in found) else found
+
+
+def _children(found: List[SelectedField]) -> Dict[str, List[SelectedField]]:
+    return _fields(chain.from_iterable(field.selections for field in found))
+
+
+def plan_posts(selections: Iterable) -> Optional[PostPlan]:
+    """Compile the selection set of a list of posts; None when nothing can be prefetched."""
+    fields = _fields(selections)
+    comments = _plain(fields, "comments")
+    plan = PostPlan(
+        author=bool(fields.get("author")),
+        tags=bool(fields.get("tags")),
+        likes_count=bool(fields.get("likesCount")),
+        comments=CommentPlan(author=bool(_children(comments).get("author"))) if comments else None,
+    )
+    return None if plan == PostPlan() else plan
+
+
+def post_plan(info: strawberry.Info, field: Optional[str] = None) -> Optional[PostPlan]:
+    """Plan for the posts this resolver returns, or for those under its `field` child."""
+    if not getattr(info.context, "plan_queries", False):
+        return None
+    found = info.selected_fields
+    if field is not None:
+        found = _plain(_children(found), field)
+        if not found:
+            return None
+    return plan_posts(chain.from_iterable(selected.selections for selected in found))
+
+
+def _prime_users(loaders: DataLoaders, db: Session, user_ids: Set[int]) -> None:
+    # Users repeat across pages; only those not loaded earlier in the request are fetched
+    missing = [user_id for user_id in user_ids if loaders.user_loader.cache_map.get(user_id) is None]
+    if missing:
+        found = {user.id: user for user in db.query(user_models.User).filter(user_models.User.id.in_(missing))}
+        loaders.user_loader.prime_many({user_id: found.get(user_id) for user_id in missing})
+
+
+def prefetch_posts(loaders: DataLoaders, db: Session, plan: Optional[PostPlan], posts: List[post_models.Post]) -> None:
+    """Load what `plan` selects for `posts` and prime the loaders the field resolvers read."""
+    if plan is None or not posts:
+        return
+    # Stands in for the loader batches, so it honours their deadline too
+    if loaders.deadline is not None and time.monotonic() >= loaders.deadline:
+        raise DeadlineExceeded()
+    # Post and comment authors are fetched together, last
+    user_ids = {post.author_id for post in posts} if plan.author else set()
+    # Each post's children are read from the session (shard) the post came from
+    posts_by_session = defaultdict(list)
+    for post in posts:
+        posts_by_session[object_session(post) or db].append(post)
+    for content_db, session_posts in posts_by_session.items():
+        _prefetch_children(loaders, db, content_db, plan, session_posts, user_ids)
+
+    if user_ids:
+        _prime_users(loaders, db, user_ids)
+
+
+def _prefetch_children(
+    loaders: DataLoaders,
+    db: Session,
+    content_db: Session,
+    plan: PostPlan,
+    posts: List[post_models.Post],
+    user_ids: Set[int],
+) -> None:
+    post_ids = [post.id for post in posts]
+    if plan.tags:
+        tags_map = tags_by_post(content_db, post_ids, tags_db=db)
+        loaders.tags_by_post_loader.prime_many({post_id: tags_map.get(post_id, []) for post_id in post_ids})
+
+    if plan.likes_count:
+        counts = count_likes_by_post(content_db, post_ids)
+        loaders.likes_count_by_post_loader.prime_many({post_id: counts.get(post_id, 0) for post_id in post_ids})
+
+    if plan.comments is not None:
+        Comment = comment_models.Comment
+        comments = content_db.query(Comment).filter(Comment.post_id.in_(post_ids)).all()
+        comments_map = defaultdict(list)
+        for comment in comments:
+            comments_map[comment.post_id].append(comment)
+        loaders.prime(comments)
+        if plan.comments.author:
+            user_ids.update(comment.author_id for comment in comments)
+        loaders.comments_by_post_loader.prime_many({post_id: comments_map[post_id] for post_id in post_ids})
+
+
+class QueryPlannerExtension(SchemaExtension):
+    """Lets `posts`, `feed` and `user { posts }` prefetch their selection set (see module docstring)."""
+
+    def on_execute(self):
+        context = self.execution_context.context
+        if context is not None:
+            context.plan_queries = True
+        yield
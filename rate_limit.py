@@ -0,0 +1,249 @@
+import math
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional, Protocol, Tuple
+
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLSchema,
+    InlineFragmentNode,
+    IntValueNode,
+    OperationDefinitionNode,
+    OperationType,
+    VariableNode,
+    get_named_type,
+    get_nullable_type,
+    is_composite_type,
+    is_list_type,
+    parse,
+)
+
+from settings import (
+    RATE_LIMIT_CAPACITY,
+    RATE_LIMIT_LIST_SIZE,
+    RATE_LIMIT_NESTED_LIST_SIZE,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_REFILL_PER_SECOND,
+)
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # optional, only needed for the shared store
+    redis = None
+
+# Assumed length of list fields without a `first` argument or default, and of
+# such lists inside another list
+DEFAULT_LIST_SIZE = RATE_LIMIT_LIST_SIZE
+NESTED_LIST_SIZE = RATE_LIMIT_NESTED_LIST_SIZE
+# Mutations do writes (and `login` hashes a password), so they cost more
+MUTATION_FIELD_COST = 10
+
+
+# Query cost
+#
+# Every object in the response costs 1: an object field costs 1 plus its
+# selections, and a list field multiplies that by its expected length:
+# its `first` argument or that argument's default, else the `first` of the
+# enclosing connection, else DEFAULT_LIST_SIZE, or NESTED_LIST_SIZE for a
+# list inside another list. Scalars are free.
+
+@lru_cache(maxsize=1024)
+def _parse(query: str):
+    return parse(query, no_location=True)
+
+
+def _first_argument(field_def, node: FieldNode, variables: dict) -> Optional[int]:
+    for argument in node.arguments or ():
+        if argument.name.value != "first":
+            continue
+        value = argument.value
+        # Negative values are clamped to 0, as the resolvers do
+        if isinstance(value, IntValueNode):
+            return max(0, int(value.value))
+        if isinstance(value, VariableNode) and isinstance(variables.get(value.name.value), int):
+            return max(0, variables[value.name.value])
+    if "first" in field_def.args and isinstance(field_def.args["first"].default_value, int):
+        return field_def.args["first"].default_value
+    return None
+
+
+def _selection_cost(
+    schema: GraphQLSchema,
+    parent_type,
+    selection_set,
+    fragments: Dict[str, FragmentDefinitionNode],
+    variables: dict,
+    page_size: Optional[int] = None,
+    in_list: bool = False,
+) -> int:
+    total = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            fields = getattr(parent_type, "fields", None) or {}
+            field_def = fields.get(selection.name.value)
+            if field_def is None:
+                continue
+            named_type = get_named_type(field_def.type)
+            if not is_composite_type(named_type):
+                continue
+            first = _first_argument(field_def, selection, variables)
+            is_list = is_list_type(get_nullable_type(field_def.type))
+            cost = 1
+            if selection.selection_set:
+                # A paginated connection passes its `first` on to its `edges` list
+                child_page_size = None if is_list else first
+                cost += _selection_cost(
+                    schema, named_type, selection.selection_set, fragments, variables, child_page_size, in_list or is_list
+                )
+            if is_list:
+                default_size = NESTED_LIST_SIZE if in_list else DEFAULT_LIST_SIZE
+                size = first if first is not None else page_size if page_size is not None else default_size
+                cost *= max(0, size)
+            total += cost
+        elif isinstance(selection, InlineFragmentNode):
+            condition = selection.type_condition
+            fragment_type = schema.get_type(condition.name.value) if condition else parent_type
+            total += _selection_cost(schema, fragment_type, selection.selection_set, fragments, variables, page_size, in_list)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                fragment_type = schema.get_type(fragment.type_condition.name.value)
+                total += _selection_cost(schema, fragment_type, fragment.selection_set, fragments, variables, page_size, in_list)
+    return total
+
+
+def compute_query_cost(schema: GraphQLSchema, query: str, operation_name: Optional[str] = None, variables: Optional[dict] = None) -> int:
+    document = _parse(query)
+    operations = [d for d in document.definitions if isinstance(d, OperationDefinitionNode)]
+    if operation_name is not None:
+        operations = [d for d in operations if d.name and d.name.value == operation_name]
+    if not operations:
+        return 1
+    operation = operations[0]
+    fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+
+    root_type = schema.get_root_type(operation.operation)
+    cost = 1 + _selection_cost(schema, root_type, operation.selection_set, fragments, variables or {})
+    if operation.operation == OperationType.MUTATION:
+        cost += MUTATION_FIELD_COST * len(operation.selection_set.selections)
+    return cost
+
+
+# Token bucket stores
+
+class RateLimitStore(Protocol):
+    async def take(self, key: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        """Take `cost` tokens from the bucket at `key`, or return the seconds until they are available."""
+
+
+class MemoryRateLimitStore:
+    """Per-process buckets; each worker of a multi-worker deployment limits separately."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / refill_per_second
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            # Least recently seen buckets go first; they are the most likely to be full again
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# Refill and take atomically on the Redis server, using its clock so that
+# workers on different hosts agree on elapsed time.
+_TAKE_SCRIPT = """
+local cost, capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisRateLimitStore:
+    """Buckets shared by every worker and host, kept in Redis (`pip install redis`)."""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self._take = client.register_script(_TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisRateLimitStore":
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+        return cls(redis.from_url(url), **kwargs)
+
+    async def take(self, key: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        wait = await self._take(keys=[self.prefix + key], args=[cost, capacity, refill_per_second])
+        return float(wait)
+
+
+def create_rate_limit_store() -> RateLimitStore:
+    if RATE_LIMIT_REDIS_URL:
+        return RedisRateLimitStore.from_url(RATE_LIMIT_REDIS_URL)
+    return MemoryRateLimitStore()
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, cost: int, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry in {math.ceil(retry_after)}s")
+        self.cost = cost
+        self.retry_after = retry_after
+
+
+class QueryTooExpensive(Exception):
+    def __init__(self, cost: int, capacity: float):
+        super().__init__(f"Query cost {cost} exceeds the limit of {capacity:g}")
+        self.cost = cost
+
+
+class RateLimiter:
+    """Token buckets per client (user id, else IP), charged by query cost."""
+
+    def __init__(
+        self,
+        store: Optional[RateLimitStore] = None,
+        capacity: float = RATE_LIMIT_CAPACITY,
+        refill_per_second: float = RATE_LIMIT_REFILL_PER_SECOND,
+    ):
+        self.store = store or MemoryRateLimitStore()
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+    @staticmethod
+    def client_key(request, user_id: Optional[int]) -> str:
+        if user_id is not None:
+            return f"user:{user_id}"
+        client = getattr(request, "client", None)
+        return f"ip:{client.host if client else 'unknown'}"
+
+    async def charge(self, key: str, cost: int) -> None:
+        if cost > self.capacity:
+            raise QueryTooExpensive(cost, self.capacity)
+        retry_after = await self.store.take(key, cost, self.capacity, self.refill_per_second)
+        if retry_after > 0:
+            raise RateLimitExceeded(cost, retry_after)
@@ -0,0 +1,194 @@
+"""Place posts, comments and likes on shard databases (see database.py).
+
+    python reshard.py --to sqlite:///./shards/0.db,sqlite:///./shards/1.db,sqlite:///./shards/2.db
+
+Reads the current placement (the shards in SHARD_URLS or, with sharding off,
+the main database) and gives every slot to the database jump hashing picks
+for it among the --to URLs: the slot's rows are copied there, then deleted
+at the source. Slots that stay put are not read, so going from N to N + 1
+databases moves about 1/(N + 1) of the rows. A failed run can be repeated.
+Stop writers while it runs, then set SHARD_URLS to the --to list and restart
+the servers.
+
+The first split out of the main database renumbers posts, comments and likes
+so that each id falls in its owner's slot; user ids never change.
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import Engine, delete, insert, select
+
+from comments import models as comment_models
+from database import SHARD_SLOTS, Base, jump_hash, shard_engine
+from likes import models as like_models
+import outbox  # noqa: F401 (outbox_events on new shards)
+from posts import models as post_models
+from search import models as search_models  # noqa: F401 (full-text indexes on new shards)
+from tags import models as tag_models  # noqa: F401 (registers Tag for the mappers)
+from users import models as user_models  # noqa: F401
+
+CHUNK_SIZE = 500
+
+_posts = post_models.Post.__table__
+_post_tags = post_models.post_tags_table
+_post_scores = post_models.PostScore.__table__
+_comments = comment_models.Comment.__table__
+_likes = like_models.Like.__table__
+# Tables kept on the shards, parents first, with the column whose slot places each row
+SHARDED_TABLES = [
+    (_posts, _posts.c.id),
+    (_post_tags, _post_tags.c.post_id),
+    (_post_scores, _post_scores.c.post_id),
+    (_comments, _comments.c.id),
+    (_likes, _likes.c.id),
+]
+
+
+@dataclass
+class ReshardReport:
+    slots: int = 0
+    rows: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    skipped: int = 0  # rows pointing at a post or comment that no longer exists
+
+
+def placement(count: int) -> List[int]:
+    return [jump_hash(slot, count) for slot in range(SHARD_SLOTS)]
+
+
+def move_slots(sources: Sequence[Engine], targets: Sequence[Engine], report: ReshardReport) -> None:
+    """Move the slots whose database differs between the two placements."""
+    before, after = placement(len(sources)), placement(len(targets))
+    routes = defaultdict(list)
+    for slot in range(SHARD_SLOTS):
+        if str(sources[before[slot]].url) != str(targets[after[slot]].url):
+            routes[(before[slot], after[slot])].append(slot)
+
+    for (source_index, target_index), slots in routes.items():
+        with sources[source_index].connect() as source, targets[target_index].begin() as target:
+            for table, column in SHARDED_TABLES:
+                result = source.execution_options(yield_per=CHUNK_SIZE).execute(
+                    select(table).where((column % SHARD_SLOTS).in_(slots))
+                )
+                for rows in result.partitions():
+                    # OR IGNORE: rows copied by a run that failed before deleting them
+                    target.execute(insert(table).prefix_with("OR IGNORE"), [row._asdict() for row in rows])
+                    report.rows[table.name] += len(rows)
+        with sources[source_index].begin() as source:
+            for table, column in reversed(SHARDED_TABLES):
+                source.execute(delete(table).where((column % SHARD_SLOTS).in_(slots)))
+        report.slots += len(slots)
+
+
+def split_main(main: Engine, targets: Sequence[Engine], report: ReshardReport) -> None:
+    """Copy the main database's posts, comments and likes to the shards under new ids, then delete them."""
+    after = placement(len(targets))
+    handed_out: Dict[tuple, int] = defaultdict(int)
+
+    def new_id(table: str, slot: int) -> int:
+        # Ids of a slot count up from SHARD_SLOTS + slot, so none is 0
+        handed_out[(table, slot)] += 1
+        return handed_out[(table, slot)] * SHARD_SLOTS + slot
+
+    with main.connect() as source:
+        post_ids = {
+            id: new_id("posts", author_id % SHARD_SLOTS)
+            for id, author_id in source.execute(select(_posts.c.id, _posts.c.author_id).order_by(_posts.c.id))
+        }
+        comment_ids = {
+            id: new_id("comments", post_ids[post_id] % SHARD_SLOTS)
+            for id, post_id in source.execute(select(_comments.c.id, _comments.c.post_id).order_by(_comments.c.id))
+            if post_id in post_ids
+        }
+
+        def like_ids(row: dict) -> Optional[dict]:
+            post_id, comment_id = post_ids.get(row["post_id"]), comment_ids.get(row["comment_id"])
+            owner = post_id or comment_id
+            if owner is None:
+                return None
+            return {**row, "id": new_id("likes", owner % SHARD_SLOTS), "post_id": post_id, "comment_id": comment_id}
+
+        def comment_row(row: dict) -> Optional[dict]:
+            if row["id"] not in comment_ids:
+                return None
+            parent = row["parent_comment_id"]
+            return {**row, "id": comment_ids[row["id"]], "post_id": post_ids[row["post_id"]],
+                    "parent_comment_id": comment_ids.get(parent) if parent is not None else None}
+
+        def by_post(row: dict) -> Optional[dict]:
+            return {**row, "post_id": post_ids[row["post_id"]]} if row["post_id"] in post_ids else None
+
+        renumber: Dict[str, Callable[[dict], Optional[dict]]] = {
+            "posts": lambda row: {**row, "id": post_ids[row["id"]]},
+            "post_tags": by_post,
+            "post_scores": by_post,
+            "comments": comment_row,
+            "likes": like_ids,
+        }
+        with ExitStack() as stack:
+            connections = [stack.enter_context(target.begin()) for target in targets]
+            for table, column in SHARDED_TABLES:
+                result = source.execution_options(yield_per=CHUNK_SIZE).execute(
+                    select(table).order_by(*table.primary_key.columns)
+                )
+                for rows in result.partitions():
+                    by_shard = defaultdict(list)
+                    for row in rows:
+                        moved = renumber[table.name](row._asdict())
+                        if moved is None:
+                            report.skipped += 1
+                            continue
+                        by_shard[after[moved[column.name] % SHARD_SLOTS]].append(moved)
+                    for index, shard_rows in by_shard.items():
+                        connections[index].execute(insert(table).prefix_with("OR IGNORE"), shard_rows)
+                        report.rows[table.name] += len(shard_rows)
+
+    with main.begin() as connection:
+        for table, _ in reversed(SHARDED_TABLES):
+            connection.execute(delete(table))
+    report.slots = SHARD_SLOTS
+
+
+def reshard(main: Engine, sources: Sequence[Engine], urls: Sequence[str]) -> ReshardReport:
+    """Place the slots on the databases at `urls`, from `sources` (the current shards, or none for the main database)."""
+    targets = [shard_engine(url) for url in urls]
+    for target in targets:
+        Base.metadata.create_all(bind=target)
+    report = ReshardReport()
+    if sources:
+        move_slots(sources, targets, report)
+    else:
+        split_main(main, targets, report)
+    for target in targets:
+        target.dispose()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", required=True, metavar="URLS", help="comma-separated shard database URLs")
+    args = parser.parse_args(argv)
+    urls = [url.strip() for url in args.to.split(",") if url.strip()]
+    if not urls:
+        parser.error("--to needs at least one database URL")
+
+    from database import engine, shard_map
+
+    started = time.perf_counter()
+    report = reshard(engine, shard_map.engines, urls)
+    elapsed = time.perf_counter() - started
+
+    for table, _ in SHARDED_TABLES:
+        print(f"{table.name:<12}{report.rows[table.name]:>10} rows moved")
+    if report.skipped:
+        print(f"{report.skipped} rows skipped: their post or comment no longer exists", file=sys.stderr)
+    print(f"\n{report.slots} of {SHARD_SLOTS} slots placed in {elapsed:.1f}s. Set SHARD_URLS={','.join(urls)} and restart the servers.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from inspect import isawaitable
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from graphql import get_named_type, is_abstract_type, is_list_type, is_object_type, parse, print_ast
+from graphql.type import get_nullable_type
+from strawberry.extensions import SchemaExtension
+from strawberry.types import ExecutionResult
+
+from cache_control import CacheScope, compute_cache_policy
+from json_encoding import decode_json, encode_json
+from outbox import ChangeEvent, outbox
+from settings import RESULT_CACHE_MAX_ENTRIES
+
+
+class ResultCache:
+    """Bounded LRU of serialized results with per-entry TTL and entity-tag invalidation."""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, bytes, frozenset]]" = OrderedDict()
+        self._keys_by_tag: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, payload, _ = entry
+        if expires_at <= time.monotonic():
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: bytes, ttl: float, tags: Iterable[str]) -> None:
+        self._discard(key)
+        tags = frozenset(tags)
+        self._entries[key] = (time.monotonic() + ttl, payload, tags)
+        for tag in tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        keys = set()
+        for tag in tags:
+            keys |= self._keys_by_tag.pop(tag, set())
+        for key in keys:
+            self._discard(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_tag.clear()
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+result_cache = ResultCache(max_entries=RESULT_CACHE_MAX_ENTRIES)
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str:
+    return print_ast(parse(query, no_location=True))
+
+
+def make_cache_key(query: str, variables: Optional[dict], operation_name: Optional[str], scope_key: str) -> str:
+    raw = json.dumps(
+        [normalize_query(query), operation_name, variables or {}, scope_key],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def emit_cache_tags(info, *tags: str) -> None:
+    """Attach extra invalidation tags (e.g. `User:7`) to the cached result of this request."""
+    cache_tags = getattr(info.context, "cache_tags", None)
+    if cache_tags is not None:
+        cache_tags.update(tags)
+
+
+def _entity_tags(info, value) -> Iterable[str]:
+    return_type = get_nullable_type(info.return_type)
+    if is_list_type(return_type):
+        named = get_named_type(return_type)
+        if is_object_type(named):
+            yield named.name
+            for item in value or ():
+                item_id = getattr(item, "id", None)
+                if item_id is not None:
+                    yield f"{named.name}:{item_id}"
+    elif is_object_type(return_type) and value is not None:
+        item_id = getattr(value, "id", None)
+        if item_id is not None:
+            yield f"{return_type.name}:{item_id}"
+    elif is_abstract_type(return_type) and value is not None:
+        definition = getattr(value, "__strawberry_definition__", None)
+        item_id = getattr(value, "id", None)
+        if definition is not None and item_id is not None:
+            yield f"{definition.name}:{item_id}"
+
+
+class ResultCacheExtension(SchemaExtension):
+    """Opt-in cache of full query results keyed by operation, variables and viewer.
+
+    TTL and viewer scope come from the `@cacheControl` policy of the
+    operation; anonymous requests and uncacheable operations bypass the
+    cache. Every object resolved while filling an entry tags it with
+    `Type:id` (and list fields with `Type`), and committed writes invalidate
+    the matching tags as their outbox events arrive (see outbox.py).
+    """
+
+    def __init__(self, *, cache: Optional[ResultCache] = None):
+        self.cache = cache or result_cache
+        self._key: Optional[str] = None
+        self._ttl = 0
+
+    def on_execute(self):
+        execution_context = self.execution_context
+        context = execution_context.context
+        self._key = None
+        # The token's user id: a cache hit never loads the viewer from the database
+        viewer_id = getattr(context, "viewer_id", None)
+
+        if viewer_id is not None and execution_context.query:
+            policy = compute_cache_policy(
+                execution_context.schema._schema,
+                execution_context.query,
+                execution_context.operation_name,
+            )
+            if policy.cacheable:
+                scope_key = "public" if policy.scope == CacheScope.PUBLIC else f"user:{viewer_id}"
+                self._key = make_cache_key(
+                    execution_context.query,
+                    execution_context.variables,
+                    execution_context.operation_name,
+                    scope_key,
+                )
+                self._ttl = policy.max_age
+                payload = self.cache.get(self._key)
+                if payload is not None:
+                    execution_context.result = ExecutionResult(data=decode_json(payload), errors=None)
+                    self._key = None
+
+        yield
+
+        result = execution_context.result
+        # Incremental (@defer/@stream) results have no single `data` payload to store
+        if self._key is not None and hasattr(result, "data") and not result.errors:
+            payload = encode_json(result.data)
+            self.cache.set(self._key, payload, self._ttl, getattr(context, "cache_tags", ()))
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        result = _next(root, info, *args, **kwargs)
+        if self._key is None:
+            return result
+        if isawaitable(result):
+            return self._collect_async(result, info)
+        return self._collect(info, result)
+
+    async def _collect_async(self, awaitable, info):
+        return self._collect(info, await awaitable)
+
+    def _collect(self, info, value):
+        cache_tags = getattr(info.context, "cache_tags", None)
+        if cache_tags is None:
+            return value
+        if hasattr(value, "__aiter__"):
+            # Streamed lists are tagged item by item as they are consumed
+            cache_tags.update(_entity_tags(info, ()))
+            return self._tag_items(info, value, cache_tags)
+        cache_tags.update(_entity_tags(info, value))
+        return value
+
+    async def _tag_items(self, info, items, cache_tags):
+        type_name = get_named_type(info.return_type).name
+        async for item in items:
+            item_id = getattr(item, "id", None)
+            if item_id is not None:
+                cache_tags.add(f"{type_name}:{item_id}")
+            yield item
+
+
+def _event_tags(change: ChangeEvent) -> Set[str]:
+    tags = {f"{target}:{id}" for target, ids in change.refs.items() for id in ids}
+    if change.row is None:
+        if change.op != "insert" and change.entity_id is not None:
+            tags.add(f"{change.entity}:{change.entity_id}")
+        if change.op != "update":
+            # Inserts and deletes change every list the entity appears in
+            tags.add(change.entity)
+    return tags
+
+
+@outbox.subscribe
+def _invalidate_changes(events: List[ChangeEvent]) -> None:
+    result_cache.invalidate(set().union(*map(_event_tags, events)))
@@ -0,0 +1,57 @@
+from sqlalchemy import event, text
+from database import Base
+
+# FTS5 indexes over posts.content and comments.content. They are external
+# content tables (the text lives only in `posts`/`comments`) kept in sync by
+# triggers, so every write path, ORM or not, updates the index.
+SEARCH_INDEXES = {
+    "posts_fts": "posts",
+    "comments_fts": "comments",
+}
+
+
+def _index_ddl(index: str, table: str) -> list:
+    return [
+        f"""CREATE VIRTUAL TABLE {index} USING fts5(
+            content, content='{table}', content_rowid='id',
+            tokenize='porter unicode61', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index}(rowid, content) VALUES (new.id, new.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE OF content ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO {index}(rowid, content) VALUES (new.id, new.content);
+        END""",
+        # Index rows that existed before the index did
+        f"INSERT INTO {index}({index}) VALUES ('rebuild')",
+    ]
+
+
+def create_search_indexes(connection) -> None:
+    for index, table in SEARCH_INDEXES.items():
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": index},
+        ).first()
+        if exists:
+            continue
+        for statement in _index_ddl(index, table):
+            connection.execute(text(statement))
+
+
+def drop_search_indexes(connection) -> None:
+    """Drop the indexes and their triggers, e.g. for a bulk load; `create_search_indexes` rebuilds them."""
+    for index, table in SEARCH_INDEXES.items():
+        for suffix in ("ai", "ad", "au"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {index}_{suffix}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {index}"))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_indexes(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        create_search_indexes(connection)
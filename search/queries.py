@@ -0,0 +1,8 @@
+import strawberry
+from search.schemas import SearchConnection
+from search.resolvers import resolve_search
+from cache_control import CacheControl
+
+@strawberry.type
+class SearchQuery:
+    search: SearchConnection = strawberry.field(resolver=resolve_search, directives=[CacheControl(max_age=30)])
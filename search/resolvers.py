@@ -0,0 +1,145 @@
+import base64
+import heapq
+import json
+import re
+from itertools import islice
+import strawberry
+from typing import Annotated, List, Optional, Tuple, TYPE_CHECKING
+from sqlalchemy import text
+
+import posts.schemas
+import comments.schemas
+import search.schemas
+from result_cache import emit_cache_tags
+
+if TYPE_CHECKING:
+    from search.schemas import SearchConnection, SearchType
+
+MAX_PAGE_SIZE = 100
+
+# kind, FTS index, content table, column holding the post id (for tag filters)
+SEARCH_SOURCES = {
+    "post": ("posts_fts", "posts", "posts.id"),
+    "comment": ("comments_fts", "comments", "comments.post_id"),
+}
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def build_match_expression(query: str) -> Optional[str]:
+    # Quote every term so user input can't use FTS5 syntax; the last term is
+    # matched as a prefix for search-as-you-type.
+    terms = _TOKEN.findall(query.lower())
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+def encode_cursor(rank: float, kind: str, id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, kind, id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[float, str, int]:
+    try:
+        rank, kind, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), str(kind), int(id)
+    except (ValueError, TypeError):
+        raise Exception("Invalid cursor")
+
+def _source_sql(kind: str, author_id: Optional[int], tag_id: Optional[int]) -> str:
+    index, table, post_id_column = SEARCH_SOURCES[kind]
+    where = [f"{index} MATCH :match"]
+    if author_id:
+        where.append(f"{table}.author_id = :author_id")
+    if tag_id:
+        where.append(
+            f"EXISTS (SELECT 1 FROM post_tags WHERE post_tags.post_id = {post_id_column}"
+            " AND post_tags.tag_id = :tag_id)"
+        )
+    return (
+        f"SELECT '{kind}' AS kind, {table}.id AS id, bm25({index}) AS rank"
+        f" FROM {index} JOIN {table} ON {table}.id = {index}.rowid"
+        f" WHERE {' AND '.join(where)}"
+    )
+
+def search_ids(
+    db,
+    match: str,
+    kinds: List[str],
+    first: int,
+    after: Optional[Tuple[float, str, int]] = None,
+    author_id: Optional[int] = None,
+    tag_id: Optional[int] = None,
+) -> List[Tuple[str, int, float]]:
+    # Keyset pagination over (rank, kind, id); bm25() is lower for better matches
+    union = " UNION ALL ".join(_source_sql(kind, author_id, tag_id) for kind in kinds)
+    sql = f"SELECT kind, id, rank FROM ({union})"
+    params = {"match": match, "author_id": author_id, "tag_id": tag_id, "limit": first}
+    if after is not None:
+        sql += (
+            " WHERE rank > :after_rank OR (rank = :after_rank AND"
+            " (kind > :after_kind OR (kind = :after_kind AND id > :after_id)))"
+        )
+        params.update(after_rank=after[0], after_kind=after[1], after_id=after[2])
+    sql += " ORDER BY rank, kind, id LIMIT :limit"
+    return [tuple(row) for row in db.execute(text(sql), params)]
+
+# Query Resolvers
+async def resolve_search(
+    info: strawberry.Info,
+    query: str,
+    type: Optional[Annotated["SearchType", strawberry.lazy("search.schemas")]] = None,
+    first: int = 20,
+    after: Optional[str] = None,
+    author_id: Optional[int] = None,
+    tag_id: Optional[int] = None,
+) -> Annotated["SearchConnection", strawberry.lazy("search.schemas")]:
+    if not info.context.user:
+        raise Exception("Not authenticated")
+
+    # Any new post or comment may change the results
+    emit_cache_tags(info, "Post", "Comment")
+    first = max(1, min(first, MAX_PAGE_SIZE))
+    match = build_match_expression(query)
+    if match is None:
+        return search.schemas.SearchConnection(
+            edges=[], page_info=search.schemas.PageInfo(has_next_page=False, end_cursor=None)
+        )
+
+    kinds = [type.value] if type else list(SEARCH_SOURCES)
+    # Each shard indexes its own posts and comments; their best matches are merged
+    shard_rows = [
+        search_ids(
+            db,
+            match,
+            kinds,
+            first + 1,
+            after=decode_cursor(after) if after else None,
+            author_id=author_id,
+            tag_id=tag_id,
+        )
+        for db in info.context.shards.all()
+    ]
+    rows = list(islice(heapq.merge(*shard_rows, key=lambda row: (row[2], row[0], row[1])), first + 1))
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+
+    loaders = info.context.loaders
+    post_rows = await loaders.post_loader.load_many([id for kind, id, _ in rows if kind == "post"])
+    comment_rows = await loaders.comment_loader.load_many([id for kind, id, _ in rows if kind == "comment"])
+    nodes = {
+        **{("post", p.id): posts.schemas.Post.from_db_model(p) for p in post_rows if p},
+        **{("comment", c.id): comments.schemas.Comment.from_db_model(c) for c in comment_rows if c},
+    }
+
+    edges = [
+        search.schemas.SearchEdge(cursor=encode_cursor(rank, kind, id), score=-rank, node=nodes[(kind, id)])
+        for kind, id, rank in rows
+        if (kind, id) in nodes
+    ]
+    return search.schemas.SearchConnection(
+        edges=edges,
+        page_info=search.schemas.PageInfo(
+            has_next_page=has_next_page,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
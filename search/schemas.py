@@ -0,0 +1,30 @@
+import strawberry
+from enum import Enum
+from typing import Optional, List, Union, Annotated
+from posts.schemas import Post
+from comments.schemas import Comment
+from cache_control import CacheControl
+
+@strawberry.enum
+class SearchType(Enum):
+    POST = "post"
+    COMMENT = "comment"
+
+SearchResult = Annotated[Union[Post, Comment], strawberry.union("SearchResult")]
+
+@strawberry.type(directives=[CacheControl(max_age=30)])
+class PageInfo:
+    has_next_page: bool
+    end_cursor: Optional[str]
+
+@strawberry.type(directives=[CacheControl(max_age=30)])
+class SearchEdge:
+    cursor: str
+    # BM25 relevance, higher is better
+    score: float
+    node: SearchResult = strawberry.field(directives=[CacheControl(max_age=30)])
+
+@strawberry.type(directives=[CacheControl(max_age=30)])
+class SearchConnection:
+    edges: List[SearchEdge]
+    page_info: PageInfo
@@ -0,0 +1,187 @@
+"""Production entry point: a pre-forking master running N uvicorn workers.
+
+The app (models, schema, follow graph, tag dictionary) is imported and warmed
+up once in the master, then forked so workers share it copy-on-write. Each
+worker drops the inherited connection pools and serves the shared listening
+socket with its own event loop.
+
+Signals to the master:
+    TERM / INT  graceful shutdown (workers finish in-flight requests)
+    HUP         rolling restart, one worker at a time
+    TTIN / TTOU add / remove a worker
+
+Usage: python serve.py [--workers N] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+GRACEFUL_TIMEOUT = 30.0
+WARM_UP_QUERY = "query { __typename }"
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def warm_up(app) -> None:
+    """Run a request through the full stack so lazily built state exists before fork."""
+    from database import SessionLocal
+    from tags.dictionary import tag_dictionary
+
+    async def request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://warm-up") as client:
+            await client.get("/")
+            await client.post("/graphql", json={"query": WARM_UP_QUERY})
+
+    asyncio.run(request())
+    with SessionLocal() as db:
+        tag_dictionary.all(db)
+
+
+def run_worker(app, sock: socket.socket, max_requests: Optional[int]) -> None:
+    from archive import forget_partition_engines
+    from database import engine, shard_map
+
+    # Never reuse the master's SQLite connections in a child (init_storage
+    # opened some on every shard too); close=False leaves them alone for the
+    # master instead of closing them under it.
+    for inherited in [engine, *shard_map.engines]:
+        inherited.dispose(close=False)
+    forget_partition_engines()
+
+    # uvicorn installs its own handlers while serving and re-raises the
+    # signal afterwards; ignoring it here lets the worker exit cleanly.
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+        signal.signal(sig, signal.SIG_IGN)
+
+    config = uvicorn.Config(app, lifespan="on", limit_max_requests=max_requests, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, workers: int, graceful_timeout: float = GRACEFUL_TIMEOUT, max_requests: Optional[int] = None):
+        self.app = app
+        self.sock = sock
+        self.target = workers
+        self.graceful_timeout = graceful_timeout
+        self.max_requests = max_requests
+        self.workers: Dict[int, float] = {}  # pid -> started at
+        self.signals: List[int] = []
+        self.stopping = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(self.app, self.sock, self.max_requests)
+            except BaseException:
+                status = 1
+                import traceback
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        self.workers[pid] = time.monotonic()
+        return pid
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.pop(pid, None)
+
+    def stop_worker(self, pid: int) -> None:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def wait_for(self, pids, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while any(pid in self.workers for pid in pids) and time.monotonic() < deadline:
+            time.sleep(0.05)
+            self.reap()
+        for pid in pids:
+            if pid in self.workers:
+                os.kill(pid, signal.SIGKILL)
+        self.reap()
+
+    def rolling_restart(self) -> None:
+        for pid in list(self.workers):
+            self.spawn()
+            self.stop_worker(pid)
+            self.wait_for([pid], self.graceful_timeout)
+
+    def handle_signal(self, sig: int, frame) -> None:
+        self.signals.append(sig)
+
+    def run(self) -> None:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(sig, self.handle_signal)
+
+        while not self.stopping:
+            while self.signals:
+                sig = self.signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT):
+                    self.stopping = True
+                elif sig == signal.SIGHUP:
+                    self.rolling_restart()
+                elif sig == signal.SIGTTIN:
+                    self.target += 1
+                elif sig == signal.SIGTTOU and self.target > 1:
+                    self.target -= 1
+                    self.stop_worker(max(self.workers, key=self.workers.get))
+            if self.stopping:
+                break
+            self.reap()
+            # Replace crashed or recycled (max_requests) workers
+            while len(self.workers) < self.target:
+                self.spawn()
+            time.sleep(0.1)
+
+        pids = list(self.workers)
+        for pid in pids:
+            self.stop_worker(pid)
+        self.wait_for(pids, self.graceful_timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT)
+    parser.add_argument("--max-requests", type=int, default=None, help="recycle a worker after this many requests")
+    args = parser.parse_args(argv)
+
+    from main import app, init_storage
+
+    # Done before fork so workers inherit the loaded follow graph instead of each building one
+    init_storage()
+    warm_up(app)
+    sock = bind_socket(args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers (master pid {os.getpid()})", file=sys.stderr)
+    Master(app, sock, args.workers, args.graceful_timeout, args.max_requests).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Server-side full-result cache (see result_cache.py)
+RESULT_CACHE_ENABLED = _env_bool("RESULT_CACHE_ENABLED")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+
+# Prefetch the selection set of post lists with planned SQL (see query_planner.py)
+QUERY_PLANNER_ENABLED = _env_bool("QUERY_PLANNER_ENABLED")
+
+# Run each query operation's reads in one read-only snapshot transaction
+# (see snapshot_reads.py); switches SQLite databases to WAL mode
+SNAPSHOT_READS = _env_bool("SNAPSHOT_READS")
+
+# Seconds before the in-process tag dictionary is reloaded (see tags/dictionary.py)
+TAG_DICTIONARY_TTL = float(os.getenv("TAG_DICTIONARY_TTL", "300"))
+
+# Cost-based rate limiting per user / client IP (see rate_limit.py)
+RATE_LIMIT_ENABLED = _env_bool("RATE_LIMIT_ENABLED")
+RATE_LIMIT_CAPACITY = float(os.getenv("RATE_LIMIT_CAPACITY", "5000"))
+RATE_LIMIT_REFILL_PER_SECOND = float(os.getenv("RATE_LIMIT_REFILL_PER_SECOND", "100"))
+# Assumed length of list fields without `first`: top-level lists are pages of
+# posts and the like, lists nested in a list (likes, comments, replies of each
+# item) are usually short
+RATE_LIMIT_LIST_SIZE = int(os.getenv("RATE_LIMIT_LIST_SIZE", "50"))
+RATE_LIMIT_NESTED_LIST_SIZE = int(os.getenv("RATE_LIMIT_NESTED_LIST_SIZE", "5"))
+# Share buckets between workers/hosts through Redis, e.g. redis://localhost:6379/0
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+
+# Admission control around /graphql (see admission.py). Keep max in-flight at
+# or below the connection pool (5 + 10 overflow) so admitted requests never
+# block the event loop waiting for a connection; 0 disables admission.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "10"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+# Seconds from arrival (queue time included) before resolvers, DataLoader batches and SQL are aborted
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10"))
+
+# Most operations accepted in one batched (JSON array) request; 0 disables batching
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "10"))
+
+# Monthly partitions of cold posts written by archive.py. Partitions are
+# decompressed into ARCHIVE_CACHE_DIR (default ARCHIVE_DIR/.cache) on first read.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_CACHE_DIR = os.getenv("ARCHIVE_CACHE_DIR")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+# Seconds before a worker notices partitions written by another process
+ARCHIVE_CATALOG_TTL = float(os.getenv("ARCHIVE_CATALOG_TTL", "30"))
+
+# Shard databases for posts, comments and likes (see database.py), comma
+# separated, e.g. sqlite:///./shards/0.db,sqlite:///./shards/1.db. Empty keeps
+# everything in the main database; change it only together with reshard.py.
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+
+# Change events written with each transaction (see outbox.py). Commits made by
+# other worker processes are picked up every OUTBOX_POLL_INTERVAL seconds;
+# events are deleted after OUTBOX_RETENTION seconds.
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", "3600"))
+
+# Rows fetched per server-side cursor batch by the /export endpoint (see export.py)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Usernames allowed to export whole tables, comma separated; empty disables /export
+EXPORT_USERS = [name.strip() for name in os.getenv("EXPORT_USERS", "").split(",") if name.strip()]
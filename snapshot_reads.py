@@ -0,0 +1,74 @@
+"""Snapshot-consistent reads for query operations (opt-in, see SNAPSHOT_READS).
+
+Without it, every SELECT a request runs through SQLite is its own implicit
+transaction: `post`, `likesCount` and `likes` come from different loader
+batches and can see different states of the database while writes commit in
+between, e.g. a like count that disagrees with the likes listed next to it.
+
+With SnapshotReadsExtension installed, the session of a query operation
+starts a real, read-only transaction at its first statement (`BEGIN` with
+`PRAGMA query_only` on SQLite, `REPEATABLE READ READ ONLY` elsewhere) and
+keeps it, on the one connection the session holds, until the request
+releases the session. Every read then sees the database as of that first
+statement. SQLite needs WAL mode for this, so that long readers never block
+writers; `use_wal` switches a database over (it persists in the file).
+
+A shard session (see database.py) gets a snapshot of its own shard, so
+reads are consistent per database, not across shards. Mutations are not
+affected; a batch that mixes them with queries it has already started
+reading for is refused.
+"""
+from graphql import GraphQLError
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+from strawberry.extensions import SchemaExtension
+from strawberry.types import ExecutionResult
+from strawberry.types.graphql import OperationType
+
+
+def use_wal(engine: Engine) -> None:
+    with engine.connect() as connection:
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+
+class SnapshotReadsExtension(SchemaExtension):
+    """Runs each query operation's reads in one read-only snapshot (see module docstring)."""
+
+    def on_execute(self):
+        execution_context = self.execution_context
+        db = getattr(execution_context.context, "db", None)
+        if db is not None:
+            if execution_context.operation_type == OperationType.QUERY:
+                # A session that already began (an earlier operation of a batch) keeps its transaction
+                if not db.in_transaction():
+                    db.info["snapshot"] = True
+            elif db.info.get("snapshot") and db.in_transaction():
+                execution_context.result = ExecutionResult(data=None, errors=[GraphQLError(
+                    "Mutations cannot run in a batch with queries under snapshot reads",
+                    extensions={"code": "SNAPSHOT_READ_ONLY"},
+                )])
+            else:
+                db.info.pop("snapshot", None)
+        yield
+
+
+@event.listens_for(Session, "after_begin")
+def _begin_snapshot(session, transaction, connection):
+    if not session.info.get("snapshot"):
+        return
+    if connection.dialect.name == "sqlite":
+        # pysqlite sends no BEGIN before a SELECT; the snapshot is taken at the first read
+        connection.exec_driver_sql("BEGIN")
+        connection.exec_driver_sql("PRAGMA query_only = ON")
+        connection.connection.info["query_only"] = True
+    else:
+        connection.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+
+@event.listens_for(Pool, "checkin")
+def _end_query_only(dbapi_connection, connection_record):
+    # The transaction was rolled back on return to the pool
+    if dbapi_connection is not None and connection_record.info.pop("query_only", False):
+        dbapi_connection.execute("PRAGMA query_only = OFF")
@@ -0,0 +1,64 @@
+# Process-wide id -> tag dictionary. Tags are few and rarely change, so
+# `Post.tags` and `tags` resolve from memory. Committed tag writes clear it
+# (through the outbox, from any process); the TTL bounds staleness from
+# writes that record no outbox events. Ids still unknown after a reload, e.g.
+# a dangling post_tags row, are remembered until the next load, so they do
+# not force a reload on every lookup.
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from outbox import ChangeEvent, outbox
+from settings import TAG_DICTIONARY_TTL
+from tags import models
+
+
+class TagEntry(NamedTuple):
+    id: int
+    name: str
+
+
+class TagDictionary:
+    def __init__(self, ttl: float = TAG_DICTIONARY_TTL):
+        self.ttl = ttl
+        self._tags: Optional[Dict[int, TagEntry]] = None
+        self._missing: Set[int] = set()
+        self._loaded_at = 0.0
+
+    def all(self, db: Session) -> List[TagEntry]:
+        return list(self._load(db).values())
+
+    def get_many(self, db: Session, ids: Iterable[int]) -> List[TagEntry]:
+        ids = list(ids)
+        loaded_at = self._loaded_at
+        tags = self._load(db)
+        unknown = [tag_id for tag_id in ids if tag_id not in tags and tag_id not in self._missing]
+        if unknown:
+            if self._loaded_at == loaded_at:
+                # Created since the last load, e.g. by another process
+                tags = self._load(db, refresh=True)
+            self._missing.update(tag_id for tag_id in unknown if tag_id not in tags)
+        return [tags[tag_id] for tag_id in ids if tag_id in tags]
+
+    def invalidate(self) -> None:
+        self._tags = None
+
+    def _load(self, db: Session, refresh: bool = False) -> Dict[int, TagEntry]:
+        tags = self._tags
+        if refresh or tags is None or time.monotonic() - self._loaded_at > self.ttl:
+            rows = db.execute(select(models.Tag.id, models.Tag.name).order_by(models.Tag.id))
+            tags = {row.id: TagEntry(row.id, row.name) for row in rows}
+            self._tags, self._loaded_at = tags, time.monotonic()
+            self._missing = set()
+        return tags
+
+
+tag_dictionary = TagDictionary()
+
+
+@outbox.subscribe
+def _invalidate_tag_dictionary(events: List[ChangeEvent]) -> None:
+    if any(change.entity == "Tag" for change in events):
+        tag_dictionary.invalidate()
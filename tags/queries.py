@@ -2,7 +2,8 @@ import strawberry
 from typing import List
 from tags.schemas import Tag
 from tags.resolvers import resolve_tags
+from cache_control import CacheControl
 
 @strawberry.type
 class TagQuery:
-    tags: List[Tag] = strawberry.field(resolver=resolve_tags)
+    tags: List[Tag] = strawberry.field(resolver=resolve_tags, directives=[CacheControl(max_age=300)])
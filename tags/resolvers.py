@@ -1,6 +1,7 @@
 import strawberry
 from typing import List, TYPE_CHECKING
-from tags import models
+from posts import models as post_models
+from tags.dictionary import tag_dictionary
 from sqlalchemy.orm import Session # type: ignore
 
 import posts.schemas
@@ -13,9 +14,14 @@ if TYPE_CHECKING:
 # Field Resolvers
 def get_tag_posts(root: "Tag", info: strawberry.Info) -> List["Post"]:
     # from posts.schemas import Post # Removed
-    db = info.context.db
-    tag = db.query(models.Tag).filter(models.Tag.id == root.id).first()
-    return [posts.schemas.Post.from_db_model(post) for post in tag.posts]
+    # Through post_tags on each shard, which hold the posts but not the tags
+    post_tags = post_models.post_tags_table
+    return [
+        posts.schemas.Post.from_db_model(post)
+        for db in info.context.shards.all()
+        for post in db.query(post_models.Post).join(post_tags, post_tags.c.post_id == post_models.Post.id)
+        .filter(post_tags.c.tag_id == root.id)
+    ]
 
 # Query Resolvers
 def resolve_tags(info: strawberry.Info) -> List["Tag"]:
@@ -23,6 +29,4 @@ def resolve_tags(info: strawberry.Info) -> List["Tag"]:
     if not info.context.user:
         raise Exception("Not authenticated")
     
-    db = info.context.db
-    all_tags = db.query(models.Tag).all()
-    return [tags.schemas.Tag.from_db_model(tag) for tag in all_tags]
+    return [tags.schemas.Tag.from_db_model(tag) for tag in tag_dictionary.all(info.context.db)]
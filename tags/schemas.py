@@ -1,12 +1,15 @@
 import strawberry
 from typing import List, TYPE_CHECKING, Annotated
 import tags.resolvers as resolvers
+from cache_control import CacheControl
 
 if TYPE_CHECKING:
     from posts.schemas import Post
 
-@strawberry.type
+@strawberry.type(directives=[CacheControl(max_age=300)])
 class Tag:
+    __slots__ = ("id", "name")
+
     id: int
     name: str
 
@@ -1,7 +1,7 @@
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
-from main import app
+from main import app, init_storage
 from database import Base, engine, SessionLocal
 from auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import timedelta
@@ -10,6 +10,11 @@ from auth import get_password_hash
 
 # ...
 
+@pytest.fixture(scope="session", autouse=True)
+def storage():
+    # ASGITransport does not run the lifespan, so set up storage like it would
+    init_storage()
+
 @pytest.fixture(scope="session")
 def db_engine():
     return engine
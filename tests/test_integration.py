@@ -1,4 +1,5 @@
 import pytest
+import pytest_asyncio
 from httpx import AsyncClient
 
 
@@ -905,3 +906,2333 @@ class TestEdgeCases:
         # Empty query returns 400 Bad Request in Strawberry/GraphQL
         assert response.status_code == 400
 
+
+
+# ==============================================================================
+# HTTP CACHING TESTS
+# ==============================================================================
+
+class TestHTTPCaching:
+    """Tests for Cache-Control, ETag and persisted GET queries."""
+
+    @pytest.mark.asyncio
+    async def test_get_query_sets_cache_headers(self, client, auth_headers):
+        """Test that a cacheable GET query carries Cache-Control and ETag."""
+        response = await client.get(
+            "/graphql", params={"query": "{ tags { id name } }"}, headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert "errors" not in response.json()
+        assert response.headers["cache-control"] == "max-age=300, public"
+        assert response.headers["etag"].startswith('"')
+        # Authenticated: a shared cache must not serve it to anonymous clients
+        assert "Authorization" in response.headers["vary"]
+
+    @pytest.mark.asyncio
+    async def test_if_none_match_returns_304(self, client, auth_headers):
+        """Test that a matching If-None-Match short-circuits with 304."""
+        params = {"query": "{ tags { id name } }"}
+        first = await client.get("/graphql", params=params, headers=auth_headers)
+        etag = first.headers["etag"]
+
+        second = await client.get(
+            "/graphql", params=params, headers={**auth_headers, "If-None-Match": etag}
+        )
+        assert second.status_code == 304
+        assert second.headers["etag"] == etag
+        assert second.content == b""
+
+    @pytest.mark.asyncio
+    async def test_private_hint_wins(self, client, auth_headers):
+        """Test that selecting a private type makes the whole response private."""
+        query = "{ tags { id name posts { id author { username } } } }"
+        response = await client.get("/graphql", params={"query": query}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "max-age=60, private"
+        assert "Authorization" in response.headers["vary"]
+
+    @pytest.mark.asyncio
+    async def test_errors_are_not_cached(self, client):
+        """Test that failed queries are marked no-store."""
+        response = await client.get("/graphql", params={"query": "{ tags { id } }"})
+        assert "errors" in response.json()
+        assert response.headers["cache-control"] == "no-store"
+        assert "etag" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_post_requests_have_no_etag(self, client, auth_headers):
+        """Test that POST responses are left uncached."""
+        response = await client.post(
+            "/graphql", json={"query": "{ tags { id } }"}, headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert "etag" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_persisted_query_flow(self, client, auth_headers):
+        """Test registering a persisted query and then fetching it by id via GET."""
+        import hashlib
+        query = "{ tags { name } }"
+        digest = hashlib.sha256(query.encode()).hexdigest()
+
+        missing = await client.get("/graphql", params={"id": digest}, headers=auth_headers)
+        assert missing.json()["errors"][0]["extensions"]["code"] == "PERSISTED_QUERY_NOT_FOUND"
+
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": digest}}
+        registered = await client.post(
+            "/graphql", json={"query": query, "extensions": extensions}, headers=auth_headers
+        )
+        assert "errors" not in registered.json()
+
+        response = await client.get("/graphql", params={"id": digest}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["data"] == registered.json()["data"]
+        assert response.headers["cache-control"] == "max-age=300, public"
+
+    @pytest.mark.asyncio
+    async def test_persisted_query_hash_mismatch(self, client, auth_headers):
+        """Test that a query whose hash does not match is rejected."""
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": "0" * 64}}
+        response = await client.post(
+            "/graphql", json={"query": "{ tags { id } }", "extensions": extensions}, headers=auth_headers
+        )
+        assert response.json()["errors"][0]["extensions"]["code"] == "PERSISTED_QUERY_HASH_MISMATCH"
+
+
+# ==============================================================================
+# RESULT CACHE TESTS
+# ==============================================================================
+
+class TestResultCache:
+    """Tests for the opt-in server-side result cache extension."""
+
+    @pytest.fixture
+    def cached_schema(self):
+        import strawberry
+        from main import Query, Mutation
+        from cache_control import CacheControlExtension
+        from result_cache import ResultCacheExtension, result_cache
+
+        result_cache.clear()
+        yield strawberry.Schema(
+            query=Query,
+            mutation=Mutation,
+            extensions=[CacheControlExtension, ResultCacheExtension],
+        )
+        result_cache.clear()
+
+    @pytest.fixture
+    def viewer(self, db_session, auth_headers):
+        from users.models import User
+        return db_session.query(User).filter(User.username == "testuser").first()
+
+    def make_context(self, user):
+        from main import Context
+        from database import SessionLocal
+        return Context(db=SessionLocal(), user=user)
+
+    @pytest.mark.asyncio
+    async def test_repeated_query_is_served_from_cache(self, cached_schema, viewer, db_session):
+        """Test that a second identical query does not see raw (un-hooked) writes."""
+        from sqlalchemy import text
+        from tags.models import Tag
+        from result_cache import result_cache
+
+        tag = db_session.query(Tag).first()
+        query = "{ tags { id name } }"
+        first = await cached_schema.execute(query, context_value=self.make_context(viewer))
+        assert first.errors is None
+        assert len(result_cache) == 1
+
+        db_session.execute(text("UPDATE tags SET name = name || '-raw' WHERE id = :id"), {"id": tag.id})
+        db_session.commit()
+        try:
+            # Differently formatted but equivalent operation hits the same entry
+            second = await cached_schema.execute("query {\n tags { id\n name } }", context_value=self.make_context(viewer))
+            assert second.data == first.data
+        finally:
+            db_session.execute(text("UPDATE tags SET name = :name WHERE id = :id"), {"name": tag.name, "id": tag.id})
+            db_session.commit()
+
+    @pytest.mark.asyncio
+    async def test_orm_write_invalidates_entity_tag(self, cached_schema, viewer, db_session):
+        """Test that committing a change to a cached entity evicts the entry."""
+        from tags.models import Tag
+        from result_cache import result_cache
+
+        query = "{ tags { id name } }"
+        await cached_schema.execute(query, context_value=self.make_context(viewer))
+        assert len(result_cache) == 1
+
+        tag = db_session.query(Tag).first()
+        original = tag.name
+        tag.name = original + "-orm"
+        db_session.commit()
+        try:
+            assert len(result_cache) == 0
+            fresh = await cached_schema.execute(query, context_value=self.make_context(viewer))
+            names = [t["name"] for t in fresh.data["tags"]]
+            assert original + "-orm" in names
+        finally:
+            tag.name = original
+            db_session.commit()
+
+    @pytest.mark.asyncio
+    async def test_private_results_are_keyed_per_viewer(self, cached_schema, viewer):
+        """Test that private-scope operations are cached per user, and anonymous ones not at all."""
+        from result_cache import result_cache
+
+        await cached_schema.execute("{ me { id username } }", context_value=self.make_context(viewer))
+        assert len(result_cache) == 0  # `me` has maxAge 0
+
+        await cached_schema.execute("{ users { id username } }", context_value=self.make_context(viewer))
+        assert len(result_cache) == 1
+
+        anonymous = await cached_schema.execute("{ tags { id } }", context_value=self.make_context(None))
+        assert anonymous.errors
+        assert len(result_cache) == 1
+
+
+# ==============================================================================
+# SERIALIZATION TESTS
+# ==============================================================================
+
+class TestSerialization:
+    """Tests for the pluggable response encoder."""
+
+    @pytest.mark.asyncio
+    async def test_datetimes_are_isoformat(self, client, auth_headers, db_session):
+        """Test that datetimes keep their isoformat representation with any encoder."""
+        from posts.models import Post
+        post = db_session.query(Post).first()
+        query = f"{{ post(id: {post.id}) {{ createdAt updatedAt }} }}"
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        assert data["data"]["post"]["createdAt"] == post.created_at.isoformat()
+
+    def test_encoders_agree(self):
+        """Test that the stdlib and orjson encoders produce equivalent JSON."""
+        import json
+        from datetime import datetime
+        from json_encoding import orjson, orjson_encode, stdlib_encode
+
+        data = {"data": {"posts": [{"id": 1, "content": "héllo", "createdAt": datetime(2024, 1, 2, 3, 4, 5, 6)}]}}
+        expected = {"data": {"posts": [{"id": 1, "content": "héllo", "createdAt": "2024-01-02T03:04:05.000006"}]}}
+        assert json.loads(stdlib_encode(data)) == expected
+        if orjson is not None:
+            assert json.loads(orjson_encode(data)) == expected
+
+
+# ==============================================================================
+# OUTPUT TYPES
+# ==============================================================================
+
+class TestOutputTypes:
+    """Tests for the slotted Strawberry types built once per row."""
+
+    # Printed from the schema before the types declared __slots__
+    SDL = {
+        "Post": """type Post {
+  id: Int!
+  authorId: Int!
+  content: String!
+  imageUrl: String
+  createdAt: DateTime!
+  updatedAt: DateTime!
+  author: User
+  comments(first: Int = null, orderBy: CommentOrder = null): [Comment!]!
+  likes(first: Int = null): [Like!]!
+  tags: [Tag!]!
+  likesCount: Int!
+  viewerHasLiked: Boolean!
+}""",
+        "Comment": """type Comment {
+  id: Int!
+  authorId: Int!
+  postId: Int
+  parentCommentId: Int
+  content: String!
+  createdAt: DateTime!
+  updatedAt: DateTime!
+  author: User
+  post: Post
+  parentComment: Comment
+  replies: [Comment!]!
+  likes: [Like!]!
+  viewerHasLiked: Boolean!
+}""",
+        "Like": """type Like {
+  id: Int!
+  userId: Int!
+  postId: Int
+  commentId: Int
+  createdAt: DateTime!
+  user: User
+  post: Post
+  comment: Comment
+}""",
+        "User": """type User {
+  id: Int!
+  username: String!
+  email: String
+  bio: String
+  avatarUrl: String
+  createdAt: DateTime!
+  posts: [Post!]!
+  followers: [User!]!
+  following: [User!]!
+  viewerFollows: Boolean!
+}""",
+        "Tag": """type Tag {
+  id: Int!
+  name: String!
+  posts: [Post!]!
+}""",
+    }
+
+    def test_instances_have_no_dict(self, db_session):
+        """Test that instances built from rows keep their fields in slots only."""
+        from comments import models as comment_models, schemas as comment_schemas
+        from likes import models as like_models, schemas as like_schemas
+        from posts import models as post_models, schemas as post_schemas
+        from tags import models as tag_models, schemas as tag_schemas
+        from users import models as user_models, schemas as user_schemas
+
+        for model, schema_type in [
+            (post_models.Post, post_schemas.Post),
+            (comment_models.Comment, comment_schemas.Comment),
+            (like_models.Like, like_schemas.Like),
+            (user_models.User, user_schemas.User),
+            (tag_models.Tag, tag_schemas.Tag),
+        ]:
+            instance = schema_type.from_db_model(db_session.query(model).first())
+            assert not hasattr(instance, "__dict__"), schema_type.__name__
+            assert instance.id is not None
+
+    def test_printed_types_unchanged(self):
+        """Test that declaring __slots__ left the printed GraphQL types as they were."""
+        from graphql import print_type
+        from main import schema
+
+        for name, sdl in self.SDL.items():
+            assert print_type(schema._schema.get_type(name)) == sdl
+
+
+# ==============================================================================
+# INCREMENTAL DELIVERY TESTS
+# ==============================================================================
+
+MULTIPART_ACCEPT = "multipart/mixed;deferSpec=20220824, application/json"
+
+
+def parse_multipart_parts(response):
+    """Split a multipart/mixed GraphQL response into its JSON payloads."""
+    import json
+    payloads = []
+    for part in response.text.split("\r\n---"):
+        _, _, body = part.partition("\r\n\r\n")
+        if body.strip() and body.strip() != "--":
+            payloads.append(json.loads(body))
+    return payloads
+
+
+class TestIncrementalDelivery:
+    """Tests for @defer and @stream served as multipart/mixed."""
+
+    @pytest.mark.asyncio
+    async def test_defer_sends_cheap_fields_first(self, client, auth_headers):
+        """Test that deferred nested lists arrive after the initial payload."""
+        query = """
+        query {
+            posts {
+                id
+                content
+                ... @defer(label: "engagement") {
+                    comments { id }
+                    likesCount
+                }
+            }
+        }
+        """
+        response = await client.post(
+            "/graphql", json={"query": query}, headers={**auth_headers, "Accept": MULTIPART_ACCEPT}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("multipart/mixed")
+
+        initial, *rest = parse_multipart_parts(response)
+        assert initial["hasNext"] is True
+        assert "comments" not in initial["data"]["posts"][0]
+        assert rest[-1]["hasNext"] is False
+        deferred = [item for payload in rest for item in payload.get("incremental", [])]
+        assert deferred and "comments" in deferred[0]["data"]
+
+    @pytest.mark.asyncio
+    async def test_stream_sends_first_items_first(self, client, auth_headers):
+        """Test that @stream delivers the initial items before the remainder."""
+        query = "query { posts @stream(initialCount: 2) { id } }"
+        response = await client.post(
+            "/graphql", json={"query": query}, headers={**auth_headers, "Accept": MULTIPART_ACCEPT}
+        )
+        assert response.status_code == 200
+
+        initial, *rest = parse_multipart_parts(response)
+        assert len(initial["data"]["posts"]) == 2
+        streamed = [
+            item
+            for payload in rest
+            for incremental in payload.get("incremental", [])
+            for item in incremental["items"]
+        ]
+
+        plain = await client.post("/graphql", json={"query": "query { posts { id } }"}, headers=auth_headers)
+        assert initial["data"]["posts"] + streamed == plain.json()["data"]["posts"]
+
+
+# ==============================================================================
+# SEARCH TESTS
+# ==============================================================================
+
+SEARCH_QUERY = """
+query Search($query: String!, $type: SearchType, $first: Int, $after: String, $authorId: Int) {
+    search(query: $query, type: $type, first: $first, after: $after, authorId: $authorId) {
+        edges {
+            cursor
+            score
+            node {
+                __typename
+                ... on Post { id content }
+                ... on Comment { id content }
+            }
+        }
+        pageInfo { hasNextPage endCursor }
+    }
+}
+"""
+
+
+class TestSearch:
+    """Tests for full-text search over posts and comments."""
+
+    @pytest.fixture
+    def searchable_post(self, db_session):
+        from posts.models import Post
+        from users.models import User
+        author = db_session.query(User).filter(User.username == "testuser").first()
+        post = Post(author_id=author.id, content="Quokkabanana smoothie recipe for quokkabanana fans")
+        db_session.add(post)
+        db_session.commit()
+        yield post
+        db_session.delete(post)
+        db_session.commit()
+
+    async def search(self, client, headers, **variables):
+        response = await client.post(
+            "/graphql", json={"query": SEARCH_QUERY, "variables": variables}, headers=headers
+        )
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        return data["data"]["search"]
+
+    @pytest.mark.asyncio
+    async def test_search_finds_new_post_by_prefix(self, client, auth_headers, searchable_post):
+        """Test that inserted posts are indexed and matched by prefix."""
+        result = await self.search(client, auth_headers, query="quokkaba", type="POST")
+        nodes = [edge["node"] for edge in result["edges"]]
+        assert {"__typename": "Post", "id": searchable_post.id, "content": searchable_post.content} in nodes
+
+    @pytest.mark.asyncio
+    async def test_search_index_follows_updates_and_deletes(self, client, auth_headers, db_session, searchable_post):
+        """Test that the triggers keep the index in sync with content changes."""
+        searchable_post.content = "Wombatcherry pie"
+        db_session.commit()
+        assert (await self.search(client, auth_headers, query="quokkabanana"))["edges"] == []
+        result = await self.search(client, auth_headers, query="wombatcherry")
+        assert [edge["node"]["id"] for edge in result["edges"]] == [searchable_post.id]
+
+    @pytest.mark.asyncio
+    async def test_search_author_filter(self, client, auth_headers, searchable_post):
+        """Test that the author filter excludes other authors' posts."""
+        other_author = searchable_post.author_id + 1000
+        result = await self.search(client, auth_headers, query="quokkabanana", authorId=other_author)
+        assert result["edges"] == []
+
+    @pytest.mark.asyncio
+    async def test_search_pagination_is_stable(self, client, auth_headers, db_session):
+        """Test that paging with cursors returns every match exactly once, best first."""
+        from comments.models import Comment
+        word = db_session.query(Comment).first().content.split()[0]
+
+        everything = await self.search(client, auth_headers, query=word, first=100)
+        seen, after = [], None
+        while True:
+            page = await self.search(client, auth_headers, query=word, first=2, after=after)
+            seen += page["edges"]
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+
+        assert [e["cursor"] for e in seen] == [e["cursor"] for e in everything["edges"]]
+        scores = [e["score"] for e in seen]
+        assert scores == sorted(scores, reverse=True)
+
+    @pytest.mark.asyncio
+    async def test_search_ignores_fts_syntax(self, client, auth_headers):
+        """Test that FTS5 operators in user input are treated as plain terms."""
+        result = await self.search(client, auth_headers, query='NEAR( "unbalanced * OR')
+        assert isinstance(result["edges"], list)
+
+
+# ==============================================================================
+# TRENDING / RANKED FEED
+# ==============================================================================
+
+class TestTrending:
+    """Tests for the precomputed trending scores and the ranked feed."""
+
+    @pytest.fixture
+    def ranked_posts(self, db_session):
+        from datetime import datetime, timedelta
+        from likes.models import Like
+        from posts.models import Post
+        from users.models import User
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        author = db_session.query(User).filter(User.id != viewer.id).first()
+        followed = author in viewer.following
+        if not followed:
+            viewer.following.append(author)
+        # Dated a year ahead, so engagement other tests leave behind cannot outrank them
+        ahead = datetime.utcnow() + timedelta(days=365)
+        quiet = Post(author_id=author.id, content="A quiet post", created_at=ahead)
+        busy = Post(author_id=author.id, content="A busy post", created_at=ahead + timedelta(seconds=1))
+        db_session.add_all([quiet, busy])
+        db_session.commit()
+        yield quiet, busy, [
+            Like(user_id=user_id, post_id=busy.id, created_at=ahead + timedelta(seconds=2))
+            for user_id in (viewer.id, author.id)
+        ]
+        db_session.delete(quiet)
+        db_session.delete(busy)
+        if not followed:
+            viewer.following.remove(author)
+        db_session.commit()
+
+    def scores(self, db_session, window):
+        from posts.models import PostScore
+        rows = db_session.query(PostScore).filter(PostScore.window == window).all()
+        return {row.post_id: row.score for row in rows}
+
+    @pytest.mark.asyncio
+    async def test_engagement_updates_scores_incrementally(self, db_session, ranked_posts):
+        """Test that new and deleted likes move a post's score in every window without a rebuild."""
+        quiet, busy, likes = ranked_posts
+        windows = ("HOUR", "DAY", "WEEK")
+        before = {window: self.scores(db_session, window) for window in windows}
+        assert before["DAY"][busy.id] == pytest.approx(before["DAY"][quiet.id], abs=1e-3)
+
+        db_session.add_all(likes)
+        db_session.commit()
+        for window in windows:
+            scores = self.scores(db_session, window)
+            assert scores[busy.id] > before[window][busy.id]
+            assert scores[busy.id] > scores[quiet.id]
+            assert scores[quiet.id] == before[window][quiet.id]
+
+        for like in likes:
+            db_session.delete(like)
+        db_session.commit()
+        for window in windows:
+            assert self.scores(db_session, window)[busy.id] == pytest.approx(before[window][busy.id])
+
+    @pytest.mark.asyncio
+    async def test_trending_posts_ordered_by_score(self, client, auth_headers, db_session, ranked_posts):
+        """Test that trendingPosts returns the top-K posts of a window by score."""
+        _, busy, likes = ranked_posts
+        db_session.add_all(likes)
+        db_session.commit()
+
+        query = "query { trendingPosts(window: WEEK, first: 5) { id } }"
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        ids = [post["id"] for post in data["data"]["trendingPosts"]]
+
+        scores = self.scores(db_session, "WEEK")
+        expected = sorted(scores, key=scores.get, reverse=True)[:5]
+        assert ids == expected
+        assert busy.id in ids
+
+    @pytest.mark.asyncio
+    async def test_ranked_feed(self, client, auth_headers, db_session, ranked_posts):
+        """Test that feed(order: RANKED) ranks followed authors' posts by score."""
+        quiet, busy, likes = ranked_posts
+        db_session.add_all(likes)
+        db_session.commit()
+
+        query = "query { feed(order: RANKED, first: 200) { id author { id } } }"
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        ids = [post["id"] for post in data["data"]["feed"]]
+        assert ids.index(busy.id) < ids.index(quiet.id)
+
+        scores = self.scores(db_session, "DAY")
+        assert [scores[i] for i in ids] == sorted((scores[i] for i in ids), reverse=True)
+
+    @pytest.mark.asyncio
+    async def test_ranked_feed_keeps_unscored_posts(self, client, auth_headers, db_session, ranked_posts):
+        """Test that posts without a score row (written outside the ORM) still rank, by creation time."""
+        from sqlalchemy import delete
+        from posts.models import PostScore
+
+        quiet, busy, _ = ranked_posts
+        db_session.execute(delete(PostScore).where(PostScore.post_id == quiet.id))
+        db_session.commit()
+
+        for window in ("DAY", "WEEK"):
+            query = f"query {{ feed(order: RANKED, window: {window}, first: 2) {{ id }} }}"
+            response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+            data = response.json()
+            assert "errors" not in data, f"Query failed: {data.get('errors')}"
+            # The newest two posts, scored by their creation alone
+            assert {post["id"] for post in data["data"]["feed"]} == {quiet.id, busy.id}
+
+    @pytest.mark.asyncio
+    async def test_ranked_lists_clamp_first(self, client, auth_headers, ranked_posts):
+        """Test that ranked lists treat a negative `first` as 0 and cap large ones."""
+        from posts.resolvers import MAX_RANKED_SIZE
+        query = "query { trendingPosts(first: -1) { id } feed(order: RANKED, first: -1) { id } }"
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        assert data["data"] == {"trendingPosts": [], "feed": []}
+
+        query = f"query {{ trendingPosts(window: WEEK, first: {MAX_RANKED_SIZE + 50}) {{ id }} }}"
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        assert len(response.json()["data"]["trendingPosts"]) <= MAX_RANKED_SIZE
+
+    @pytest.mark.asyncio
+    async def test_feed_first_limits_recent_feed(self, client, auth_headers, ranked_posts):
+        """Test that `first` caps the chronological feed."""
+        query = "query { feed(first: 1) { id } }"
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        assert [post["id"] for post in data["data"]["feed"]] == [ranked_posts[1].id]
+
+
+# ==============================================================================
+# FOLLOW GRAPH
+# ==============================================================================
+
+class TestFollowGraph:
+    """Tests for the in-memory follow graph and the queries built on it."""
+
+    @pytest.fixture
+    def triangle(self, db_session):
+        """viewer -> friend -> stranger, with viewer not following stranger."""
+        from users.models import User
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        friend, stranger = db_session.query(User).filter(User.id != viewer.id).order_by(User.id.desc()).limit(2).all()
+        snapshot = {user: list(user.following) for user in (viewer, friend)}
+        viewer.following = [u for u in viewer.following if u is not stranger] + ([friend] if friend not in viewer.following else [])
+        if stranger not in friend.following:
+            friend.following.append(stranger)
+        db_session.commit()
+        yield viewer, friend, stranger
+        for user, following in snapshot.items():
+            user.following = following
+        db_session.commit()
+
+    async def query(self, client, headers, query, **variables):
+        response = await client.post("/graphql", json={"query": query, "variables": variables}, headers=headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        return data["data"]
+
+    def test_intersect_sorted(self):
+        """Test both intersection strategies against set intersection."""
+        from users.follow_graph import intersect_sorted
+        small, large = [3, 50, 999, 5000], list(range(0, 10000, 3))
+        assert intersect_sorted(small, large) == sorted(set(small) & set(large))
+        assert intersect_sorted(large, list(range(0, 10000, 5))) == list(range(0, 10000, 15))
+        assert intersect_sorted([], large) == []
+
+    def test_graph_matches_follows_table(self, db_session):
+        """Test that the graph built at startup and kept by commits matches the table."""
+        from sqlalchemy import select
+        from users.follow_graph import follow_graph
+        from users.models import follows_table
+        edges = db_session.execute(select(follows_table.c.follower_id, follows_table.c.following_id)).all()
+        assert len(follow_graph) == len(edges)
+        assert all(follow_graph.is_following(a, b) for a, b in edges)
+
+    @pytest.mark.asyncio
+    async def test_mutual_followers_and_suggestions(self, client, auth_headers, triangle):
+        """Test friend-of-friend queries answered from the graph."""
+        viewer, friend, stranger = triangle
+        data = await self.query(
+            client, auth_headers,
+            "query($id: Int!) { mutualFollowers(userId: $id) { id } followSuggestions(first: 50) { id } }",
+            id=stranger.id,
+        )
+        assert {"id": friend.id} in data["mutualFollowers"]
+        assert {"id": stranger.id} in data["followSuggestions"]
+        assert {"id": viewer.id} not in data["followSuggestions"]
+
+    @pytest.mark.asyncio
+    async def test_follow_lists_clamp_first(self, client, auth_headers, triangle):
+        """Test that a negative `first` returns no users instead of slicing from the end."""
+        viewer, friend, stranger = triangle
+        data = await self.query(
+            client, auth_headers,
+            "query($id: Int!) { mutualFollowers(userId: $id, first: -1) { id } followSuggestions(first: -1) { id } }",
+            id=stranger.id,
+        )
+        assert data == {"mutualFollowers": [], "followSuggestions": []}
+
+    @pytest.mark.asyncio
+    async def test_follow_mutations_update_graph(self, client, auth_headers, triangle):
+        """Test that follow/unfollow are reflected by isFollowing immediately."""
+        viewer, friend, stranger = triangle
+        check = "query($ids: [Int!]!) { isFollowing(ids: $ids) }"
+        ids = [friend.id, stranger.id]
+        assert (await self.query(client, auth_headers, check, ids=ids))["isFollowing"] == [True, False]
+
+        follow = "mutation($id: Int!) { followUser(userId: $id) { id } }"
+        assert (await self.query(client, auth_headers, follow, id=stranger.id))["followUser"] == {"id": stranger.id}
+        assert (await self.query(client, auth_headers, check, ids=ids))["isFollowing"] == [True, True]
+
+        unfollow = "mutation($id: Int!) { unfollowUser(userId: $id) { id } }"
+        await self.query(client, auth_headers, unfollow, id=friend.id)
+        assert (await self.query(client, auth_headers, check, ids=ids))["isFollowing"] == [False, True]
+
+    @pytest.mark.asyncio
+    async def test_cannot_follow_self(self, client, auth_headers, triangle):
+        """Test that following yourself is rejected."""
+        viewer = triangle[0]
+        response = await client.post(
+            "/graphql",
+            json={"query": "mutation { followUser(userId: %d) { id } }" % viewer.id},
+            headers=auth_headers,
+        )
+        assert "You cannot follow yourself" in response.json()["errors"][0]["message"]
+
+
+# ==============================================================================
+# VIEWER FIELDS
+# ==============================================================================
+
+@pytest.fixture
+def sql_statements(db_engine):
+    from sqlalchemy import event
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(db_engine, "before_cursor_execute", record)
+
+
+class TestViewerFields:
+    """Tests for viewerHasLiked / viewerFollows and their batching."""
+
+    @pytest.fixture
+    def viewer_state(self, db_session):
+        from comments.models import Comment
+        from likes.models import Like
+        from posts.models import Post
+        from users.models import User
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        post = db_session.query(Post).order_by(Post.id).first()
+        comment = db_session.query(Comment).order_by(Comment.id).first()
+        author = db_session.query(User).filter(User.id != viewer.id).order_by(User.id).first()
+        likes = [Like(user_id=viewer.id, post_id=post.id), Like(user_id=viewer.id, comment_id=comment.id)]
+        followed = author in viewer.following
+        if not followed:
+            viewer.following.append(author)
+        db_session.add_all(likes)
+        db_session.commit()
+        yield post, comment, author
+        for like in likes:
+            db_session.delete(like)
+        if not followed:
+            viewer.following.remove(author)
+        db_session.commit()
+
+    @pytest.mark.asyncio
+    async def test_viewer_has_liked_batched(self, client, auth_headers, viewer_state, sql_statements):
+        """Test that viewerHasLiked is correct and costs one likes query per list."""
+        post, comment, author = viewer_state
+        query = """
+        query {
+            posts {
+                id
+                viewerHasLiked
+                author { id viewerFollows }
+                comments { id viewerHasLiked }
+            }
+        }
+        """
+        response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        posts = {p["id"]: p for p in data["data"]["posts"]}
+
+        assert posts[post.id]["viewerHasLiked"] is True
+        assert sum(p["viewerHasLiked"] for p in posts.values()) >= 1
+        comments = {c["id"]: c["viewerHasLiked"] for p in posts.values() for c in p["comments"]}
+        assert comments[comment.id] is True
+        authors = {p["author"]["id"]: p["author"]["viewerFollows"] for p in posts.values()}
+        assert authors[author.id] is True
+
+        viewer_lookups = [s for s in sql_statements if "likes.user_id = ?" in s or "follows.follower_id = ?" in s]
+        # posts, comments and authors: one batched lookup each
+        assert len(viewer_lookups) == 3, viewer_lookups
+
+
+# ==============================================================================
+# TOP-N PREVIEWS
+# ==============================================================================
+
+class TestPreviewLoaders:
+    """Tests for comments(first, orderBy) / likes(first) previews."""
+
+    PREVIEW_QUERY = """
+    query {
+        posts {
+            id
+            latest: comments(first: 2, orderBy: NEWEST) { id createdAt }
+            oldest: comments(first: 1, orderBy: OLDEST) { id }
+            all: comments { id createdAt }
+            likes(first: 3) { id createdAt }
+            likesCount
+        }
+    }
+    """
+
+    @pytest.mark.asyncio
+    async def test_previews_match_full_lists(self, client, auth_headers, sql_statements):
+        """Test that each preview is the head of the ordered full list."""
+        response = await client.post("/graphql", json={"query": self.PREVIEW_QUERY}, headers=auth_headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+
+        for post in data["data"]["posts"]:
+            newest = sorted(post["all"], key=lambda c: (c["createdAt"], c["id"]), reverse=True)
+            assert post["latest"] == newest[:2]
+            assert [c["id"] for c in post["oldest"]] == [c["id"] for c in newest[::-1][:1]]
+            assert len(post["likes"]) == min(3, post["likesCount"])
+            dates = [like["createdAt"] for like in post["likes"]]
+            assert dates == sorted(dates, reverse=True)
+
+        # One windowed query per distinct (first, orderBy) for all posts
+        windowed = [s for s in sql_statements if "row_number() OVER" in s]
+        assert len(windowed) == 3
+
+
+# ==============================================================================
+# LOADER PRIMING
+# ==============================================================================
+
+class TestLoaderPriming:
+    """Tests that entities loaded by list loaders are not fetched again by id."""
+
+    @pytest.mark.asyncio
+    async def test_list_loaders_prime_entity_loaders(self, client, auth_headers, db_session, sql_statements):
+        """Test that comment.post and parentComment reuse already loaded rows."""
+        from comments.models import Comment
+        comment = db_session.query(Comment).first()
+        query = """
+        query($id: Int!) {
+            post(id: $id) {
+                author {
+                    posts {
+                        id
+                        comments { id post { id } parentComment { id } }
+                    }
+                }
+            }
+        }
+        """
+        response = await client.post(
+            "/graphql", json={"query": query, "variables": {"id": comment.post_id}}, headers=auth_headers
+        )
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        for post in data["data"]["post"]["author"]["posts"]:
+            assert all(c["post"]["id"] == post["id"] for c in post["comments"])
+
+        by_id = [s for s in sql_statements if "WHERE posts.id IN" in s or "WHERE comments.id IN" in s]
+        assert by_id == []
+
+    @pytest.mark.asyncio
+    async def test_viewer_primes_user_loader(self, db_session, sql_statements):
+        """Test that the authenticated user is served from the user loader without a query."""
+        from main import Context
+        from users.models import User
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        sql_statements.clear()
+
+        context = Context(db=db_session, user=viewer)
+        assert await context.loaders.user_loader.load(viewer.id) is viewer
+        assert sql_statements == []
+
+
+# ==============================================================================
+# TAG DICTIONARY
+# ==============================================================================
+
+class TestTagDictionary:
+    """Tests for post tags served from the in-memory tag dictionary."""
+
+    @pytest.fixture
+    def new_tag(self, db_session):
+        from tags.models import Tag
+        tag = Tag(name="dictionary-test")
+        db_session.add(tag)
+        db_session.commit()
+        yield tag
+        db_session.delete(tag)
+        db_session.commit()
+
+    async def tag_names(self, client, headers):
+        response = await client.post("/graphql", json={"query": "query { tags { id name } }"}, headers=headers)
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        return {tag["id"]: tag["name"] for tag in data["data"]["tags"]}
+
+    @pytest.mark.asyncio
+    async def test_post_tags_read_join_table_only(self, client, auth_headers, db_session, sql_statements):
+        """Test that Post.tags matches the relationship without re-reading tags or posts."""
+        from posts.models import Post
+        expected = {
+            post.id: sorted((tag.id, tag.name) for tag in post.tags)
+            for post in db_session.query(Post).all()
+        }
+        await self.tag_names(client, auth_headers)  # warm the dictionary
+        sql_statements.clear()
+
+        response = await client.post(
+            "/graphql", json={"query": "query { posts { id tags { id name } } }"}, headers=auth_headers
+        )
+        data = response.json()
+        assert "errors" not in data, f"Query failed: {data.get('errors')}"
+        for post in data["data"]["posts"]:
+            assert [(t["id"], t["name"]) for t in post["tags"]] == expected[post["id"]]
+
+        tag_reads = [s for s in sql_statements if "FROM tags" in s or "post_tags JOIN" in s]
+        assert tag_reads == []
+
+    @pytest.mark.asyncio
+    async def test_tag_writes_invalidate_dictionary(self, client, auth_headers, db_session, new_tag):
+        """Test that created and renamed tags are visible right after commit."""
+        assert (await self.tag_names(client, auth_headers))[new_tag.id] == "dictionary-test"
+        new_tag.name = "dictionary-renamed"
+        db_session.commit()
+        assert (await self.tag_names(client, auth_headers))[new_tag.id] == "dictionary-renamed"
+
+    def test_unknown_tag_ids_reload_once(self, db_session, sql_statements):
+        """Test that a dangling tag id triggers one reload, not one per lookup, until the next load."""
+        from tags.dictionary import TagDictionary
+
+        dictionary = TagDictionary()
+        known = [tag.id for tag in dictionary.all(db_session)]
+        dangling = max(known, default=0) + 1000
+        sql_statements.clear()
+        for _ in range(3):
+            assert [tag.id for tag in dictionary.get_many(db_session, known[:1] + [dangling])] == known[:1]
+        assert len([s for s in sql_statements if "FROM tags" in s]) == 1
+
+        # A load that already missed it does not reload again
+        dictionary.invalidate()
+        dictionary.get_many(db_session, [dangling])
+        dictionary.get_many(db_session, [dangling])
+        assert len([s for s in sql_statements if "FROM tags" in s]) == 2
+
+
+# ==============================================================================
+# PRE-FORK SERVER
+# ==============================================================================
+
+class TestServe:
+    """Tests for the multi-worker entry point in serve.py."""
+
+    def test_workers_serve_restart_and_stop(self):
+        """Test that forked workers answer, survive a rolling restart and stop on SIGTERM."""
+        import os
+        import signal
+        import socket
+        import subprocess
+        import sys
+        import time
+        import httpx
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        server = subprocess.Popen(
+            [sys.executable, "serve.py", "--workers", "2", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=root,
+            stderr=subprocess.DEVNULL,
+        )
+
+        def get(path="/"):
+            deadline = time.monotonic() + 20
+            while True:
+                try:
+                    return httpx.get(f"http://127.0.0.1:{port}{path}")
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.1)
+
+        try:
+            assert get().json()["graphql_endpoint"] == "/graphql"
+            server.send_signal(signal.SIGHUP)
+            time.sleep(0.5)
+            assert get().status_code == 200
+        finally:
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=20) == 0
+
+
+# ==============================================================================
+# COLD START
+# ==============================================================================
+
+IMPORT_BUDGET_SECONDS = 0.5
+
+IMPORT_PROFILE_SCRIPT = """
+import time
+import fastapi, strawberry, strawberry.fastapi, sqlalchemy.orm, jose.jwt, passlib.context
+from sqlalchemy import event
+import database
+
+statements = []
+event.listen(database.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+started = time.perf_counter()
+import main
+print(len(statements), time.perf_counter() - started)
+"""
+
+
+class TestColdStart:
+    """Tests that importing the app stays cheap and free of side effects."""
+
+    def test_import_budget(self):
+        """Test that importing main runs no SQL and our own modules load within budget."""
+        import os
+        import subprocess
+        import sys
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROFILE_SCRIPT], cwd=root, capture_output=True, text=True, check=True
+        )
+        statements, seconds = result.stdout.split()
+        assert int(statements) == 0
+        assert float(seconds) < IMPORT_BUDGET_SECONDS
+
+
+# ==============================================================================
+# RATE LIMITING
+# ==============================================================================
+
+class TestRateLimit:
+    """Tests for cost-based token bucket rate limiting."""
+
+    @pytest_asyncio.fixture
+    async def limited_client(self):
+        from fastapi import FastAPI
+        from httpx import ASGITransport
+        from graphql_router import AppGraphQLRouter
+        from main import get_context, schema
+        from rate_limit import MemoryRateLimitStore, RateLimiter
+
+        app = FastAPI()
+        limiter = RateLimiter(MemoryRateLimitStore(), capacity=100, refill_per_second=1)
+        app.include_router(AppGraphQLRouter(schema, context_getter=get_context, rate_limiter=limiter), prefix="/graphql")
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            yield client
+
+    def test_query_cost(self):
+        """Test that costs scale with list sizes taken from `first`, defaults and connections."""
+        from main import schema
+        from rate_limit import DEFAULT_LIST_SIZE, compute_query_cost
+        graphql_schema = schema._schema
+
+        assert compute_query_cost(graphql_schema, "{ me { id username } }") == 2
+        assert compute_query_cost(graphql_schema, "{ posts { id } }") == 1 + DEFAULT_LIST_SIZE
+        assert compute_query_cost(graphql_schema, "{ trendingPosts { id } }") == 1 + 20
+        assert compute_query_cost(
+            graphql_schema, "query($n: Int) { feed(first: $n) { author { id } } }", variables={"n": 3}
+        ) == 1 + 3 * 2
+        assert compute_query_cost(
+            graphql_schema, '{ search(query: "x", first: 5) { edges { node { ... on Post { id } } } } }'
+        ) == 1 + 1 + 5 * 2
+        # A negative `first` costs nothing rather than a negative amount
+        assert compute_query_cost(graphql_schema, "{ trendingPosts(first: -1) { id } feed(first: 10) { id } }") == 1 + 0 + 10
+        assert compute_query_cost(
+            graphql_schema, "query($n: Int) { feed(first: $n) { id } }", variables={"n": -100}
+        ) == 1
+
+    @pytest.mark.asyncio
+    async def test_bucket_exhaustion_returns_429(self, limited_client, auth_headers):
+        """Test that a drained bucket answers 429 with Retry-After and no data."""
+        query = {"query": "query { trendingPosts(first: 30) { id } }"}  # cost 31
+        for _ in range(3):
+            response = await limited_client.post("/graphql", json=query, headers=auth_headers)
+            assert response.status_code == 200
+
+        response = await limited_client.post("/graphql", json=query, headers=auth_headers)
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        error = response.json()["errors"][0]
+        assert error["extensions"]["code"] == "RATE_LIMITED"
+        assert error["extensions"]["cost"] == 31
+
+        # Anonymous clients are limited by IP, in a bucket of their own
+        response = await limited_client.post("/graphql", json={"query": "{ __typename }"})
+        assert response.status_code == 200
+
+    @pytest.mark.asyncio
+    async def test_batch_charged_as_a_whole(self, limited_client, auth_headers):
+        """Test that a batch is charged its total cost once and limited all-or-nothing."""
+        operation = {"query": "query { trendingPosts(first: 19) { id } }"}  # cost 20
+        response = await limited_client.post("/graphql", json=[operation] * 4, headers=auth_headers)
+        assert response.status_code == 200
+        assert all("errors" not in result for result in response.json())
+
+        response = await limited_client.post("/graphql", json=[operation] * 2, headers=auth_headers)
+        assert response.status_code == 429
+        results = response.json()
+        assert len(results) == 2
+        assert all(r["errors"][0]["extensions"]["code"] == "RATE_LIMITED" for r in results)
+        assert results[0]["errors"][0]["extensions"]["cost"] == 40
+
+    @pytest.mark.asyncio
+    async def test_query_over_capacity_rejected(self, limited_client, auth_headers):
+        """Test that a query costing more than the bucket can hold is refused outright."""
+        response = await limited_client.post("/graphql", json={"query": "query { posts { id } posts2: posts { id } }"}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["errors"][0]["extensions"]["code"] == "QUERY_TOO_EXPENSIVE"
+
+    @pytest.mark.asyncio
+    async def test_default_limits_admit_ordinary_queries(self, auth_headers):
+        """Test that the nested queries of the integration tests run under the shipped defaults."""
+        from fastapi import FastAPI
+        from httpx import ASGITransport
+        from graphql_router import AppGraphQLRouter
+        from main import get_context, schema
+        from rate_limit import RateLimiter
+
+        queries = [
+            # TestPostQueries.test_complex_post_query
+            "{ posts { id content likes { user { avatarUrl username } } tags { name } comments { content author { bio } } } }",
+            # TestNPlusOneOptimization.test_deeply_nested_query
+            """{ posts { id content author { id username posts { id content } }
+                 comments { id content author { id username } replies { id content } } } }""",
+            "{ feed { author { username } comments { content } likes { user { username } } } }",
+            "{ me { id username followers { username } following { username } } tags { name posts { content } } }",
+        ]
+        app = FastAPI()
+        app.include_router(AppGraphQLRouter(schema, context_getter=get_context, rate_limiter=RateLimiter()), prefix="/graphql")
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            for query in queries:
+                response = await client.post("/graphql", json={"query": query}, headers=auth_headers)
+                assert response.status_code == 200
+                assert "errors" not in response.json(), response.json()
+
+
+# ==============================================================================
+# ADMISSION CONTROL
+# ==============================================================================
+
+class TestAdmission:
+    """Tests for in-flight limits, priority lanes and request deadlines."""
+
+    def test_operation_lane(self):
+        """Test that only operations made entirely of login/me take the critical lane."""
+        from admission import Lane, operation_lane
+
+        assert operation_lane("{ me { id } }") == Lane.CRITICAL
+        assert operation_lane('mutation { login(username: "a", password: "b") { accessToken } }') == Lane.CRITICAL
+        assert operation_lane("{ me { id } posts { id } }") == Lane.NORMAL
+        assert operation_lane("query A { posts { id } } query B { me { id } }", "B") == Lane.CRITICAL
+        assert operation_lane("{ not valid") == Lane.NORMAL
+        assert operation_lane(None) == Lane.NORMAL
+
+    @pytest.mark.asyncio
+    async def test_queue_and_shedding(self):
+        """Test that waiters queue up, critical requests jump ahead and a full queue sheds normal ones."""
+        import asyncio
+        from admission import AdmissionController, Lane, Overloaded
+
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5, request_timeout=10)
+        await controller.acquire()
+        normal = asyncio.create_task(controller.acquire(Lane.NORMAL))
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+
+        with pytest.raises(Overloaded):
+            await controller.acquire(Lane.NORMAL)
+
+        # A critical request takes the queued normal request's place
+        critical = asyncio.create_task(controller.acquire(Lane.CRITICAL))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await normal
+        assert controller.queued == 1
+
+        controller.release()
+        await critical
+        assert controller.in_flight == 1 and controller.queued == 0
+        controller.release()
+        assert controller.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_timeout(self):
+        """Test that a request waiting longer than the queue timeout is shed."""
+        from admission import AdmissionController, Overloaded
+
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_timeout=0.01, request_timeout=10)
+        await controller.acquire()
+        with pytest.raises(Overloaded):
+            await controller.acquire()
+        assert controller.queued == 0 and controller.in_flight == 1
+
+    @pytest.mark.asyncio
+    async def test_overloaded_response(self, client, auth_headers, monkeypatch):
+        """Test that a saturated server answers 503 with Retry-After, shedding normal requests before `me`."""
+        import asyncio
+        import main
+        from admission import AdmissionController
+
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5, request_timeout=10)
+        monkeypatch.setattr(main, "admission", controller)
+        await controller.acquire()
+
+        posts = asyncio.create_task(client.post("/graphql", json={"query": "{ posts { id } }"}, headers=auth_headers))
+        while controller.queued < 1:
+            await asyncio.sleep(0.001)
+        me = asyncio.create_task(client.post("/graphql", json={"query": "{ me { username } }"}, headers=auth_headers))
+
+        response = await posts
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert response.json()["errors"][0]["extensions"]["code"] == "OVERLOADED"
+
+        controller.release()
+        response = await me
+        assert response.status_code == 200
+        assert response.json()["data"]["me"]["username"] == "testuser"
+        assert controller.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_deadline_exceeded(self, client, auth_headers, monkeypatch):
+        """Test that an expired deadline aborts DataLoader batches and answers 503 without partial data."""
+        import main
+        from admission import AdmissionController
+
+        monkeypatch.setattr(main, "admission", AdmissionController(max_in_flight=1, request_timeout=0))
+        response = await client.post(
+            "/graphql", json={"query": "{ posts { id author { username } } }"}, headers=auth_headers
+        )
+        assert response.status_code == 503
+        body = response.json()
+        assert body["data"] is None
+        assert body["errors"][0]["extensions"]["code"] == "DEADLINE_EXCEEDED"
+
+    def test_deadline_interrupts_sql(self, db_engine):
+        """Test that SQL running past the session's deadline is interrupted, and the pool is left clean."""
+        import time
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+        from sqlalchemy.orm import Session
+
+        slow = text(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000) "
+            "SELECT count(*) FROM n"
+        )
+        with Session(db_engine) as session:
+            session.info["deadline"] = time.monotonic()
+            with pytest.raises(OperationalError, match="interrupted"):
+                session.execute(slow)
+
+        with Session(db_engine) as session:
+            assert session.execute(slow).scalar() == 100000
+
+
+# ==============================================================================
+# QUERY BATCHING
+# ==============================================================================
+
+class TestBatching:
+    """Tests for several operations in one HTTP request sharing a context."""
+
+    @pytest.mark.asyncio
+    async def test_batch_returns_result_per_operation(self, client, auth_headers):
+        """Test that a JSON array of operations is answered with an array of results, in order."""
+        response = await client.post("/graphql", json=[
+            {"query": "{ me { username } }"},
+            {"query": "query Tags { tags { name } }", "operationName": "Tags"},
+            {"query": "query($id: Int!) { post(id: $id) { id } }", "variables": {"id": 1}},
+            {"query": "{ nope }"},
+        ], headers=auth_headers)
+        assert response.status_code == 200
+        results = response.json()
+        assert len(results) == 4
+        assert results[0]["data"]["me"]["username"] == "testuser"
+        assert isinstance(results[1]["data"]["tags"], list)
+        assert results[2]["data"]["post"]["id"] == 1
+        assert "errors" in results[3]
+
+    @pytest.mark.asyncio
+    async def test_batch_shares_context(self, client, auth_headers, sql_statements):
+        """Test that auth runs once and DataLoaders deduplicate across the batch's operations."""
+        query = "{ posts { id author { username } } }"
+        response = await client.post("/graphql", json=[{"query": query}, {"query": query}], headers=auth_headers)
+        assert response.status_code == 200
+        first, second = response.json()
+        assert first == second
+
+        from_users = [s for s in sql_statements if "FROM users" in s]
+        from_posts = [s for s in sql_statements if "FROM posts" in s]
+        # One viewer lookup, one batched author load; the two posts lists are separate queries
+        assert len(from_users) == 2
+        assert len(from_posts) == 2
+
+    @pytest.mark.asyncio
+    async def test_batch_size_limit(self, client, auth_headers):
+        """Test that batches over BATCH_MAX_OPERATIONS are refused."""
+        from settings import BATCH_MAX_OPERATIONS
+        response = await client.post(
+            "/graphql", json=[{"query": "{ __typename }"}] * (BATCH_MAX_OPERATIONS + 1), headers=auth_headers
+        )
+        assert response.status_code == 400
+
+
+# ==============================================================================
+# BULK EXPORT
+# ==============================================================================
+
+class TestExport:
+    """Tests for the streaming /export endpoint."""
+
+    @pytest.fixture(autouse=True)
+    def export_users(self, monkeypatch):
+        monkeypatch.setattr("export.EXPORT_USERS", ["testuser"])
+
+    @pytest.mark.asyncio
+    async def test_ndjson_export(self, client, auth_headers, db_session):
+        """Test that every row is streamed as one JSON object per line, in key order."""
+        import json
+        from posts.models import Post
+
+        response = await client.get("/export/posts", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert len(rows) == db_session.query(Post).count()
+        assert [row["id"] for row in rows] == sorted(row["id"] for row in rows)
+        assert set(rows[0]) == {"id", "author_id", "content", "image_url", "created_at", "updated_at"}
+
+        response = await client.get("/export/follows", headers=auth_headers)
+        assert response.status_code == 200
+
+    def test_batches_stream_with_bounded_size(self, db_engine, db_session):
+        """Test that rows come back in batches of the requested size rather than all at once."""
+        from export import ExportTable, iter_batches
+        from posts.models import Post
+
+        with db_engine.connect() as connection:
+            sizes = [len(rows) for _, rows in iter_batches(connection, ExportTable.POSTS, batch_size=7)]
+        assert sum(sizes) == db_session.query(Post).count()
+        assert max(sizes) == 7
+
+    @pytest.mark.asyncio
+    async def test_since_watermark(self, client, auth_headers, db_session):
+        """Test that `since` only exports rows written at or after it, using the returned watermark."""
+        import json
+        from likes.models import Like
+        from posts.models import Post
+
+        response = await client.get("/export/likes", headers=auth_headers)
+        watermark = response.headers["x-export-watermark"]
+
+        post = db_session.query(Post).first()
+        like = Like(user_id=post.author_id, post_id=post.id)
+        db_session.add(like)
+        db_session.commit()
+        try:
+            response = await client.get("/export/likes", params={"since": watermark}, headers=auth_headers)
+            rows = [json.loads(line) for line in response.text.splitlines()]
+            assert [row["id"] for row in rows] == [like.id]
+        finally:
+            db_session.delete(like)
+            db_session.commit()
+
+    @pytest.mark.asyncio
+    async def test_export_is_limited_to_export_users(self, client, auth_headers, monkeypatch):
+        """Test that a logged-in user not listed in EXPORT_USERS cannot export other users' rows."""
+        monkeypatch.setattr("export.EXPORT_USERS", ["someone-else"])
+        assert (await client.get("/export/posts", headers=auth_headers)).status_code == 403
+
+    @pytest.mark.asyncio
+    async def test_export_requires_auth_and_known_table(self, client, auth_headers):
+        """Test that anonymous requests, unknown tables and unavailable formats are refused."""
+        from export import pyarrow
+
+        assert (await client.get("/export/posts")).status_code == 401
+        assert (await client.get("/export/users", headers=auth_headers)).status_code == 422
+        response = await client.get("/export/posts", params={"format": "arrow"}, headers=auth_headers)
+        if pyarrow is None:
+            assert response.status_code == 400
+        else:
+            table = pyarrow.ipc.open_stream(response.content).read_all()
+            assert table.column_names[0] == "id"
+
+
+# ==============================================================================
+# BULK IMPORT
+# ==============================================================================
+
+class TestBulkImport:
+    """Tests for the bulk_import.py pipeline, against a scratch database."""
+
+    @pytest.fixture
+    def scratch_engine(self, tmp_path):
+        from sqlalchemy import create_engine
+        engine = create_engine(f"sqlite:///{tmp_path}/import.db")
+        yield engine
+        engine.dispose()
+
+    @pytest.fixture
+    def files(self, tmp_path):
+        (tmp_path / "users.ndjson").write_text(
+            '{"username": "ann", "email": "ann@example.com", "password_hash": "x"}\n'
+            '{"username": "bob", "email": "bob@example.com", "password_hash": "x", "created_at": "2024-01-02T03:04:05"}\n'
+            '{"username": "eve"}\n'
+        )
+        (tmp_path / "posts.csv").write_text(
+            "id,author,content,image_url\n"
+            "1,ann,hello graphql,\n"
+            "2,bob,second post,http://example.com/a.png\n"
+            "3,zed,orphan,\n"
+        )
+        (tmp_path / "comments.ndjson").write_text(
+            '{"id": 10, "post_id": 1, "author": "bob", "content": "first"}\n'
+            '{"id": 11, "post_id": 1, "author": "ann", "content": "reply", "parent_comment_id": 10}\n'
+            '\n'
+            '{"id": 12, "post_id": 99, "author": "ann", "content": "lost"}\n'
+        )
+        (tmp_path / "likes.ndjson").write_text(
+            '{"user": "ann", "post_id": 2}\n'
+            '{"user": "bob", "comment_id": 11}\n'
+            '{"user": "bob"}\n'
+        )
+        (tmp_path / "follows.ndjson").write_text(
+            '{"follower": "ann", "following": "bob"}\n'
+            '{"follower": "ann", "following": "ann"}\n'
+        )
+        return {name: str(next(tmp_path.glob(f"{name}.*"))) for name in ("users", "posts", "comments", "likes", "follows")}
+
+    def test_import_validates_and_resolves_references(self, scratch_engine, files):
+        """Test that valid rows are loaded, natural keys resolved and bad rows reported, chunk by chunk."""
+        from sqlalchemy import text
+        from bulk_import import run_import
+
+        reports = {r.name: r for r in run_import(scratch_engine, files, chunk_size=2)}
+        assert {name: (r.read, r.inserted) for name, r in reports.items()} == {
+            "users": (3, 2), "posts": (3, 2), "comments": (3, 2), "likes": (3, 2), "follows": (2, 1),
+        }
+        assert reports["users"].errors == [(3, "missing email")]
+        # Errors give file lines, counting the CSV header and blank lines
+        assert reports["posts"].errors == [(4, "unknown author 'zed'")]
+        assert reports["comments"].errors == [(4, "unknown post_id 99")]
+        assert reports["likes"].errors == [(3, "a like needs post_id or comment_id")]
+        assert reports["follows"].errors == [(2, "users cannot follow themselves")]
+
+        with scratch_engine.connect() as connection:
+            posts = connection.execute(text("SELECT id, author_id, image_url FROM posts ORDER BY id")).all()
+            assert posts == [(1, 1, None), (2, 2, "http://example.com/a.png")]
+            assert connection.execute(text("SELECT parent_comment_id FROM comments WHERE id = 11")).scalar() == 10
+            assert connection.execute(text("SELECT created_at FROM users WHERE username = 'bob'")).scalar().startswith("2024-01-02 03:04:05")
+            # Scores are rebuilt for imported engagement
+            assert connection.execute(text("SELECT COUNT(DISTINCT post_id) FROM post_scores")).scalar() == 2
+
+    def test_deferred_indexes_are_rebuilt(self, scratch_engine, files):
+        """Test that --defer-indexes leaves the same indexes and a working search index behind."""
+        from sqlalchemy import inspect, text
+        from bulk_import import run_import
+
+        run_import(scratch_engine, {"users": files["users"]})
+        indexes_before = {i["name"] for i in inspect(scratch_engine).get_indexes("posts")}
+
+        run_import(scratch_engine, {"posts": files["posts"]}, defer_indexes=True)
+        assert {i["name"] for i in inspect(scratch_engine).get_indexes("posts")} == indexes_before
+        with scratch_engine.connect() as connection:
+            matches = connection.execute(text("SELECT rowid FROM posts_fts WHERE posts_fts MATCH 'graphql'")).scalars().all()
+        assert matches == [1]
+
+    def test_skip_duplicates(self, scratch_engine, files):
+        """Test that re-importing with --skip-duplicates ignores rows that already exist."""
+        from bulk_import import run_import
+
+        run_import(scratch_engine, {"users": files["users"]})
+        [report] = run_import(scratch_engine, {"users": files["users"]}, skip_duplicates=True)
+        assert report.inserted == 0
+
+    def test_import_records_outbox_events(self, scratch_engine, files):
+        """Test that imported chunks reach outbox subscribers: one event per entity chunk, one per follow."""
+        from bulk_import import run_import
+        from outbox import Outbox
+
+        run_import(scratch_engine, files, chunk_size=2)
+        events = []
+        outbox = Outbox()
+        outbox.subscribe(events.extend)
+        outbox.drain(scratch_engine, first_id=1)
+
+        # Every table's second chunk only holds a rejected row
+        assert [change.entity for change in events if change.row is None] == ["User", "Post", "Comment", "Like"]
+        assert next(change.refs for change in events if change.entity == "Post") == {"User": [1, 2]}
+        assert [change.row for change in events if change.entity == "follows"] == [{"follower_id": 1, "following_id": 2}]
+
+
+# ==============================================================================
+# QUERY PLANNER
+# ==============================================================================
+
+class TestQueryPlanner:
+    """Tests for the opt-in query planner extension."""
+
+    POSTS_QUERY = """
+        { posts { id ...PostDetails likesCount comments { content author { username } } } }
+        fragment PostDetails on Post { author { username } tags { name } }
+    """
+
+    @pytest.fixture
+    def planned_schema(self):
+        import strawberry
+        from main import Query, Mutation
+        from query_planner import QueryPlannerExtension
+
+        return strawberry.Schema(query=Query, mutation=Mutation, extensions=[QueryPlannerExtension])
+
+    @pytest.fixture
+    def viewer(self, db_session, auth_headers):
+        from users.models import User
+        return db_session.query(User).filter(User.username == "testuser").first()
+
+    @pytest.fixture
+    def liked_post(self, db_session, viewer):
+        from posts.models import Post
+        from comments.models import Comment
+        from likes.models import Like
+        from tags.models import Tag
+
+        tag = db_session.query(Tag).first()
+        post = Post(author_id=viewer.id, content="Planned post", tags=[tag] if tag else [])
+        db_session.add(post)
+        db_session.flush()
+        db_session.add_all([
+            Comment(post_id=post.id, author_id=viewer.id, content="Planned comment"),
+            Like(post_id=post.id, user_id=viewer.id),
+        ])
+        db_session.commit()
+        yield post
+        db_session.delete(post)
+        db_session.commit()
+
+    async def execute(self, schema, query, viewer, sql_statements):
+        from main import Context
+        from database import SessionLocal
+
+        sql_statements.clear()
+        db = SessionLocal()
+        try:
+            result = await schema.execute(query, context_value=Context(db=db, user=viewer))
+        finally:
+            db.close()
+        assert result.errors is None
+        return result.data, len(sql_statements)
+
+    @pytest.mark.asyncio
+    async def test_planned_posts_match_loaders(self, planned_schema, viewer, liked_post, sql_statements):
+        """Test that planned prefetching returns the same data with fewer statements."""
+        from main import schema
+
+        expected, loader_statements = await self.execute(schema, self.POSTS_QUERY, viewer, sql_statements)
+        data, planned_statements = await self.execute(planned_schema, self.POSTS_QUERY, viewer, sql_statements)
+        assert data == expected
+        assert planned_statements < loader_statements
+
+        post = next(p for p in data["posts"] if p["id"] == liked_post.id)
+        assert post["likesCount"] == 1
+        assert post["comments"] == [{"content": "Planned comment", "author": {"username": "testuser"}}]
+
+    @pytest.mark.asyncio
+    async def test_user_posts_are_prefetched(self, planned_schema, viewer, liked_post, sql_statements):
+        """Test that user { posts } is prefetched by the user resolver."""
+        from main import schema
+
+        query = f"{{ user(id: {viewer.id}) {{ posts {{ id author {{ username }} tags {{ name }} likesCount }} }} }}"
+        expected, loader_statements = await self.execute(schema, query, viewer, sql_statements)
+        data, planned_statements = await self.execute(planned_schema, query, viewer, sql_statements)
+        assert data == expected
+        assert planned_statements <= loader_statements
+        # Fetched for this one user by the plan, not through the posts-by-author loader
+        assert not any("posts.author_id IN" in statement for statement in sql_statements)
+
+    @pytest.mark.asyncio
+    async def test_arguments_fall_back_to_loaders(self, planned_schema, viewer, liked_post, sql_statements):
+        """Test that fields with arguments are not planned and still resolve through the loaders."""
+        from main import schema
+
+        query = "{ posts { id comments(first: 1, orderBy: NEWEST) { content } } }"
+        expected, _ = await self.execute(schema, query, viewer, sql_statements)
+        data, _ = await self.execute(planned_schema, query, viewer, sql_statements)
+        assert data == expected
+
+    @pytest.mark.asyncio
+    async def test_excluded_selections_are_not_planned(self, planned_schema, viewer, liked_post, sql_statements):
+        """Test that fields left out by @include / @skip are never prefetched."""
+        query = """query Posts($withComments: Boolean!) {
+            posts { id comments @include(if: $withComments) { content } ...Counts @skip(if: true) }
+        }
+        fragment Counts on Post { likesCount }"""
+        from main import Context
+        from database import SessionLocal
+
+        sql_statements.clear()
+        with SessionLocal() as db:
+            result = await planned_schema.execute(
+                query, variable_values={"withComments": False}, context_value=Context(db=db, user=viewer)
+            )
+        assert result.errors is None
+        assert all(set(post) == {"id"} for post in result.data["posts"])
+        assert not any("FROM comments" in statement or "FROM likes" in statement for statement in sql_statements)
+
+
+# ==============================================================================
+# ARCHIVE PARTITIONS
+# ==============================================================================
+
+class TestArchive:
+    """Tests for archive.py monthly partitions and reads routed to them."""
+
+    THREAD_QUERY = """query Thread($id: Int!, $commentId: Int!) {
+        post(id: $id) {
+            content author { username } tags { name } likesCount likes { userId }
+            comments { content likes { userId } }
+        }
+        comment(id: $commentId) { content post { id } }
+        comments(postId: $id) { content }
+    }"""
+
+    @pytest.fixture
+    def threads(self, db_session, auth_headers):
+        from datetime import datetime
+        from sqlalchemy import delete
+        from archive import archive_catalog
+        from comments.models import Comment
+        from likes.models import Like
+        from posts.models import Post, PostArchive
+        from tags.models import Tag
+        from users.models import User
+
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        tag = db_session.query(Tag).first()
+        january = datetime(2020, 1, 15)
+        cold = Post(author_id=viewer.id, content="Cold post", created_at=january, updated_at=january, tags=[tag] if tag else [])
+        # Just as old, but liked recently: its thread stays hot
+        warm = Post(author_id=viewer.id, content="Warm post", created_at=january, updated_at=january)
+        db_session.add_all([cold, warm])
+        db_session.flush()
+        comment = Comment(post_id=cold.id, author_id=viewer.id, content="Cold comment", created_at=january, updated_at=january)
+        db_session.add(comment)
+        db_session.flush()
+        db_session.add_all([
+            Like(post_id=cold.id, user_id=viewer.id, created_at=january),
+            Like(comment_id=comment.id, user_id=viewer.id, created_at=january),
+            Like(post_id=warm.id, user_id=viewer.id),
+        ])
+        db_session.commit()
+        ids = {"cold": cold.id, "warm": warm.id, "comment": comment.id}
+        yield ids
+
+        db_session.expire_all()
+        for post in db_session.query(Post).filter(Post.id.in_(ids.values())):
+            db_session.delete(post)
+        db_session.execute(delete(Like).where(Like.post_id.in_([ids["cold"], ids["warm"]]) | (Like.comment_id == ids["comment"])))
+        db_session.execute(delete(PostArchive).where(PostArchive.period == "2020-01"))
+        db_session.commit()
+        archive_catalog.invalidate()
+
+    def archive(self, db_engine, db_session, tmp_path):
+        from datetime import datetime
+        from archive import run_archive
+
+        reports = run_archive(db_engine, datetime(2020, 6, 1), str(tmp_path))
+        db_session.expire_all()
+        return reports
+
+    def test_archive_moves_cold_threads(self, db_engine, db_session, threads, tmp_path):
+        """Test that only threads quiet since the cutoff move, into a compressed monthly partition."""
+        from comments.models import Comment
+        from likes.models import Like
+        from posts.models import Post, PostArchive
+
+        [report] = self.archive(db_engine, db_session, tmp_path)
+        assert (report.period, report.posts, report.comments, report.likes) == ("2020-01", 1, 1, 2)
+        assert (tmp_path / "posts-2020-01.db.gz").exists()
+
+        assert db_session.get(Post, threads["cold"]) is None
+        assert db_session.get(Comment, threads["comment"]) is None
+        assert db_session.query(Like).filter(Like.post_id == threads["cold"]).count() == 0
+        assert db_session.get(Post, threads["warm"]) is not None
+        catalog = db_session.get(PostArchive, "2020-01")
+        assert catalog.min_post_id <= threads["cold"] <= catalog.max_post_id
+
+    def test_archive_keeps_threads_that_got_activity(self, db_engine, db_session, threads, tmp_path):
+        """Test that a thread commented on after it was listed as cold stays in the hot tables."""
+        from datetime import datetime
+        from archive import archive_period, cold_posts
+        from comments.models import Comment
+        from posts.models import Post
+
+        cutoff = datetime(2020, 6, 1)
+        with db_engine.connect() as connection:
+            post_ids = cold_posts(connection, cutoff)["2020-01"]
+        assert threads["cold"] in post_ids
+        comment = Comment(post_id=threads["cold"], author_id=db_session.get(Post, threads["cold"]).author_id, content="Late")
+        db_session.add(comment)
+        db_session.commit()
+
+        assert archive_period(db_engine, "2020-01", post_ids, cutoff, str(tmp_path)) is None
+        db_session.expire_all()
+        assert db_session.get(Post, threads["cold"]) is not None
+        assert db_session.get(Comment, comment.id) is not None
+        assert not (tmp_path / "posts-2020-01.db.gz").exists()
+
+    @pytest.mark.asyncio
+    async def test_archived_thread_still_resolves(self, client, auth_headers, db_engine, db_session, threads, tmp_path):
+        """Test that lookups and DataLoaders fall back to the partition for archived rows."""
+        body = {"query": self.THREAD_QUERY, "variables": {"id": threads["cold"], "commentId": threads["comment"]}}
+        before = (await client.post("/graphql", json=body, headers=auth_headers)).json()
+        assert "errors" not in before
+        assert before["data"]["post"]["likesCount"] == 1
+
+        self.archive(db_engine, db_session, tmp_path)
+        after = (await client.post("/graphql", json=body, headers=auth_headers)).json()
+        assert after == before
+
+    @pytest.mark.asyncio
+    async def test_export_includes_archived_rows(self, client, auth_headers, db_engine, db_session, threads, tmp_path, monkeypatch):
+        """Test that /export streams archived posts and likes after the hot ones."""
+        import json
+
+        monkeypatch.setattr("export.EXPORT_USERS", ["testuser"])
+        self.archive(db_engine, db_session, tmp_path)
+        response = await client.get("/export/posts", headers=auth_headers)
+        ids = [json.loads(line)["id"] for line in response.text.splitlines()]
+        assert ids[-1] == threads["cold"]
+        assert threads["warm"] in ids
+
+        response = await client.get("/export/likes", headers=auth_headers)
+        likes = [json.loads(line) for line in response.text.splitlines()]
+        assert any(like["post_id"] == threads["cold"] for like in likes)
+
+    @pytest.mark.asyncio
+    async def test_hot_posts_without_children_skip_partitions(
+        self, client, auth_headers, db_engine, db_session, threads, tmp_path, monkeypatch
+    ):
+        """Test that empty counts and lists of a hot post in an archived id range are not looked up in partitions."""
+        import archive
+        from posts.models import Post, PostArchive
+        from users.models import User
+
+        self.archive(db_engine, db_session, tmp_path)
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        quiet = Post(author_id=viewer.id, content="Quiet post")
+        db_session.add(quiet)
+        db_session.flush()
+        # Hot posts of archived months sit inside the partition's id range
+        db_session.get(PostArchive, "2020-01").max_post_id = quiet.id
+        db_session.commit()
+        archive.archive_catalog.invalidate()
+
+        opened = []
+        archive_session = archive.archive_session
+        monkeypatch.setattr(archive, "archive_session", lambda partition: opened.append(partition) or archive_session(partition))
+        query = """query Quiet($id: Int!) {
+            post(id: $id) { likesCount viewerHasLiked likes { userId } tags { name } comments { content } }
+            comments(postId: $id) { content }
+        }"""
+        response = await client.post("/graphql", json={"query": query, "variables": {"id": quiet.id}}, headers=auth_headers)
+        data = response.json()["data"]
+        assert data["post"] == {"likesCount": 0, "viewerHasLiked": False, "likes": [], "tags": [], "comments": []}
+        assert data["comments"] == []
+        assert opened == []
+
+        db_session.delete(quiet)
+        db_session.commit()
+
+    @pytest.mark.asyncio
+    async def test_lists_include_archived_on_demand(self, client, auth_headers, db_engine, db_session, threads, tmp_path):
+        """Test that posts leave archived threads out unless includeArchived is set."""
+        self.archive(db_engine, db_session, tmp_path)
+
+        response = await client.post("/graphql", json={"query": "{ posts { id } }"}, headers=auth_headers)
+        hot_ids = [post["id"] for post in response.json()["data"]["posts"]]
+        assert threads["cold"] not in hot_ids
+        assert threads["warm"] in hot_ids
+
+        response = await client.post(
+            "/graphql", json={"query": "{ posts(includeArchived: true) { id } }"}, headers=auth_headers
+        )
+        all_ids = [post["id"] for post in response.json()["data"]["posts"]]
+        # Partitions follow the hot tables
+        assert all_ids == hot_ids + [threads["cold"]]
+
+    @pytest.mark.asyncio
+    async def test_archiving_evicts_cached_lists(self, db_engine, db_session, threads, tmp_path):
+        """Test that cached results listing archived posts are evicted once the archive's events are delivered."""
+        import strawberry
+        from cache_control import CacheControlExtension
+        from database import SessionLocal
+        from main import Context, Mutation, Query
+        from outbox import outbox
+        from result_cache import ResultCacheExtension, result_cache
+        from users.models import User
+
+        schema = strawberry.Schema(query=Query, mutation=Mutation, extensions=[CacheControlExtension, ResultCacheExtension])
+        viewer = db_session.query(User).filter(User.username == "testuser").first()
+        result_cache.clear()
+        try:
+            before = await schema.execute("{ posts { id } }", context_value=Context(db=SessionLocal(), user=viewer))
+            assert threads["cold"] in [post["id"] for post in before.data["posts"]]
+            assert len(result_cache) == 1
+
+            self.archive(db_engine, db_session, tmp_path)
+            outbox.drain(db_engine)
+            assert len(result_cache) == 0
+            after = await schema.execute("{ posts { id } }", context_value=Context(db=SessionLocal(), user=viewer))
+            assert threads["cold"] not in [post["id"] for post in after.data["posts"]]
+        finally:
+            result_cache.clear()
+
+
+# ==============================================================================
+# SHARDING
+# ==============================================================================
+
+class TestSharding:
+    """Tests for posts, comments and likes split over shard databases by reshard.py."""
+
+    QUERY = """{
+        feed(first: 8) {
+            content author { username } tags { name } likesCount viewerHasLiked
+            comments { content author { username } likes { userId } replies { content } }
+        }
+        posts(authorId: 3) { content comments(first: 1, orderBy: NEWEST) { content } likes(first: 2) { userId } }
+        trendingPosts(window: WEEK, first: 5) { content }
+        comments { content post { content } }
+    }"""
+    # Results in no particular order: compared as sets
+    UNORDERED_QUERY = """{
+        search(query: "thread", type: POST, first: 50) { edges { node { ... on Post { content } ... on Comment { content } } } }
+        tags { name posts { content } }
+    }"""
+
+    @pytest.fixture
+    def network(self, tmp_path):
+        """A main database of its own: 12 users, each with posts, tags, comments, replies and likes."""
+        from datetime import datetime, timedelta
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+        from database import Base, shard_map
+        from comments.models import Comment
+        from likes.models import Like
+        from posts.models import Post
+        from tags.dictionary import tag_dictionary
+        from tags.models import Tag
+        from users.models import User, follows_table
+
+        main = create_engine(f"sqlite:///{tmp_path}/main.db")
+        Base.metadata.create_all(bind=main)
+        start = datetime(2024, 1, 1)
+        with Session(main) as db:
+            users = [User(username=f"shard{i}", email=f"shard{i}@example.com", password_hash="x") for i in range(1, 13)]
+            tags = [Tag(name="news"), Tag(name="sports")]
+            db.add_all(users + tags)
+            db.flush()
+            posts = [
+                Post(author_id=user.id, content=f"thread {user.id}.{n}", tags=[tags[(user.id + n) % 2]],
+                     created_at=start + timedelta(hours=3 * user.id + n))
+                for user in users for n in range(3)
+            ]
+            db.add_all(posts)
+            db.flush()
+            comments = [
+                Comment(post_id=post.id, author_id=users[(post.id + k) % 12].id, content=f"thread comment {post.id}.{k}",
+                        created_at=post.created_at + timedelta(minutes=k + 1))
+                for post in posts for k in range(2)
+            ]
+            db.add_all(comments)
+            db.flush()
+            db.add_all([
+                Comment(post_id=comment.post_id, parent_comment_id=comment.id, author_id=users[0].id,
+                        content=f"reply {comment.id}", created_at=comment.created_at + timedelta(seconds=30))
+                for comment in comments[::5]
+            ])
+            db.add_all([Like(post_id=post.id, user_id=users[k].id) for post in posts for k in range(post.id % 4)])
+            db.add_all([Like(comment_id=comment.id, user_id=users[1].id) for comment in comments[::3]])
+            db.commit()
+            # Core, so the process-wide follow graph never sees these users
+            db.execute(follows_table.insert(), [{"follower_id": users[0].id, "following_id": user.id} for user in users[1:]])
+            db.commit()
+        tag_dictionary.invalidate()
+        yield main
+        shard_map.configure([])
+        tag_dictionary.invalidate()
+        main.dispose()
+
+    async def execute(self, main, query, schema=None):
+        from sqlalchemy.orm import Session
+        from main import Context, schema as default_schema
+        from users.models import User
+
+        with Session(main) as db:
+            context = Context(db=db, user=db.get(User, 1))
+            try:
+                result = await (schema or default_schema).execute(query, context_value=context)
+            finally:
+                context.shards.close()
+        assert result.errors is None, result.errors
+        return result.data
+
+    def split(self, main, tmp_path, count, sources=()):
+        from database import shard_map
+        from reshard import reshard
+
+        urls = [f"sqlite:///{tmp_path}/shard{index}.db" for index in range(count)]
+        report = reshard(main, list(sources), urls)
+        shard_map.configure(urls)
+        return report
+
+    def test_split_places_threads_with_their_author(self, network, tmp_path):
+        """Test that every post, comment and like lands on the shard of the post's author, under a routable id."""
+        from sqlalchemy import func, select
+        from database import SHARD_SLOTS, shard_map
+        from comments.models import Comment
+        from likes.models import Like
+        from posts.models import Post
+
+        with network.connect() as connection:
+            counts = {model: connection.execute(select(func.count()).select_from(model)).scalar() for model in (Post, Comment, Like)}
+        report = self.split(network, tmp_path, 3)
+        assert report.skipped == 0
+        assert {model.__tablename__: report.rows[model.__tablename__] for model in counts} == \
+            {model.__tablename__: count for model, count in counts.items()}
+
+        with network.connect() as connection:
+            assert connection.execute(select(func.count()).select_from(Post)).scalar() == 0
+        for index, shard in enumerate(shard_map.engines):
+            with shard.connect() as connection:
+                for id, author_id in connection.execute(select(Post.id, Post.author_id)):
+                    assert id % SHARD_SLOTS == author_id % SHARD_SLOTS
+                    assert shard_map.shard_of(id) == index
+                for id, post_id in connection.execute(select(Comment.id, Comment.post_id)):
+                    assert id % SHARD_SLOTS == post_id % SHARD_SLOTS
+                    assert connection.execute(select(Post.id).where(Post.id == post_id)).first() is not None
+        assert len({shard_map.shard_of(user_id) for user_id in range(1, 13)}) == 3
+
+    @pytest.mark.asyncio
+    async def test_queries_match_one_database(self, network, tmp_path):
+        """Test that lists, nested loaders, trending and search read the same across shards as from one database."""
+        def unordered(data):
+            # bm25 is scored per shard, and tag posts come shard by shard
+            return (
+                sorted(edge["node"]["content"] for edge in data["search"]["edges"]),
+                {tag["name"]: sorted(post["content"] for post in tag["posts"]) for tag in data["tags"]},
+            )
+
+        before = await self.execute(network, self.QUERY)
+        unordered_before = unordered(await self.execute(network, self.UNORDERED_QUERY))
+        assert len(before["feed"]) == 8 and before["posts"]
+
+        self.split(network, tmp_path, 3)
+        assert await self.execute(network, self.QUERY) == before
+        assert unordered(await self.execute(network, self.UNORDERED_QUERY)) == unordered_before
+
+    @pytest.mark.asyncio
+    async def test_planned_queries_match_one_database(self, network, tmp_path):
+        """Test that the query planner prefetches each post's children from the post's shard."""
+        import strawberry
+        from main import Query, Mutation
+        from query_planner import QueryPlannerExtension
+
+        planned = strawberry.Schema(query=Query, mutation=Mutation, extensions=[QueryPlannerExtension])
+        query = "{ feed { content author { username } tags { name } likesCount comments { content author { username } } } }"
+        before = await self.execute(network, query)
+        self.split(network, tmp_path, 3)
+        assert await self.execute(network, query, planned) == before
+
+    @pytest.mark.asyncio
+    async def test_loader_batches_split_by_shard(self, network, tmp_path):
+        """Test that one loader batch becomes one query per shard, run on worker threads."""
+        import threading
+        from sqlalchemy import event
+        from database import shard_map
+
+        self.split(network, tmp_path, 3)
+        counts = []
+
+        def record(index):
+            def listener(conn, cursor, statement, *args):
+                if "count(likes.id)" in statement:
+                    counts.append((index, threading.current_thread() is threading.main_thread()))
+            return listener
+
+        listeners = [(shard, record(index)) for index, shard in enumerate(shard_map.engines)]
+        for shard, listener in listeners:
+            event.listen(shard, "before_cursor_execute", listener)
+        try:
+            await self.execute(network, "{ posts { likesCount } }")
+        finally:
+            for shard, listener in listeners:
+                event.remove(shard, "before_cursor_execute", listener)
+        assert sorted(counts) == [(0, False), (1, False), (2, False)]
+
+    @pytest.mark.asyncio
+    async def test_adding_a_shard_moves_only_reassigned_slots(self, network, tmp_path):
+        """Test that growing from 3 to 4 shards moves just the slots jump hashing gives the new one, ids unchanged."""
+        from sqlalchemy import select
+        from database import SHARD_SLOTS, shard_map
+        from posts.models import Post
+        from reshard import placement
+
+        before = await self.execute(network, self.QUERY)
+        self.split(network, tmp_path, 3)
+
+        def post_ids():
+            ids = set()
+            for shard in shard_map.engines:
+                with shard.connect() as connection:
+                    ids.update(connection.execute(select(Post.id)).scalars())
+            return ids
+
+        ids = post_ids()
+        report = self.split(network, tmp_path, 4, sources=shard_map.engines)
+        three, four = placement(3), placement(4)
+        moved = [slot for slot in range(SHARD_SLOTS) if three[slot] != four[slot]]
+        assert report.slots == len(moved)
+        assert all(four[slot] == 3 for slot in moved)
+        assert post_ids() == ids
+        assert await self.execute(network, self.QUERY) == before
+
+
+# ==============================================================================
+# OUTBOX
+# ==============================================================================
+
+class TestOutbox:
+    """Tests for change events written with each commit and delivered to subscribers."""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        from sqlalchemy import create_engine
+        from database import Base
+        from users.models import User
+
+        engine = create_engine(f"sqlite:///{tmp_path}/outbox.db")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            connection.execute(User.__table__.insert(), [
+                {"username": f"outbox{i}", "email": f"outbox{i}@example.com", "password_hash": "x"} for i in range(1, 4)
+            ])
+        yield engine
+        engine.dispose()
+
+    @staticmethod
+    def events(engine):
+        from sqlalchemy import select
+        from outbox import OutboxEvent
+
+        with engine.connect() as connection:
+            return [
+                (row.entity, row.entity_id, row.op, row.data)
+                for row in connection.execute(select(OutboxEvent.__table__).order_by(OutboxEvent.id))
+            ]
+
+    def test_commits_record_row_and_link_changes(self, store):
+        """Test that a commit records its inserts, updates, deletes and follows, and a rollback records nothing."""
+        from sqlalchemy.orm import Session
+        from comments.models import Comment
+        from posts.models import Post
+        from users.models import User
+
+        with Session(store) as db:
+            alice, bob = db.get(User, 1), db.get(User, 2)
+            post = Post(author_id=alice.id, content="first")
+            db.add(post)
+            db.flush()
+            db.add(Comment(post_id=post.id, author_id=bob.id, content="hi"))
+            bob.following.append(alice)
+            db.commit()
+
+            post.content = "edited"
+            db.commit()
+
+            db.delete(post)
+            db.add(Post(author_id=bob.id, content="never committed"))
+            db.flush()
+            db.rollback()
+
+        events = self.events(store)
+        assert events[:2] == [
+            ("Post", 1, "insert", {"refs": {"User": [1]}}),
+            ("Comment", 1, "insert", {"refs": {"Post": [1], "User": [2]}}),
+        ]
+        assert ("follows", None, "insert", {"refs": {"User": [1, 2]}, "row": {"follower_id": 2, "following_id": 1}}) in events
+        assert events[-1] == ("Post", 1, "update", {"refs": {"User": [1]}})
+        # Nothing from the rolled back transaction
+        assert all(op != "delete" for _, _, op, _ in events)
+        assert not any(entity == "Post" and entity_id == 2 for entity, entity_id, _, _ in events)
+
+    def test_subscribers_get_batches_in_order_and_failures_are_redelivered(self, store):
+        """Test that each subscriber keeps its own cursor: a failing one is offered the batch again, others move on."""
+        from outbox import Outbox, record
+
+        box = Outbox(batch_size=2)
+        seen, attempts = [], []
+
+        @box.subscribe
+        def collect(events):
+            seen.append([event.entity_id for event in events])
+
+        @box.subscribe
+        def flaky(events):
+            attempts.append([event.entity_id for event in events])
+            if len(attempts) == 1:
+                raise RuntimeError("subscriber down")
+
+        with store.begin() as connection:
+            record(connection, [{"entity": "Post", "entity_id": 1, "op": "insert", "data": {"refs": {}}}])
+        box.start([store])
+        with store.begin() as connection:
+            record(connection, [{"entity": "Post", "entity_id": id, "op": "insert", "data": {"refs": {}}} for id in range(2, 7)])
+
+        assert box.drain(store) == 5
+        assert seen == [[2, 3], [4, 5], [6]]
+        assert attempts == [[2, 3]]
+
+        box.drain(store)
+        assert seen == [[2, 3], [4, 5], [6]]
+        assert attempts == [[2, 3], [2, 3], [4, 5], [6]]
+
+    @pytest.mark.asyncio
+    async def test_other_workers_commits_reach_the_caches(self, db_session):
+        """Test that a follow and a tag written outside this process's sessions update the follow graph and tag dictionary once delivered."""
+        from sqlalchemy import delete, insert
+        from database import engine
+        from outbox import outbox, record
+        from tags.dictionary import tag_dictionary
+        from tags.models import Tag
+        from users.follow_graph import follow_graph
+        from users.models import User, follows_table
+
+        a = User(username="outbox_a", email="outbox_a@example.com", password_hash="x")
+        b = User(username="outbox_b", email="outbox_b@example.com", password_hash="x")
+        db_session.add_all([a, b])
+        db_session.commit()
+        tag_dictionary.all(db_session)
+
+        # What another worker's commit leaves behind: the rows and their events
+        with engine.begin() as connection:
+            connection.execute(insert(follows_table), {"follower_id": a.id, "following_id": b.id})
+            tag_id = connection.execute(insert(Tag.__table__).returning(Tag.__table__.c.id), {"name": "outbox-news"}).scalar()
+            record(connection, [
+                {"entity": "follows", "entity_id": None, "op": "insert",
+                 "data": {"refs": {"User": [a.id, b.id]}, "row": {"follower_id": a.id, "following_id": b.id}}},
+                {"entity": "Tag", "entity_id": tag_id, "op": "insert", "data": {"refs": {}}},
+            ])
+        assert b.id not in follow_graph.following(a.id)
+        assert "outbox-news" not in [tag.name for tag in tag_dictionary.all(db_session)]
+
+        outbox.drain(engine)
+        assert list(follow_graph.following(a.id)) == [b.id]
+        assert "outbox-news" in [tag.name for tag in tag_dictionary.all(db_session)]
+
+        with engine.begin() as connection:
+            connection.execute(delete(follows_table).where(follows_table.c.follower_id == a.id))
+            connection.execute(delete(Tag.__table__).where(Tag.__table__.c.id == tag_id))
+        db_session.delete(a)
+        db_session.delete(b)
+        db_session.commit()
+
+    @pytest.mark.asyncio
+    async def test_shutdown_waits_for_the_consumer(self):
+        """Test that leaving the app's lifespan cancels the outbox consumer and waits for it to finish."""
+        import asyncio
+        from main import app, lifespan
+
+        def consumers():
+            return [task for task in asyncio.all_tasks() if task.get_coro().__qualname__ == "Outbox.run"]
+
+        async with lifespan(app):
+            await asyncio.sleep(0)
+            [consumer] = consumers()
+        assert consumer.cancelled()
+        assert consumers() == []
+
+
+# ==============================================================================
+# REQUEST SESSIONS
+# ==============================================================================
+
+class TestRequestSessions:
+    """Tests that a request holds a pool connection only while its resolvers need one."""
+
+    @pytest.fixture
+    def checkouts(self, db_engine):
+        from sqlalchemy import event
+        counted = []
+
+        def count(dbapi_connection, connection_record, connection_proxy):
+            counted.append(connection_record)
+
+        event.listen(db_engine, "checkout", count)
+        yield counted
+        event.remove(db_engine, "checkout", count)
+
+    @pytest.mark.asyncio
+    async def test_invalid_operation_takes_no_connection(self, client, auth_headers, checkouts):
+        """Test that an authenticated request failing validation never checks out a connection."""
+        response = await client.post("/graphql", json={"query": "{ me { noSuchField } }"}, headers=auth_headers)
+
+        assert response.json()["errors"]
+        assert checkouts == []
+
+    @pytest.mark.asyncio
+    async def test_viewer_is_loaded_on_first_use(self, client, auth_headers, checkouts):
+        """Test that the viewer row is read only by resolvers that use it."""
+        response = await client.post("/graphql", json={"query": "{ tags { name } }"}, headers=auth_headers)
+        assert "errors" not in response.json()
+        assert len(checkouts) == 1
+
+        response = await client.post("/graphql", json={"query": "{ me { username } }"}, headers=auth_headers)
+        assert response.json()["data"]["me"]["username"] == "testuser"
+
+    @pytest.mark.asyncio
+    async def test_connections_are_returned_before_serialization(self, client, auth_headers, db_engine):
+        """Test that the request's connection is back in the pool by the time the result is encoded."""
+        from main import graphql_app
+
+        baseline = db_engine.pool.checkedout()
+        checked_out = []
+        encoder = graphql_app.encoder
+
+        def encode(data):
+            checked_out.append(db_engine.pool.checkedout())
+            return encoder(data)
+
+        graphql_app.encoder = encode
+        try:
+            response = await client.post("/graphql", json={"query": "{ me { username } posts { id author { username } } }"}, headers=auth_headers)
+        finally:
+            graphql_app.encoder = encoder
+
+        assert response.json()["data"]["me"]["username"] == "testuser"
+        assert checked_out == [baseline]
+
+
+# ==============================================================================
+# SNAPSHOT READS
+# ==============================================================================
+
+class TestSnapshotReads:
+    """Tests for query operations reading from one snapshot while writes commit."""
+
+    QUERY = "{{ post(id: {id}) {{ likesCount likes {{ userId }} }} }}"
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        """A WAL database with one post and two likes, and a hook that commits a third like between two reads."""
+        import sqlite3
+        from sqlalchemy import create_engine, event
+        from database import Base
+        from likes.models import Like
+        from posts.models import Post
+        from snapshot_reads import use_wal
+        from users.models import User
+
+        path = tmp_path / "snapshot.db"
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        use_wal(engine)
+        with engine.begin() as connection:
+            connection.execute(User.__table__.insert(), [
+                {"username": f"snap{i}", "email": f"snap{i}@example.com", "password_hash": "x"} for i in range(1, 4)
+            ])
+            connection.execute(Post.__table__.insert(), {"id": 1, "author_id": 1, "content": "snapshot"})
+            connection.execute(Like.__table__.insert(), [{"post_id": 1, "user_id": 1}, {"post_id": 1, "user_id": 2}])
+
+        like_reads = []
+
+        def concurrent_like(conn, cursor, statement, parameters, context, executemany):
+            if "FROM likes" in statement:
+                like_reads.append(statement)
+                if len(like_reads) == 2:
+                    with sqlite3.connect(path) as writer:
+                        writer.execute("INSERT INTO likes (post_id, user_id) VALUES (1, 3)")
+
+        event.listen(engine, "before_cursor_execute", concurrent_like)
+        yield engine
+        event.remove(engine, "before_cursor_execute", concurrent_like)
+        engine.dispose()
+
+    async def execute(self, engine, extensions):
+        import strawberry
+        from sqlalchemy.orm import Session
+        from main import Context, Mutation, Query
+
+        schema = strawberry.Schema(query=Query, mutation=Mutation, extensions=extensions)
+        with Session(engine) as db:
+            result = await schema.execute(self.QUERY.format(id=1), context_value=Context(db=db, viewer_id=3))
+        assert result.errors is None
+        post = result.data["post"]
+        return post["likesCount"], len(post["likes"])
+
+    @pytest.mark.asyncio
+    async def test_loaders_read_one_snapshot(self, store):
+        """Test that likesCount and likes agree although a like commits between their queries."""
+        from snapshot_reads import SnapshotReadsExtension
+
+        assert await self.execute(store, [SnapshotReadsExtension]) == (2, 2)
+        # The like committed meanwhile is there for the next request
+        assert await self.execute(store, [SnapshotReadsExtension]) == (3, 3)
+
+    @pytest.mark.asyncio
+    async def test_without_snapshots_loaders_can_disagree(self, store):
+        """Test that, without the extension, the same interleaving shows two states in one response."""
+        count, listed = await self.execute(store, [])
+        assert count != listed
+
+    def test_snapshot_sessions_are_read_only(self, store):
+        """Test that a snapshot session refuses writes and its connection goes back to the pool writable."""
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+        from sqlalchemy.orm import Session
+
+        with Session(store, info={"snapshot": True}) as db:
+            with pytest.raises(OperationalError, match="readonly"):
+                db.execute(text("UPDATE users SET bio = 'x'"))
+        with Session(store) as db:
+            assert db.execute(text("UPDATE users SET bio = 'x'")).rowcount == 3
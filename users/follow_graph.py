@@ -0,0 +1,164 @@
+# In-memory adjacency index of the follow graph.
+#
+# Every user has two sorted integer arrays (who they follow, who follows
+# them), built from the `follows` table at startup and kept current from the
+# outbox's follow events, including commits made by other workers. Graph
+# questions become intersections of sorted arrays instead of multi-hop joins.
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import select
+
+from outbox import ChangeEvent, outbox
+from users import models
+
+# Above this size ratio, intersect by binary search of the larger array
+# (O(m log n)) instead of a linear merge (O(m + n)).
+GALLOP_RATIO = 16
+
+_EMPTY = array("q")
+
+
+def intersect_sorted(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+
+    result = []
+    n = len(b)
+    if n > GALLOP_RATIO * len(a):
+        lo = 0
+        for value in a:
+            lo = bisect_left(b, value, lo)
+            if lo == n:
+                break
+            if b[lo] == value:
+                result.append(value)
+                lo += 1
+        return result
+
+    i = j = 0
+    m = len(a)
+    while i < m and j < n:
+        x, y = a[i], b[j]
+        if x == y:
+            result.append(x)
+            i += 1
+            j += 1
+        elif x < y:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def _contains(values: Sequence[int], value: int) -> bool:
+    index = bisect_left(values, value)
+    return index < len(values) and values[index] == value
+
+
+def _insert(index: Dict[int, array], key: int, value: int) -> None:
+    values = index.get(key)
+    if values is None:
+        index[key] = array("q", [value])
+        return
+    position = bisect_left(values, value)
+    if position == len(values) or values[position] != value:
+        values.insert(position, value)
+
+
+def _remove(index: Dict[int, array], key: int, value: int) -> None:
+    values = index.get(key)
+    if values is None:
+        return
+    position = bisect_left(values, value)
+    if position < len(values) and values[position] == value:
+        del values[position]
+        if not values:
+            del index[key]
+
+
+def _build(edges: Iterable[Tuple[int, int]]) -> Tuple[Dict[int, array], Dict[int, array]]:
+    following = defaultdict(list)
+    followers = defaultdict(list)
+    for follower_id, following_id in edges:
+        following[follower_id].append(following_id)
+        followers[following_id].append(follower_id)
+    return (
+        {user_id: array("q", sorted(ids)) for user_id, ids in following.items()},
+        {user_id: array("q", sorted(ids)) for user_id, ids in followers.items()},
+    )
+
+
+class FollowGraph:
+    """Sorted adjacency arrays per user for both directions of `follows`."""
+
+    def __init__(self, edges: Iterable[Tuple[int, int]] = ()):
+        self._following, self._followers = _build(edges)
+
+    def load(self, connection) -> None:
+        table = models.follows_table
+        rows = connection.execute(select(table.c.follower_id, table.c.following_id))
+        self._following, self._followers = _build(rows)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._following.values())
+
+    def following(self, user_id: int) -> Sequence[int]:
+        return self._following.get(user_id, _EMPTY)
+
+    def followers(self, user_id: int) -> Sequence[int]:
+        return self._followers.get(user_id, _EMPTY)
+
+    def is_following(self, follower_id: int, following_id: int) -> bool:
+        return _contains(self.following(follower_id), following_id)
+
+    def add_edge(self, follower_id: int, following_id: int) -> None:
+        _insert(self._following, follower_id, following_id)
+        _insert(self._followers, following_id, follower_id)
+
+    def remove_edge(self, follower_id: int, following_id: int) -> None:
+        _remove(self._following, follower_id, following_id)
+        _remove(self._followers, following_id, follower_id)
+
+    def remove_user(self, user_id: int) -> None:
+        for other in list(self.following(user_id)):
+            self.remove_edge(user_id, other)
+        for other in list(self.followers(user_id)):
+            self.remove_edge(other, user_id)
+
+    def mutual_followers(self, viewer_id: int, user_id: int) -> List[int]:
+        """Accounts the viewer follows that also follow `user_id`."""
+        return intersect_sorted(self.following(viewer_id), self.followers(user_id))
+
+    def suggestions(self, viewer_id: int, first: int) -> List[int]:
+        """Friends of friends the viewer does not follow yet, most shared connections first."""
+        followed = self.following(viewer_id)
+        counts = Counter()
+        for friend_id in followed:
+            counts.update(self.following(friend_id))
+        candidates = (
+            (count, user_id) for user_id, count in counts.items()
+            if user_id != viewer_id and not _contains(followed, user_id)
+        )
+        ranked = sorted(candidates, key=lambda item: (-item[0], item[1]))
+        return [user_id for _, user_id in ranked[:first]]
+
+
+follow_graph = FollowGraph()
+
+
+@outbox.subscribe
+def _apply_follow_changes(events: List[ChangeEvent]) -> None:
+    # Replaying an event already in the graph is harmless: edges are sets
+    for change in events:
+        if change.entity == models.follows_table.name:
+            if change.op == "insert":
+                follow_graph.add_edge(change.row["follower_id"], change.row["following_id"])
+            else:
+                follow_graph.remove_edge(change.row["follower_id"], change.row["following_id"])
+        elif change.entity == "User" and change.op == "delete":
+            follow_graph.remove_user(change.entity_id)
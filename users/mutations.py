@@ -1,7 +1,9 @@
 import strawberry
-from users.schemas import LoginInput, LoginResponse
-from users.resolvers import resolve_login
+from users.schemas import LoginInput, LoginResponse, User
+from users.resolvers import resolve_login, resolve_follow_user, resolve_unfollow_user
 
 @strawberry.type
 class UserMutation:
     login: LoginResponse = strawberry.mutation(resolver=resolve_login)
+    follow_user: User = strawberry.mutation(resolver=resolve_follow_user)
+    unfollow_user: User = strawberry.mutation(resolver=resolve_unfollow_user)
@@ -1,10 +1,17 @@
 import strawberry
 from typing import Optional, List
 from users.schemas import User
-from users.resolvers import resolve_me, resolve_user, resolve_users
+from users.resolvers import (
+    resolve_me, resolve_user, resolve_users,
+    resolve_mutual_followers, resolve_follow_suggestions, resolve_is_following,
+)
+from cache_control import CacheControl, CacheScope
 
 @strawberry.type
 class UserQuery:
-    me: Optional[User] = strawberry.field(resolver=resolve_me)
+    me: Optional[User] = strawberry.field(resolver=resolve_me, directives=[CacheControl(max_age=0, scope=CacheScope.PRIVATE)])
     user: Optional[User] = strawberry.field(resolver=resolve_user)
     users: List[User] = strawberry.field(resolver=resolve_users)
+    mutual_followers: List[User] = strawberry.field(resolver=resolve_mutual_followers)
+    follow_suggestions: List[User] = strawberry.field(resolver=resolve_follow_suggestions)
+    is_following: List[bool] = strawberry.field(resolver=resolve_is_following)
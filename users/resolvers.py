@@ -1,9 +1,12 @@
 import strawberry
 from typing import List, Optional, Annotated, TYPE_CHECKING
 from users import models
+from users.follow_graph import follow_graph
 from sqlalchemy.orm import Session # type: ignore
 from auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, verify_password
 from datetime import timedelta
+from posts import models as post_models
+from query_planner import post_plan, prefetch_posts
 
 # Import schemas for runtime usage?
 # The user wants NO import inside function.
@@ -18,6 +21,9 @@ if TYPE_CHECKING:
     from posts.schemas import Post
     from users.schemas import User, LoginInput, LoginResponse
 
+# Most users mutualFollowers and followSuggestions return
+MAX_FOLLOW_PAGE_SIZE = 100
+
 # Field Resolvers
 async def get_posts_for_user(root: "User", info: strawberry.Info) -> List["Post"]:
     loaders = info.context.loaders
@@ -36,6 +42,15 @@ def get_following(root: "User", info: strawberry.Info) -> List["User"]:
     user = db.query(models.User).filter(models.User.id == root.id).first()
     return [users.schemas.User.from_db_model(following) for following in user.following]
 
+async def get_viewer_follows(root: "User", info: strawberry.Info) -> bool:
+    if not info.context.user:
+        return False
+    return await info.context.loaders.viewer_follows_loader.load(root.id)
+
+async def load_users_in_order(info: strawberry.Info, ids: List[int]) -> List["User"]:
+    found = await info.context.loaders.user_loader.load_many(ids)
+    return [users.schemas.User.from_db_model(user) for user in found if user is not None]
+
 # Query Resolvers
 def resolve_me(info: strawberry.Info) -> Optional["User"]:
     # from users.schemas import User # Removed
@@ -53,6 +68,15 @@ def resolve_user(id: int, info: strawberry.Info) -> Optional["User"]:
     user = db.query(models.User).filter(models.User.id == id).first()
     if not user:
         raise Exception(f"User with id {id} not found")
+    plan = post_plan(info, "posts")
+    if plan is not None:
+        # `posts` is then read from the loaders, already primed with the prefetched rows
+        loaders = info.context.loaders
+        posts_db = info.context.shards.for_id(user.id)
+        user_posts = posts_db.query(post_models.Post).filter(post_models.Post.author_id == user.id).all()
+        loaders.posts_by_author_loader.prime(user.id, user_posts)
+        loaders.prime([user, *user_posts])
+        prefetch_posts(loaders, db, plan, user_posts)
     return users.schemas.User.from_db_model(user)
 
 def resolve_users(info: strawberry.Info) -> List["User"]:
@@ -64,7 +88,55 @@ def resolve_users(info: strawberry.Info) -> List["User"]:
     all_users = db.query(models.User).all()
     return [users.schemas.User.from_db_model(u) for u in all_users]
 
+async def resolve_mutual_followers(user_id: int, info: strawberry.Info, first: Optional[int] = None) -> List["User"]:
+    viewer = info.context.user
+    if not viewer:
+        raise Exception("Not authenticated")
+    first = MAX_FOLLOW_PAGE_SIZE if first is None else max(0, min(first, MAX_FOLLOW_PAGE_SIZE))
+    return await load_users_in_order(info, follow_graph.mutual_followers(viewer.id, user_id)[:first])
+
+async def resolve_follow_suggestions(info: strawberry.Info, first: int = 10) -> List["User"]:
+    viewer = info.context.user
+    if not viewer:
+        raise Exception("Not authenticated")
+    first = max(0, min(first, MAX_FOLLOW_PAGE_SIZE))
+    return await load_users_in_order(info, follow_graph.suggestions(viewer.id, first))
+
+def resolve_is_following(ids: List[int], info: strawberry.Info) -> List[bool]:
+    viewer = info.context.user
+    if not viewer:
+        raise Exception("Not authenticated")
+    return [follow_graph.is_following(viewer.id, user_id) for user_id in ids]
+
 # Mutation Resolvers
+def _follow_target(user_id: int, info: strawberry.Info) -> models.User:
+    viewer = info.context.user
+    if not viewer:
+        raise Exception("Not authenticated")
+    if user_id == viewer.id:
+        raise Exception("You cannot follow yourself")
+    target = info.context.db.query(models.User).filter(models.User.id == user_id).first()
+    if not target:
+        raise Exception(f"User with id {user_id} not found")
+    return target
+
+def resolve_follow_user(user_id: int, info: strawberry.Info) -> "User":
+    target = _follow_target(user_id, info)
+    viewer = info.context.user
+    if target not in viewer.following:
+        viewer.following.append(target)
+        info.context.db.commit()
+    return users.schemas.User.from_db_model(target)
+
+def resolve_unfollow_user(user_id: int, info: strawberry.Info) -> "User":
+    target = _follow_target(user_id, info)
+    viewer = info.context.user
+    if target in viewer.following:
+        viewer.following.remove(target)
+        info.context.db.commit()
+    return users.schemas.User.from_db_model(target)
+
+
 def resolve_login(
     input: Annotated["LoginInput", strawberry.lazy("users.schemas")],
     info: strawberry.Info
@@ -2,13 +2,17 @@ import strawberry
 from typing import Optional, List, TYPE_CHECKING, Annotated
 from datetime import datetime
 import users.resolvers as resolvers
+from cache_control import CacheControl, CacheScope
 
 if TYPE_CHECKING:
     from posts.schemas import Post
     from users.schemas import LoginInput, LoginResponse
 
-@strawberry.type
+# Users expose their email address, so responses containing them are never shared
+@strawberry.type(directives=[CacheControl(max_age=60, scope=CacheScope.PRIVATE)])
 class User:
+    __slots__ = ("id", "username", "email", "bio", "avatar_url", "created_at")
+
     id: int
     username: str
     email: Optional[str]
@@ -20,6 +24,7 @@ class User:
     posts: List[Annotated["Post", strawberry.lazy("posts.schemas")]] = strawberry.field(resolver=resolvers.get_posts_for_user)
     followers: List["User"] = strawberry.field(resolver=resolvers.get_followers)
     following: List["User"] = strawberry.field(resolver=resolvers.get_following)
+    viewer_follows: bool = strawberry.field(resolver=resolvers.get_viewer_follows)
 
     @staticmethod
     def from_db_model(user) -> "User":